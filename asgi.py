@@ -0,0 +1,17 @@
+"""
+ASGI entry point, served alongside run:app.
+
+LLM-bound endpoints are handled natively by AsyncRoutes so one worker keeps many Azure OpenAI calls in flight;
+every other route is served by the Flask application through asgiref's WSGI adapter.
+
+Usage:
+    gunicorn --bind=0.0.0.0:8000 --chdir . -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+from asgiref.wsgi import WsgiToAsgi
+
+from ask_viridium_ai.async_routes import AsyncRoutes
+from run import app as flask_app, main_routes
+
+async_routes = AsyncRoutes(main_routes)
+app = async_routes.asgi_app(WsgiToAsgi(flask_app))
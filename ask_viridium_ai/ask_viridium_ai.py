@@ -2,63 +2,182 @@
 AskViridium class is used to handle the query and get results.
 
 Usage:
-    from ask_viridium_ai import AskViridium
+    from ask_viridium_ai.ask_viridium_ai import get_ask_viridium
 
-    ask_vai = AskViridium()  # Initialize the AskViridium class
-    ans = ask_vai.query("Nitrogen, Cryogenic Liquid", "Matheson Tri-Gas, Inc.",
-                        "Heat Treatment, Hipping, Annealing and Tempering")  # Query the system with specific parameters
+    ask_vai = get_ask_viridium()  # Process-wide engine, built once per worker
+    outcome = ask_vai.query("Nitrogen, Cryogenic Liquid", "Matheson Tri-Gas, Inc.",
+                            "Heat Treatment, Hipping, Annealing and Tempering")  # Query the system with specific parameters
+    outcome.result  # The analysis returned by the LLM
 
-logs are stored in AppInsights and data.json
+The engine holds no per-query state, so a single instance is safely shared by all request threads.
+logs are stored in AppInsights and in the append-only record store (data_dump/data.jsonl)
 """
 
-import json
+import asyncio
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
 from typing import Optional
 
-from langchain.prompts import ChatPromptTemplate
 from langchain_core.utils.function_calling import convert_to_openai_function
 from langchain_openai import AzureChatOpenAI
-from openai import BadRequestError
+from openai import APITimeoutError, BadRequestError
 from langchain_core.output_parsers.openai_functions import JsonOutputFunctionsParser
 from langchain_community.callbacks import get_openai_callback
+from langchain_community.callbacks.openai_info import OpenAICallbackHandler
 import logging
 
 from global_constants import GlobalConstants  # Global constants used in the script
-from models import MaterialComposition, MaterialInfo  # Models for chemical composition and material information
+from models import MaterialAssessment, MaterialComposition, MaterialInfo  # Models of the LLM function calls
+from . import metrics  # Prometheus metrics served on /v1/metrics
+from .batch import QueryBatch  # Deduplication and caching for batch analyses
+from .cache import ResultCache, make_cache_key  # Cache of previous analyses shared by all workers
+from .circuit_breaker import CircuitBreaker, circuit_guarded, is_failure  # Fail fast while Azure OpenAI is failing
+from .coalescing import QueryCoalescer  # Single-flight sharing of identical queries in flight
+from .deadlines import DeadlinePolicy, deadline_bound  # End-to-end time budget of a query
+from .http_clients import build_http_clients, stage_timeout  # Connection pool of the LLM calls
+from .prescreen import PreScreen  # Rule-based decision of fluorine-free compositions
+from .prompts import build_prompt  # System prompts rendered once per process
+from .rate_limit import RateLimiter, rate_limited  # Quota of LLM calls shared by all workers
+from .reference import CasReference  # Known PFAS and non-PFAS CAS numbers
+from .similarity import SimilarityIndex  # Reuse of past analyses of near-identical material names
+from .speculation import Speculation  # Speculative analysis of materials recognizable by name
+from .storage import RecordStore  # Append-only store of query records
 from .tracking import AppInsightsConnector  # Logger for tracking and logging information
+from utils.exceptions import MaxProcessingTimeExceededException, RateLimitExceededException
 
 load_dotenv()
 
+QUERY_MODES = ("staged", "combined")  # Composition, then analysis; or both from a single LLM call
+
+
+@dataclass
+class QueryResult:
+    """Outcome of a single AskViridium query, kept off the shared engine so concurrent requests stay isolated."""
+    result: Optional[dict] = None  # Analysis returned by the LLM
+    chemical_composition: Optional[dict] = None  # Composition returned by the first LLM call
+    pfas: Optional[str] = None  # PFAS decision taken from the analysis
+    loginfo: dict = field(default_factory=dict)  # Record stored in the record store
+    cached: bool = False  # Whether the analysis was served from the result cache
+    coalesced: bool = False  # Whether the analysis was shared by a concurrent identical query
+    deadline_exceeded: bool = False  # Whether the deadline passed before the analysis finished
+    stale: bool = False  # Whether an expired cached analysis was served while Azure OpenAI was failing
+    failure: Optional[str] = None  # Why the analysis failed: deadline, unavailable (Azure failing) or None
+
 
 class AskViridium:
     def __init__(self):
         """Initialize the AskViridium class."""
         self.logger = AppInsightsConnector().get_logger()  # Initialize the logger
-        self.loginfo = dict()  # Dictionary to store log information
         self.constants = GlobalConstants()  # Initialize global constants
         self.model_name = self.constants.model_name  # Model name from constants GPT 4o
         self.deployment_name = self.constants.deployment_name  # Deployment name from constants
 
-        self.llm = AzureChatOpenAI(
+        # Long-lived connection pool shared by every LLM call of this worker
+        self.http_client, self.http_async_client = build_http_clients(self.constants.llm_http)
+        llm_settings = dict(
             deployment_name=self.deployment_name,
             temperature=0,
             max_tokens=800,
-            n=1
+            n=1,
+            request_timeout=stage_timeout(self.constants.llm_http, "default"),
+            http_client=self.http_client,
+            http_async_client=self.http_async_client
         )
+        # With the rate limiter on, every retry goes through it to reserve its share of the quota, not the SDK
+        sdk_retries = 0 if self.constants.rate_limit.enabled else self.constants.llm_http.max_retries
+        self.llm = AzureChatOpenAI(**llm_settings, max_retries=sdk_retries)
+        # Same model for the calls of queries with a deadline, which are retried only while the deadline allows
+        self.deadline_llm = AzureChatOpenAI(**llm_settings, max_retries=0)
 
         # Initialize prompts and functions
         self.cheminfo_prompt = self.prompt1_init()  # Prompt for chemical information
         self.analysis_prompt = self.prompt2_init()  # Prompt for analysis
-        self.cheminfo_function, self.analysis_function = self.openai_functions_creation()  # Create OpenAI functions
-        self.cheminfo_model, self.analysis_model = self.bind_function()  # Bind functions to models
+        self.combined_prompt = self.prompt3_init()  # Prompt for composition and analysis in a single call
+        # Create OpenAI functions and bind them to models
+        self.cheminfo_function, self.analysis_function, self.combined_function = self.openai_functions_creation()
+        self.cheminfo_model, self.analysis_model, self.combined_model = self.bind_function()
+        # Prompts and models of each stage for queries with a deadline, rebound per call with the time left
+        cheminfo_model, analysis_model, combined_model = self.bind_function(self.deadline_llm)
+        self.stages = {"composition": (self.cheminfo_prompt, cheminfo_model),
+                       "analysis": (self.analysis_prompt, analysis_model),
+                       "combined": (self.combined_prompt, combined_model)}
+
+        # Optional limiter queueing the LLM calls of all workers within the deployment's quota
+        rate_limit_config = self.constants.rate_limit
+        self.rate_limiter = RateLimiter(
+            rate_limit_config.path, rate_limit_config.requests_per_minute, rate_limit_config.tokens_per_minute,
+            rate_limit_config.max_wait, rate_limit_config.max_retries, rate_limit_config.backoff_seconds,
+            rate_limit_config.estimated_tokens) if rate_limit_config.enabled else None
+        if self.rate_limiter:
+            self.cheminfo_model = rate_limited(self.cheminfo_model, self.rate_limiter, "composition")
+            self.analysis_model = rate_limited(self.analysis_model, self.rate_limiter, "analysis")
+            self.combined_model = rate_limited(self.combined_model, self.rate_limiter, "combined")
+
+        # Optional breaker refusing the LLM calls of this worker while Azure OpenAI is failing
+        breaker_config = self.constants.circuit_breaker
+        self.circuit_breaker = CircuitBreaker(
+            breaker_config.failure_ratio, breaker_config.min_calls, breaker_config.window_seconds,
+            breaker_config.open_seconds, breaker_config.half_open_probes) if breaker_config.enabled else None
+        if self.circuit_breaker:  # Outermost, so a refused call does not wait for the rate limiter
+            self.cheminfo_model = circuit_guarded(self.cheminfo_model, self.circuit_breaker, "composition")
+            self.analysis_model = circuit_guarded(self.analysis_model, self.circuit_breaker, "analysis")
+            self.combined_model = circuit_guarded(self.combined_model, self.circuit_breaker, "combined")
+
         self.parser = JsonOutputFunctionsParser()  # Initialize JSON output parser
         self.cheminfo_chain = self.cheminfo_prompt | self.cheminfo_model | self.parser  # Chain for chemical info
         self.analysis_chain = self.analysis_prompt | self.analysis_model | self.parser  # Chain for analysis
-        self.chemical_composition = None  # Placeholder for chemical composition
-        self.pfas = None  # Placeholder for PFAS status
+        self.combined_chain = self.combined_prompt | self.combined_model | self.parser  # Chain for QUERY_MODE=combined
+        self.record_store = RecordStore(self.constants.record_store_path)  # Query records, safe across workers
+
+        # Time budget of each query, capping the timeouts of its LLM calls
+        deadline_config = self.constants.deadline
+        self.deadline_policy = DeadlinePolicy(deadline_config.default_seconds, deadline_config.max_seconds,
+                                              deadline_config.min_call_seconds)
+
+        # Cache of complete analyses keyed by the normalized query inputs
+        cache_config = self.constants.result_cache
+        self.result_cache = ResultCache(cache_config.path, cache_config.ttl_seconds, cache_config.max_entries,
+                                        cache_config.memory_entries, "result",
+                                        cache_config.stale_seconds) if cache_config.enabled else None
+        # Cache of chemical compositions keyed by the material alone, shared by every analysis of that material
+        cache_config = self.constants.composition_cache
+        self.composition_cache = ResultCache(
+            cache_config.path, cache_config.ttl_seconds, cache_config.max_entries, cache_config.memory_entries,
+            "composition") if cache_config.enabled else None
+
+        # Identical queries in flight at the same time share one run, optionally across workers
+        coalescing_config = self.constants.coalescing
+        self.coalescer = QueryCoalescer(
+            coalescing_config.path if coalescing_config.across_workers and self.result_cache else None,
+            coalescing_config.poll_interval, coalescing_config.lease_seconds) if coalescing_config.enabled else None
 
-        self.result = str()  # Placeholder for the result
+        # Optional reuse of the past analysis of a near-identical material name of the same manufacturer
+        similarity_config = self.constants.similarity
+        self.similarity_index = SimilarityIndex(
+            self.record_store, similarity_config.min_similarity, similarity_config.top_k,
+            similarity_config.max_postings, refresh_interval=similarity_config.refresh_interval
+        ) if similarity_config.enabled else None
+        if self.similarity_index:
+            self.similarity_index.start()
+
+        # Optional reference of CAS numbers deciding compositions made of known chemicals without the analysis call
+        reference_config = self.constants.cas_reference
+        self.cas_reference = CasReference.load(reference_config.path, reference_config.source) \
+            if reference_config.enabled else None
+        # Optional rule-based decision of compositions that cannot contain fluorine
+        self.prescreen = PreScreen(self.cas_reference) if self.constants.prescreen.enabled else None
+
+        # Optional analysis of recognizable materials alongside the composition call
+        speculation_config = self.constants.speculation
+        self.speculation = Speculation(speculation_config.max_words, speculation_config.min_similarity,
+                                       speculation_config.max_in_flight) if speculation_config.enabled else None
+        self.speculation_executor = ThreadPoolExecutor(
+            speculation_config.max_in_flight, thread_name_prefix="speculative-analysis"
+        ) if speculation_config.enabled else None
 
     def prompt1_init(self):
         """
@@ -67,14 +186,7 @@ class AskViridium:
         Returns:
             ChatPromptTemplate: The prompt template for finding chemical composition of the material provided.
         """
-        with open('ask_viridium_ai/system_prompt_templates/findchemicals_prompt.txt', 'r') as file:
-            cheminfo_system_prompt = file.read()
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", cheminfo_system_prompt),
-            ("human", "Material Name: {material}, manufacturer: {manufacturer}"),
-        ])
-        return prompt
+        return build_prompt("composition", self.constants.prompts.variant)
 
     def prompt2_init(self):
         """
@@ -83,115 +195,1069 @@ class AskViridium:
         Returns:
             ChatPromptTemplate: The prompt template for analysis.
         """
-        with open('ask_viridium_ai/system_prompt_templates/new_prompt.txt', 'r') as file:
-            analysis_system_prompt = file.read()
+        return build_prompt("analysis", self.constants.prompts.variant)
+
+    def prompt3_init(self):
+        """
+        Initialize the prompt for the chemical composition and the analysis in a single call.
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", analysis_system_prompt),
-            ("human",
-             "Material Name: {material}, manufactured by {manufacturer}. Its chemical composition is: {chemical_composition}.")
-        ])
-        return prompt
+        Returns:
+            ChatPromptTemplate: The prompt template for the combined call.
+        """
+        return build_prompt("combined", self.constants.prompts.variant)
 
     def openai_functions_creation(self):
         """
         Create OpenAI functions for chemical composition and analysis by converting Pydantic objects.
 
         Returns:
-            list: A list containing the chemical info function and analysis function.
+            list: A list containing the chemical info function, analysis function and combined function.
         """
         cheminfo_function = [convert_to_openai_function(MaterialComposition)]
 
         analysis_function = [convert_to_openai_function(MaterialInfo)]
-        return [cheminfo_function, analysis_function]
 
-    def bind_function(self):
+        combined_function = [convert_to_openai_function(MaterialAssessment)]
+        return [cheminfo_function, analysis_function, combined_function]
+
+    def bind_function(self, llm=None):
         """
         Bind functions to the LLM for function calling.
 
+        Args:
+            llm (Optional[AzureChatOpenAI]): The model to bind them to. Defaults to self.llm.
+
         Returns:
-            list: a list of models of material composition and of performing the PFAS analysis
+            list: a list of models of material composition, of performing the PFAS analysis and of both at once
         """
-        cheminfo_model = self.llm.bind_functions(
+        llm = llm or self.llm
+        cheminfo_model = llm.bind_functions(
             functions=self.cheminfo_function,
-            function_call={"name": "MaterialComposition"}
+            function_call={"name": "MaterialComposition"},
+            timeout=stage_timeout(self.constants.llm_http, "composition")
         )
         # Bind the analysis function to the LLM
-        analysis_model = self.llm.bind_functions(
+        analysis_model = llm.bind_functions(
             functions=self.analysis_function,
-            function_call={"name": "MaterialInfo"}
+            function_call={"name": "MaterialInfo"},
+            timeout=stage_timeout(self.constants.llm_http, "analysis")
         )
-        return [cheminfo_model, analysis_model]
+        # Bind the combined function to the LLM
+        combined_model = llm.bind_functions(
+            functions=self.combined_function,
+            function_call={"name": "MaterialAssessment"},
+            timeout=stage_timeout(self.constants.llm_http, "combined")
+        )
+        return [cheminfo_model, analysis_model, combined_model]
 
-    def query(self, material_name, manufacturer_name: Optional[str] = "Not Available",
-              work_content: Optional[str] = "Not Available"):
+    def cheminfo_inputs(self, material):
+        """Inputs of the chemical info chain for a material."""
+        return {"material": material}
+
+    def analysis_inputs(self, material, manufacturer, work_content, chemicals_list, additional_info=None):
+        """Inputs of the analysis chain for a material and its chemicals."""
+        return {"material": material, "manufacturer": manufacturer, "usecase": work_content,
+                "chemical_composition": chemicals_list, "additional_info": additional_info}
+
+    def combined_inputs(self, material, manufacturer):
+        """Inputs of the combined chain for a material."""
+        return {"material": material, "manufacturer": manufacturer}
+
+    def query_mode(self, mode=None):
         """
-        Handle the query and get results.
+        The mode of a query: the one requested, or QUERY_MODE.
 
         Args:
-            material_name (str): The name of the material.
-            manufacturer_name (Optional[str]): The name of the manufacturer. Defaults to "Not Available".
-            work_content (Optional[str]): The use case or context. Defaults to "Not Available".
+            mode (Optional[str]): staged or combined, None for the configured default.
 
         Returns:
-            str: The result of the analysis.
+            str: The mode.
         """
-        start = time.perf_counter()
+        mode = mode or self.constants.query_mode
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode {mode!r}, expected one of {QUERY_MODES}")
+        return mode
+
+    def stage_chain(self, stage, deadline=None):
+        """
+        The chain of a stage, with the timeout of its LLM call capped at the time left to a query's deadline.
+
+        Args:
+            stage (str): composition, analysis or combined.
+            deadline (Optional[Deadline]): The query's deadline, None for the chain with the stage's timeout.
+
+        Returns:
+            Runnable: The chain.
+        """
+        if deadline is None:
+            return {"composition": self.cheminfo_chain, "analysis": self.analysis_chain,
+                    "combined": self.combined_chain}[stage]
+        prompt, model = self.stages[stage]
+        model = deadline_bound(model, deadline, self.constants.llm_http, stage, retry=not self.rate_limiter)
+        if self.rate_limiter:
+            model = rate_limited(model, self.rate_limiter, stage, deadline)  # The timeout is set after the wait
+        if self.circuit_breaker:
+            model = circuit_guarded(model, self.circuit_breaker, stage)
+        return prompt | model | self.parser
+
+    def stage_ran_out_of_time(self, stage, error, deadline=None):
+        """
+        Record an LLM call that hit its timeout, or that the query's deadline did not leave time for.
+
+        Args:
+            stage (str): composition, analysis or combined.
+            error (Exception): APITimeoutError or MaxProcessingTimeExceededException.
+            deadline (Optional[Deadline]): The query's deadline.
+
+        Returns:
+            Optional[str]: deadline if the call failed because the query's deadline ran out, unavailable if it
+                hit its own timeout, as Azure OpenAI is then failing to answer.
+        """
+        self.logger.warning("The %s call ran out of time: %s", stage, error)
+        metrics.record_error(stage, error)
+        hung = isinstance(error, APITimeoutError) or isinstance(error.__cause__, TimeoutError)  # Cut mid-call
+        self.deadline_policy.count(stage, "timed_out" if hung else "aborted")
+        if isinstance(error, MaxProcessingTimeExceededException) or (deadline is not None and deadline.exhausted()):
+            return "deadline"
+        return "unavailable"
+
+    def out_of_time(self, stage, deadline):
+        """
+        Whether a query has too little time left to start the LLM call of a stage, recording it if so.
 
-        self.logger.info("Received query: Material=%s, Manufacturer=%s, Work Content=%s",
-                         material_name, manufacturer_name, work_content)
-        material = material_name
-        manufacturer = manufacturer_name
-        work_content = work_content
+        Args:
+            stage (str): composition, analysis or combined.
+            deadline (Optional[Deadline]): The query's deadline.
+
+        Returns:
+            bool: Whether the call should be skipped.
+        """
+        if deadline is None or not deadline.exhausted():
+            return False
+        self.stage_ran_out_of_time(stage, MaxProcessingTimeExceededException(
+            details=f"{deadline.remaining():.2f} s left of {deadline.budget:.0f} s, the {stage} call was not started"))
+        return True
+
+    def local_analysis(self, material, composition_stage):
+        """
+        Decide the PFAS status without the analysis call, from the CAS reference or the fluorine pre-screen.
+
+        Args:
+            material (str): The name of the material.
+            composition_stage (tuple): The return value of fetch_chemical_composition.
+
+        Returns:
+            tuple: The analysis stage, or None if the analysis call is needed, and the chemicals list to give it.
+        """
+        result, chemicals_list = None, composition_stage[1]
+        if self.cas_reference:
+            result, chemicals_list = self.cas_reference.resolve(material, composition_stage[0],
+                                                                self.constants.cas_reference.skip_analysis)
+            if result is not None:
+                self.logger.info("Decided %s from the CAS reference: PFAS=%s", material, result["decision"])
+        if result is None and self.prescreen:
+            result = self.prescreen.screen(material, composition_stage[0])
+            if result is not None:
+                self.logger.info("Decided %s by the fluorine pre-screen: PFAS=%s", material, result["decision"])
+        return ((result, 0, 0, None) if result is not None else None), chemicals_list
+
+    def cached_chemical_composition(self, material):
+        """
+        Look the chemical composition of a material up in the composition cache.
+
+        The composition only depends on the material, so it is cached independently of the analysis and reused
+        by queries that differ in manufacturer or work content.
+
+        Args:
+            material (str): The name of the material.
+
+        Returns:
+            Optional[tuple]: Same shape as fetch_chemical_composition, with the tokens and cost the composition took
+                when it was found, or None on a cache miss.
+        """
+        cached = self.composition_cache.get(make_cache_key(material)) if self.composition_cache else None
+        if cached is None:
+            return None
+        self.logger.info("Using cached chemical composition for %s", material)
+        self.composition_cache.record_saving(cached["tokens"], cached["cost"])
+        chemical_composition = cached["chemical_composition"]
+        return (chemical_composition, [chemical["name"] for chemical in chemical_composition["chemicals"]],
+                cached["tokens"], cached["cost"])
+
+    def composition_received(self, material, chemical_composition, cb):
+        """
+        Cache a chemical composition returned by the LLM.
+
+        Args:
+            material (str): The name of the material.
+            chemical_composition (dict): The composition returned by the chemical info chain.
+            cb (OpenAICallbackHandler): The callback that tracked the call.
+
+        Returns:
+            tuple: Same shape as fetch_chemical_composition.
+        """
+        self.logger.info("Chemical composition received for %s: %d chemicals", material,
+                         len(chemical_composition["chemicals"]))
+        self.logger.debug("Chemical composition: %s", chemical_composition)
+        chemicals_list = [chemical["name"] for chemical in chemical_composition["chemicals"]]
+        metrics.record_usage("composition", cb.total_tokens, cb.total_cost, cb.prompt_tokens, cb.completion_tokens)
+        if self.composition_cache:
+            self.composition_cache.set(make_cache_key(material), {"chemical_composition": chemical_composition,
+                                                                  "tokens": cb.total_tokens, "cost": cb.total_cost})
+        return chemical_composition, chemicals_list, cb.total_tokens, cb.total_cost
+
+    def fetch_chemical_composition(self, material, use_cache=True, deadline=None):
+        """
+        Run the first LLM call to find the chemical composition of the material, unless it is cached.
+
+        Args:
+            material (str): The name of the material.
+            use_cache (bool): Whether to look the composition cache up first. Defaults to True.
+            deadline (Optional[Deadline]): The query's deadline, capping the call's timeout.
+
+        Returns:
+            tuple: The chemical composition (None on failure), the list of chemical names, tokens used and cost,
+                those of the original call for a cached composition.
+        """
+        cached = self.cached_chemical_composition(material) if use_cache else None
+        if cached is not None:
+            return cached
 
         try:
-            with get_openai_callback() as cb:
+            with get_openai_callback() as cb, metrics.stage_timer("composition"):
                 # Invoke the chemical info chain and get the chemical composition
                 self.logger.info("Invoking chemical information chain")
-                self.chemical_composition = self.cheminfo_chain.invoke(
-                    {"material": material, "example": self.constants.chemical_composition_example})
-                self.logger.info("Chemical composition received: %s", self.chemical_composition)
-                chemicals_list = [chemical["name"] for chemical in self.chemical_composition["chemicals"]]
-                tokens_for_cheminfo = cb.total_tokens
-                cost_for_cheminfo = cb.total_cost
+                chemical_composition = self.stage_chain("composition", deadline).invoke(
+                    self.cheminfo_inputs(material))
+            return self.composition_received(material, chemical_composition, cb)
         except BadRequestError as e:
             self.logger.error("OpenAI BadRequestError during chemical composition retrieval: %s", e)
-            self.chemical_composition = None
-            chemicals_list = list()
-            tokens_for_cheminfo = 0
-            cost_for_cheminfo = 0
+            metrics.record_error("composition", e)
+        except RateLimitExceededException as e:
+            metrics.record_error("composition", e)
+            raise  # Answered with 429 or 503 instead of a null result
+        except (APITimeoutError, MaxProcessingTimeExceededException) as e:
+            self.stage_ran_out_of_time("composition", e)
         except Exception as e:
             self.logger.exception("Unexpected error during chemical composition retrieval: %s", e)
-            self.chemical_composition = None
-            chemicals_list = list()
-            tokens_for_cheminfo = 0
-            cost_for_cheminfo = 0
+            metrics.record_error("composition", e)
+        return None, list(), 0, 0
+
+    async def afetch_chemical_composition(self, material, use_cache=True, deadline=None):
+        """Async version of fetch_chemical_composition, awaiting the LLM instead of blocking the thread."""
+        cached = await asyncio.to_thread(self.cached_chemical_composition, material) if use_cache else None
+        if cached is not None:
+            return cached
 
-        # second llm call
         try:
-            with get_openai_callback() as cb:
+            with get_openai_callback() as cb, metrics.stage_timer("composition"):
+                self.logger.info("Invoking chemical information chain")
+                chemical_composition = await self.stage_chain("composition", deadline).ainvoke(
+                    self.cheminfo_inputs(material))
+            return await asyncio.to_thread(self.composition_received, material, chemical_composition, cb)
+        except BadRequestError as e:
+            self.logger.error("OpenAI BadRequestError during chemical composition retrieval: %s", e)
+            metrics.record_error("composition", e)
+        except RateLimitExceededException as e:
+            metrics.record_error("composition", e)
+            raise  # Answered with 429 or 503 instead of a null result
+        except (APITimeoutError, MaxProcessingTimeExceededException) as e:
+            self.stage_ran_out_of_time("composition", e)
+        except Exception as e:
+            self.logger.exception("Unexpected error during chemical composition retrieval: %s", e)
+            metrics.record_error("composition", e)
+        return None, list(), 0, 0
+
+    def run_analysis(self, material, manufacturer, work_content, chemicals_list, additional_info=None,
+                     deadline=None):
+        """
+        Run the second LLM call to decide the PFAS status of the material.
+
+        Args:
+            material (str): The name of the material.
+            manufacturer (str): The name of the manufacturer.
+            work_content (str): The use case or context.
+            chemicals_list (list): List of chemicals found in the material.
+            additional_info (Optional[str]): Additional information provided by the user.
+            deadline (Optional[Deadline]): The query's deadline. The call is not started if it has run out.
+
+        Returns:
+            tuple: The analysis result (None on failure), tokens used, cost and the kind of failure: deadline if
+                the query ran out of time, unavailable if Azure OpenAI is failing, None otherwise.
+        """
+        failure = None
+        try:
+            with get_openai_callback() as cb, metrics.stage_timer("analysis"):
                 # Invoke the analysis chain and get the analysis result
                 self.logger.info("Invoking analysis chain")
-                self.result = self.analysis_chain.invoke(
-                    {"material": material, "manufacturer": manufacturer, "usecase": work_content,
-                     "chemical_composition": chemicals_list, "example": self.constants.analysis_example,
-                     "additional_info": None})
-                self.logger.info("Analysis result received: %s", self.result)
-                tokens_for_analysis = cb.total_tokens
-                cost_for_analysis = cb.total_cost
-                self.pfas = self.result["decision"]
+                result = self.stage_chain("analysis", deadline).invoke(
+                    self.analysis_inputs(material, manufacturer, work_content, chemicals_list, additional_info))
+                self.logger.info("Analysis result received for %s: PFAS=%s", material, result.get("decision"))
+                self.logger.debug("Analysis result: %s", result)
+            metrics.record_usage("analysis", cb.total_tokens, cb.total_cost, cb.prompt_tokens, cb.completion_tokens)
+            return result, cb.total_tokens, cb.total_cost, None
         except BadRequestError as e:
             self.logger.error("OpenAI BadRequestError during analysis: %s", e)
-            self.pfas = None
-            tokens_for_analysis = 0
-            cost_for_analysis = 0
+            metrics.record_error("analysis", e)
+        except RateLimitExceededException as e:
+            metrics.record_error("analysis", e)
+            raise  # Answered with 429 or 503 instead of a null result
+        except (APITimeoutError, MaxProcessingTimeExceededException) as e:
+            failure = self.stage_ran_out_of_time("analysis", e, deadline)
         except Exception as e:
             self.logger.exception("Unexpected error during analysis: %s", e)
-            self.pfas = None
-            tokens_for_analysis = 0
-            cost_for_analysis = 0
+            metrics.record_error("analysis", e)
+            failure = "unavailable" if is_failure(e) else None
+        return None, 0, 0, failure
+
+    async def arun_analysis(self, material, manufacturer, work_content, chemicals_list, additional_info=None,
+                            deadline=None):
+        """Async version of run_analysis, awaiting the LLM instead of blocking the thread."""
+        failure = None
+        try:
+            with get_openai_callback() as cb, metrics.stage_timer("analysis"):
+                self.logger.info("Invoking analysis chain")
+                result = await self.stage_chain("analysis", deadline).ainvoke(
+                    self.analysis_inputs(material, manufacturer, work_content, chemicals_list, additional_info))
+                self.logger.info("Analysis result received for %s: PFAS=%s", material, result.get("decision"))
+                self.logger.debug("Analysis result: %s", result)
+            metrics.record_usage("analysis", cb.total_tokens, cb.total_cost, cb.prompt_tokens, cb.completion_tokens)
+            return result, cb.total_tokens, cb.total_cost, None
+        except BadRequestError as e:
+            self.logger.error("OpenAI BadRequestError during analysis: %s", e)
+            metrics.record_error("analysis", e)
+        except RateLimitExceededException as e:
+            metrics.record_error("analysis", e)
+            raise  # Answered with 429 or 503 instead of a null result
+        except (APITimeoutError, MaxProcessingTimeExceededException) as e:
+            failure = self.stage_ran_out_of_time("analysis", e, deadline)
+        except Exception as e:
+            self.logger.exception("Unexpected error during analysis: %s", e)
+            metrics.record_error("analysis", e)
+            failure = "unavailable" if is_failure(e) else None
+        return None, 0, 0, failure
+
+    def combined_received(self, material, assessment, cb):
+        """
+        Split the answer of the combined call into a composition stage and an analysis stage.
+
+        The composition is cached like one returned by the chemical info chain, so later queries of the material
+        reuse it. A single call cannot be split, so its tokens and cost are all counted for the analysis.
+
+        Args:
+            material (str): The name of the material.
+            assessment (dict): The MaterialAssessment returned by the combined chain.
+            cb (OpenAICallbackHandler): The callback that tracked the call.
+
+        Returns:
+            tuple: The composition stage, as returned by fetch_chemical_composition, and the analysis stage, as
+                returned by run_analysis.
+        """
+        chemical_composition, result = assessment["chemical_composition"], assessment["analysis"]
+        chemicals_list = [chemical["name"] for chemical in chemical_composition["chemicals"]]
+        self.logger.info("Combined result received for %s: %d chemicals, PFAS=%s", material, len(chemicals_list),
+                         result.get("decision"))
+        self.logger.debug("Combined result: %s", assessment)
+        metrics.record_usage("combined", cb.total_tokens, cb.total_cost, cb.prompt_tokens, cb.completion_tokens)
+        if self.composition_cache:
+            self.composition_cache.set(make_cache_key(material), {"chemical_composition": chemical_composition,
+                                                                  "tokens": 0, "cost": 0})
+        return (chemical_composition, chemicals_list, 0, 0), (result, cb.total_tokens, cb.total_cost, None)
+
+    def run_combined(self, material, manufacturer, deadline=None):
+        """
+        Run a single LLM call finding both the chemical composition and the PFAS status of the material.
+
+        Args:
+            material (str): The name of the material.
+            manufacturer (str): The name of the manufacturer.
+            deadline (Optional[Deadline]): The query's deadline, capping the call's timeout.
+
+        Returns:
+            tuple: The composition stage and the analysis stage, with None results on failure.
+        """
+        failure = None
+        try:
+            with get_openai_callback() as cb, metrics.stage_timer("combined"):
+                self.logger.info("Invoking combined chain")
+                assessment = self.stage_chain("combined", deadline).invoke(
+                    self.combined_inputs(material, manufacturer))
+            return self.combined_received(material, assessment, cb)
+        except BadRequestError as e:
+            self.logger.error("OpenAI BadRequestError during combined analysis: %s", e)
+            metrics.record_error("combined", e)
+        except RateLimitExceededException as e:
+            metrics.record_error("combined", e)
+            raise  # Answered with 429 or 503 instead of a null result
+        except (APITimeoutError, MaxProcessingTimeExceededException) as e:
+            failure = self.stage_ran_out_of_time("combined", e, deadline)
+        except Exception as e:
+            self.logger.exception("Unexpected error during combined analysis: %s", e)
+            metrics.record_error("combined", e)
+            failure = "unavailable" if is_failure(e) else None
+        return (None, list(), 0, 0), (None, 0, 0, failure)
+
+    async def arun_combined(self, material, manufacturer, deadline=None):
+        """Async version of run_combined, awaiting the LLM instead of blocking the thread."""
+        failure = None
+        try:
+            with get_openai_callback() as cb, metrics.stage_timer("combined"):
+                self.logger.info("Invoking combined chain")
+                assessment = await self.stage_chain("combined", deadline).ainvoke(
+                    self.combined_inputs(material, manufacturer))
+            return await asyncio.to_thread(self.combined_received, material, assessment, cb)
+        except BadRequestError as e:
+            self.logger.error("OpenAI BadRequestError during combined analysis: %s", e)
+            metrics.record_error("combined", e)
+        except RateLimitExceededException as e:
+            metrics.record_error("combined", e)
+            raise  # Answered with 429 or 503 instead of a null result
+        except (APITimeoutError, MaxProcessingTimeExceededException) as e:
+            failure = self.stage_ran_out_of_time("combined", e, deadline)
+        except Exception as e:
+            self.logger.exception("Unexpected error during combined analysis: %s", e)
+            metrics.record_error("combined", e)
+            failure = "unavailable" if is_failure(e) else None
+        return (None, list(), 0, 0), (None, 0, 0, failure)
+
+    def query(self, material_name, manufacturer_name: Optional[str] = "Not Available",
+              work_content: Optional[str] = "Not Available", mode: Optional[str] = None,
+              deadline_seconds: Optional[float] = None):
+        """
+        Handle the query and get results.
+
+        Args:
+            material_name (str): The name of the material.
+            manufacturer_name (Optional[str]): The name of the manufacturer. Defaults to "Not Available".
+            work_content (Optional[str]): The use case or context. Defaults to "Not Available".
+            mode (Optional[str]): staged or combined. Defaults to QUERY_MODE.
+            deadline_seconds (Optional[float]): Time budget of the query. Defaults to REQUEST_DEADLINE_SECONDS.
+
+        Returns:
+            QueryResult: The result of the analysis along with the composition and the stored record.
+        """
+        for stage, payload in self.stream_query(material_name, manufacturer_name, work_content, mode,
+                                                deadline_seconds):
+            if stage == "analysis":
+                return payload
+
+    async def aquery(self, material_name, manufacturer_name: Optional[str] = "Not Available",
+                     work_content: Optional[str] = "Not Available", mode: Optional[str] = None,
+                     deadline_seconds: Optional[float] = None):
+        """
+        Async version of query for the ASGI entry point.
+
+        Args:
+            material_name (str): The name of the material.
+            manufacturer_name (Optional[str]): The name of the manufacturer. Defaults to "Not Available".
+            work_content (Optional[str]): The use case or context. Defaults to "Not Available".
+            mode (Optional[str]): staged or combined. Defaults to QUERY_MODE.
+            deadline_seconds (Optional[float]): Time budget of the query. Defaults to REQUEST_DEADLINE_SECONDS.
+
+        Returns:
+            QueryResult: The result of the analysis along with the composition and the stored record.
+        """
+        async for stage, payload in self.astream_query(material_name, manufacturer_name, work_content, mode,
+                                                       deadline_seconds):
+            if stage == "analysis":
+                return payload
+
+    def stream_query(self, material_name, manufacturer_name: Optional[str] = "Not Available",
+                     work_content: Optional[str] = "Not Available", mode: Optional[str] = None,
+                     deadline_seconds: Optional[float] = None):
+        """
+        Handle the query, yielding each stage as soon as it finishes.
+
+        Args:
+            material_name (str): The name of the material.
+            manufacturer_name (Optional[str]): The name of the manufacturer. Defaults to "Not Available".
+            work_content (Optional[str]): The use case or context. Defaults to "Not Available".
+            mode (Optional[str]): staged or combined. Defaults to QUERY_MODE.
+            deadline_seconds (Optional[float]): Time budget of the query. Defaults to REQUEST_DEADLINE_SECONDS.
 
-        self.loginfo = {
+        Yields:
+            tuple: ("composition", the chemical composition or None), then ("analysis", QueryResult).
+        """
+        start = time.perf_counter()
+        mode = self.query_mode(mode)
+        deadline = self.deadline_policy.start(start, deadline_seconds)
+
+        self.logger.info("Received query: Material=%s, Manufacturer=%s, Work Content=%s, Mode=%s, Deadline=%.0fs",
+                         material_name, manufacturer_name, work_content, mode, deadline.budget)
+
+        cache_key = make_cache_key(material_name, manufacturer_name, work_content)
+        outcome = self.cached_query(start, cache_key, material_name, manufacturer_name)
+        if outcome is None:
+            outcome = self.similar_query(start, material_name, manufacturer_name)
+        if outcome is None:
+            outcome = self.stale_query(start, cache_key, material_name, manufacturer_name)
+        if outcome is not None:
+            yield "composition", outcome.chemical_composition
+            yield "analysis", outcome
+            return
+
+        flight = self.coalescer.join(cache_key) if self.coalescer else None
+        if flight is not None and not flight.leader:
+            outcome = self.follow_flight(start, flight, material_name, manufacturer_name, deadline)
+            if outcome is not None:
+                yield "composition", outcome.chemical_composition
+                yield "analysis", outcome
+                return
+            flight = None  # The leader gave up, so this query runs on its own
+        if flight is None:
+            yield from self.run_stages(start, cache_key, material_name, manufacturer_name, work_content, mode,
+                                       deadline)
+            return
+
+        with self.coalescer.lead(flight) as resolve:
+            if flight.remote:  # Another worker runs this query and caches its outcome
+                if not self.coalescer.wait_remote(flight, deadline):
+                    outcome = self.flight_out_of_time(start, material_name, manufacturer_name, deadline)
+                    yield "composition", outcome.chemical_composition
+                    yield "analysis", outcome
+                    return
+                outcome = self.cached_query(start, cache_key, material_name, manufacturer_name)
+                if outcome is not None:
+                    self.coalescer.count("joined_remote")
+                    resolve(outcome)
+                    yield "composition", outcome.chemical_composition
+                    yield "analysis", outcome
+                    return
+            for stage, payload in self.run_stages(start, cache_key, material_name, manufacturer_name,
+                                                  work_content, mode, deadline):
+                if stage == "analysis":  # Hand the outcome to the joined requests before the caller resumes
+                    resolve(None if payload.deadline_exceeded else payload)  # Cut short by this query's budget
+                yield stage, payload
+
+    def run_stages(self, start, cache_key, material_name, manufacturer_name, work_content, mode="staged",
+                   deadline=None):
+        """
+        Run both LLM stages of a query that missed the result cache, yielding each as soon as it finishes.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            cache_key (str): The normalized query key.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+            work_content (str): The use case or context.
+            mode (str): staged or combined. A combined query makes a single call for both stages, unless the
+                composition is cached and the analysis call is all that is left.
+            deadline (Optional[Deadline]): The query's deadline, capping the timeouts of both stages. The
+                analysis call is not started once it has run out.
+
+        Yields:
+            tuple: ("composition", the chemical composition or None), then ("analysis", QueryResult).
+        """
+        composition_stage = self.cached_chemical_composition(material_name)
+        composition_reused = composition_stage is not None  # Paid for by an earlier query
+        if composition_stage is None and mode == "combined":
+            composition_stage, analysis_stage = self.run_combined(material_name, manufacturer_name, deadline)
+            yield "composition", composition_stage[0]
+            yield "analysis", self.complete_query(start, cache_key, material_name, manufacturer_name,
+                                                  composition_stage, analysis_stage, mode, deadline)
+            return
+
+        speculative = None
+        if composition_stage is None:
+            speculative = self.start_speculative_analysis(material_name, manufacturer_name, work_content, deadline)
+            composition_stage = self.fetch_chemical_composition(material_name, use_cache=False, deadline=deadline)
+        yield "composition", composition_stage[0]
+
+        # second llm call, unless decided locally or the speculative one already ran on a matching composition
+        analysis_stage, chemicals_list = self.local_analysis(material_name, composition_stage)
+        if speculative and analysis_stage is not None:
+            self.discard_speculative_analysis(speculative)
+        elif speculative:
+            analysis_stage = self.settle_speculative_analysis(speculative, composition_stage[1])
+        if analysis_stage is None and self.out_of_time("analysis", deadline):
+            analysis_stage = None, 0, 0, "deadline"
+        if analysis_stage is None:
+            analysis_stage = self.run_analysis(material_name, manufacturer_name, work_content, chemicals_list,
+                                               deadline=deadline)
+
+        yield "analysis", self.complete_query(start, cache_key, material_name, manufacturer_name, composition_stage,
+                                              analysis_stage, mode, deadline, composition_reused)
+
+    async def astream_query(self, material_name, manufacturer_name: Optional[str] = "Not Available",
+                            work_content: Optional[str] = "Not Available", mode: Optional[str] = None,
+                            deadline_seconds: Optional[float] = None):
+        """
+        Async version of stream_query.
+
+        Both LLM calls are awaited, so one event loop keeps many queries in flight. Cache and record store
+        access runs in a worker thread to keep SQLite and file locks off the loop.
+
+        Args:
+            material_name (str): The name of the material.
+            manufacturer_name (Optional[str]): The name of the manufacturer. Defaults to "Not Available".
+            work_content (Optional[str]): The use case or context. Defaults to "Not Available".
+            mode (Optional[str]): staged or combined. Defaults to QUERY_MODE.
+            deadline_seconds (Optional[float]): Time budget of the query. Defaults to REQUEST_DEADLINE_SECONDS.
+
+        Yields:
+            tuple: ("composition", the chemical composition or None), then ("analysis", QueryResult).
+        """
+        start = time.perf_counter()
+        mode = self.query_mode(mode)
+        deadline = self.deadline_policy.start(start, deadline_seconds)
+
+        self.logger.info("Received query: Material=%s, Manufacturer=%s, Work Content=%s, Mode=%s, Deadline=%.0fs",
+                         material_name, manufacturer_name, work_content, mode, deadline.budget)
+
+        cache_key = make_cache_key(material_name, manufacturer_name, work_content)
+        outcome = await asyncio.to_thread(self.cached_query, start, cache_key, material_name, manufacturer_name)
+        if outcome is None and self.similarity_index:
+            outcome = await asyncio.to_thread(self.similar_query, start, material_name, manufacturer_name)
+        if outcome is None and self.circuit_breaker:
+            outcome = await asyncio.to_thread(self.stale_query, start, cache_key, material_name, manufacturer_name)
+        if outcome is not None:
+            yield "composition", outcome.chemical_composition
+            yield "analysis", outcome
+            return
+
+        flight = await asyncio.to_thread(self.coalescer.join, cache_key) if self.coalescer else None
+        if flight is not None and not flight.leader:
+            outcome = await self.afollow_flight(start, flight, material_name, manufacturer_name, deadline)
+            if outcome is not None:
+                yield "composition", outcome.chemical_composition
+                yield "analysis", outcome
+                return
+            flight = None
+        if flight is None:
+            async for stage, payload in self.arun_stages(start, cache_key, material_name, manufacturer_name,
+                                                         work_content, mode, deadline):
+                yield stage, payload
+            return
+
+        async with self.coalescer.alead(flight) as resolve:
+            if flight.remote:
+                if not await self.coalescer.await_remote(flight, deadline):
+                    outcome = await asyncio.to_thread(self.flight_out_of_time, start, material_name,
+                                                      manufacturer_name, deadline)
+                    yield "composition", outcome.chemical_composition
+                    yield "analysis", outcome
+                    return
+                outcome = await asyncio.to_thread(self.cached_query, start, cache_key, material_name,
+                                                  manufacturer_name)
+                if outcome is not None:
+                    self.coalescer.count("joined_remote")
+                    await resolve(outcome)
+                    yield "composition", outcome.chemical_composition
+                    yield "analysis", outcome
+                    return
+            async for stage, payload in self.arun_stages(start, cache_key, material_name, manufacturer_name,
+                                                         work_content, mode, deadline):
+                if stage == "analysis":
+                    await resolve(None if payload.deadline_exceeded else payload)
+                yield stage, payload
+
+    async def arun_stages(self, start, cache_key, material_name, manufacturer_name, work_content, mode="staged",
+                          deadline=None):
+        """Async version of run_stages."""
+        composition_stage = await asyncio.to_thread(self.cached_chemical_composition, material_name)
+        composition_reused = composition_stage is not None
+        if composition_stage is None and mode == "combined":
+            composition_stage, analysis_stage = await self.arun_combined(material_name, manufacturer_name, deadline)
+            yield "composition", composition_stage[0]
+            yield "analysis", await asyncio.to_thread(self.complete_query, start, cache_key, material_name,
+                                                      manufacturer_name, composition_stage, analysis_stage, mode,
+                                                      deadline)
+            return
+
+        speculative = None
+        if composition_stage is None:
+            speculative = self.astart_speculative_analysis(material_name, manufacturer_name, work_content, deadline)
+            composition_stage = await self.afetch_chemical_composition(material_name, use_cache=False,
+                                                                       deadline=deadline)
+        yield "composition", composition_stage[0]
+
+        analysis_stage, chemicals_list = self.local_analysis(material_name, composition_stage)
+        if speculative and analysis_stage is not None:
+            self.adiscard_speculative_analysis(speculative)
+        elif speculative:
+            analysis_stage = await self.asettle_speculative_analysis(speculative, composition_stage[1])
+        if analysis_stage is None and self.out_of_time("analysis", deadline):
+            analysis_stage = None, 0, 0, "deadline"
+        if analysis_stage is None:
+            analysis_stage = await self.arun_analysis(material_name, manufacturer_name, work_content, chemicals_list,
+                                                      deadline=deadline)
+
+        yield "analysis", await asyncio.to_thread(self.complete_query, start, cache_key, material_name,
+                                                  manufacturer_name, composition_stage, analysis_stage, mode,
+                                                  deadline, composition_reused)
+
+    def start_speculative_analysis(self, material, manufacturer, work_content, deadline=None):
+        """
+        Start the analysis in the background on a composition guessed from the material name.
+
+        Args:
+            material (str): The name of the material.
+            manufacturer (str): The name of the manufacturer.
+            work_content (str): The use case or context.
+            deadline (Optional[Deadline]): The query's deadline, capping the call's timeout.
+
+        Returns:
+            Optional[tuple]: The guessed chemicals and the Future of run_analysis, or None if not speculating.
+        """
+        guessed = self.speculation.guess(material) if self.speculation else None
+        if guessed is None or not self.speculation.acquire():
+            return None
+        self.logger.info("Starting speculative analysis of %s as %s", material, guessed)
+        future = self.speculation_executor.submit(self.run_analysis, material, manufacturer, work_content, guessed,
+                                                  deadline=deadline)
+        future.add_done_callback(lambda _: self.speculation.release())
+        return guessed, future
+
+    def settle_speculative_analysis(self, speculative, chemicals_list):
+        """
+        Keep the speculative analysis if the fetched composition matches the guess.
+
+        Args:
+            speculative (tuple): The value returned by start_speculative_analysis.
+            chemicals_list (list): The chemicals returned by the composition call.
+
+        Returns:
+            Optional[tuple]: The analysis stage, or None if the analysis has to run on the fetched composition.
+        """
+        guessed, future = speculative
+        if self.speculation.matches(guessed, chemicals_list):
+            analysis_stage = future.result()
+            if analysis_stage[0] is not None:
+                self.speculation.count("accepted")
+                return analysis_stage
+        self.logger.info("Discarding speculative analysis: guessed %s, found %s", guessed, chemicals_list)
+        self.discard_speculative_analysis(speculative)
+        return None
+
+    def discard_speculative_analysis(self, speculative):
+        """Drop a speculative analysis; the call cannot be interrupted, so its tokens count as wasted once done."""
+        _, future = speculative
+        future.add_done_callback(lambda done: self.speculation.count(
+            "discarded", *(done.result()[1:3] if done.exception() is None else ())))
+
+    def astart_speculative_analysis(self, material, manufacturer, work_content, deadline=None):
+        """Async version of start_speculative_analysis, running the analysis as a task on the event loop."""
+        guessed = self.speculation.guess(material) if self.speculation else None
+        if guessed is None or not self.speculation.acquire():
+            return None
+        self.logger.info("Starting speculative analysis of %s as %s", material, guessed)
+        task = asyncio.create_task(self.arun_analysis(material, manufacturer, work_content, guessed,
+                                                      deadline=deadline))
+        task.add_done_callback(lambda _: self.speculation.release())
+        return guessed, task
+
+    async def asettle_speculative_analysis(self, speculative, chemicals_list):
+        """Async version of settle_speculative_analysis; a discarded analysis is cancelled mid-call."""
+        guessed, task = speculative
+        if self.speculation.matches(guessed, chemicals_list):
+            analysis_stage = await task
+            if analysis_stage[0] is not None:
+                self.speculation.count("accepted")
+                return analysis_stage
+        self.logger.info("Discarding speculative analysis: guessed %s, found %s", guessed, chemicals_list)
+        self.adiscard_speculative_analysis(speculative)
+        return None
+
+    def adiscard_speculative_analysis(self, speculative):
+        """Async version of discard_speculative_analysis, cancelling the analysis mid-call."""
+        _, task = speculative
+        task.cancel()
+        self.speculation.count("discarded", *(task.result()[1:3] if task.done() and not task.cancelled()
+                                              and task.exception() is None else ()))
+
+    def batch_config(self, inputs, max_concurrency):
+        """Per-input configs giving every call of a batch its own token/cost tracker."""
+        callbacks = [OpenAICallbackHandler() for _ in inputs]
+        return [{"callbacks": [cb], "max_concurrency": max_concurrency} for cb in callbacks], callbacks
+
+    def run_batch(self, chain, inputs, max_concurrency):
+        """
+        Run a chain over many inputs with bounded concurrency.
+
+        Args:
+            chain (Runnable): The chain to run.
+            inputs (list): The chain inputs.
+            max_concurrency (int): Maximum number of calls in flight.
+
+        Returns:
+            tuple: The outputs (exceptions for failed calls) and the callback that tracked each call.
+        """
+        if not inputs:
+            return list(), list()
+        configs, callbacks = self.batch_config(inputs, max_concurrency)
+        return chain.batch(inputs, config=configs, return_exceptions=True), callbacks
+
+    async def arun_batch(self, chain, inputs, max_concurrency):
+        """Async version of run_batch."""
+        if not inputs:
+            return list(), list()
+        configs, callbacks = self.batch_config(inputs, max_concurrency)
+        return await chain.abatch(inputs, config=configs, return_exceptions=True), callbacks
+
+    def query_batch(self, items, max_concurrency):
+        """
+        Analyse many materials at once.
+
+        Identical items are analysed once, cached analyses and compositions are reused, and the remaining LLM
+        calls of each stage run through the chain's batch with bounded concurrency.
+
+        Args:
+            items (list): Dicts with material_name and optional manufacturer_name and work_content. Invalid
+                items carry an "error" message and are reported back without being analysed.
+            max_concurrency (int): Maximum number of LLM calls in flight.
+
+        Returns:
+            tuple: Per-item results in submission order and aggregate totals (tokens, cost, cached, failed).
+        """
+        self.logger.info("Received batch of %d materials", len(items))
+        batch = QueryBatch(self, items)
+
+        materials = batch.materials_to_look_up()
+        batch.add_compositions(materials, *self.run_batch(
+            self.cheminfo_chain, [self.cheminfo_inputs(material) for material in materials], max_concurrency))
+
+        pending = batch.queries_to_analyse()
+        batch.add_analyses(pending, *self.run_batch(
+            self.analysis_chain, [inputs for _, inputs in pending], max_concurrency))
+
+        return batch.response()
+
+    async def aquery_batch(self, items, max_concurrency):
+        """Async version of query_batch, awaiting the chains' abatch."""
+        self.logger.info("Received batch of %d materials", len(items))
+        batch = await asyncio.to_thread(QueryBatch, self, items)
+
+        materials = await asyncio.to_thread(batch.materials_to_look_up)
+        outputs, callbacks = await self.arun_batch(
+            self.cheminfo_chain, [self.cheminfo_inputs(material) for material in materials], max_concurrency)
+        await asyncio.to_thread(batch.add_compositions, materials, outputs, callbacks)
+
+        pending = await asyncio.to_thread(batch.queries_to_analyse)
+        outputs, callbacks = await self.arun_batch(
+            self.analysis_chain, [inputs for _, inputs in pending], max_concurrency)
+        await asyncio.to_thread(batch.add_analyses, pending, outputs, callbacks)
+
+        return batch.response()
+
+    def cached_query(self, start, cache_key, material_name, manufacturer_name):
+        """
+        Serve a query from the result cache, recording it like any other query.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            cache_key (str): The normalized query key.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+
+        Returns:
+            Optional[QueryResult]: The cached outcome, or None on a cache miss.
+        """
+        cached = self.result_cache.get(cache_key) if self.result_cache else None
+        if cached is None:
+            return None
+
+        self.logger.info("Serving cached analysis for %s", material_name)
+        self.result_cache.record_saving(cached["tokens"], cached["cost"])
+        loginfo = self.build_loginfo(start, material_name, manufacturer_name, cached["chemical_composition"],
+                                     cached["result"], cached=True)
+        self.store(loginfo)
+        metrics.QUERY_DURATION.labels("true").observe(loginfo["duration"])
+        return QueryResult(result=cached["result"], chemical_composition=cached["chemical_composition"],
+                           pfas=cached["pfas"], loginfo=loginfo, cached=True)
+
+    def similar_query(self, start, material_name, manufacturer_name):
+        """
+        Serve a query from the past analysis of a near-identical material name of the same manufacturer.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+
+        Returns:
+            Optional[QueryResult]: The reused outcome, or None if no past analysis is similar enough.
+        """
+        match = self.similarity_index.lookup(material_name, manufacturer_name) if self.similarity_index else None
+        if match is None:
+            return None
+
+        record, similarity = match
+        self.logger.info("Reusing the analysis of %s for %s (similarity %.3f)", record["material"], material_name,
+                         similarity)
+        metrics.CACHE_SAVED_TOKENS.labels("similarity").inc(
+            record.get("tokens_used_for_chemical_composition", 0) + record.get("tokens_used_for_analysis", 0))
+        metrics.CACHE_SAVED_COST.labels("similarity").inc(record.get("total_cost", 0))
+        loginfo = self.build_loginfo(start, material_name, manufacturer_name, record.get("chemical_composition"),
+                                     record["result"], cached=True, similar_to=record["material"])
+        self.store(loginfo)
+        metrics.QUERY_DURATION.labels("true").observe(loginfo["duration"])
+        return QueryResult(result=record["result"], chemical_composition=record.get("chemical_composition"),
+                           pfas=record["result"]["decision"], loginfo=loginfo, cached=True)
+
+    def stale_query(self, start, cache_key, material_name, manufacturer_name):
+        """
+        Serve a query while the circuit breaker refuses LLM calls, from the result cache even if expired.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            cache_key (str): The normalized query key.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+
+        Returns:
+            Optional[QueryResult]: The stale outcome, or None if the breaker lets LLM calls through.
+
+        Raises:
+            CircuitOpenException: If the breaker refuses LLM calls and the query has no cached analysis.
+        """
+        if not self.circuit_breaker or not self.circuit_breaker.rejecting():
+            return None
+        cached = self.result_cache.get_stale(cache_key) if self.result_cache else None
+        if cached is None:
+            raise self.circuit_breaker.refusal()  # Answered with 503 and Retry-After
+
+        self.logger.warning("Azure OpenAI is failing, serving a stale analysis for %s", material_name)
+        self.circuit_breaker.count("stale_served")
+        loginfo = self.build_loginfo(start, material_name, manufacturer_name, cached["chemical_composition"],
+                                     cached["result"], cached=True, stale=True)
+        self.store(loginfo)
+        metrics.QUERY_DURATION.labels("true").observe(loginfo["duration"])
+        return QueryResult(result=cached["result"], chemical_composition=cached["chemical_composition"],
+                           pfas=cached["pfas"], loginfo=loginfo, cached=True, stale=True)
+
+    def follow_flight(self, start, flight, material_name, manufacturer_name, deadline=None):
+        """
+        Wait for the query a concurrent request is running for the same key, recording it like any other query.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            flight (Flight): The flight joined.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+            deadline (Optional[Deadline]): This query's deadline, ending the wait once it passes.
+
+        Returns:
+            Optional[QueryResult]: The leader's outcome, None if the leader gave up before finishing, or an
+                outcome without a result if the deadline passed first.
+        """
+        try:
+            outcome = flight.future.result(timeout=deadline.remaining() if deadline else None)
+        except TimeoutError:  # The leader is still running
+            return self.flight_out_of_time(start, material_name, manufacturer_name, deadline)
+        return self.coalesced_query(start, outcome, material_name, manufacturer_name)
+
+    async def afollow_flight(self, start, flight, material_name, manufacturer_name, deadline=None):
+        """Async version of follow_flight, awaiting the leader instead of blocking the thread."""
+        try:  # Shielded, as cancelling the wrapper would cancel the flight for every request that joined it
+            outcome = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight.future)),
+                                             deadline.remaining() if deadline else None)
+        except TimeoutError:
+            return await asyncio.to_thread(self.flight_out_of_time, start, material_name, manufacturer_name,
+                                           deadline)
+        return await asyncio.to_thread(self.coalesced_query, start, outcome, material_name, manufacturer_name)
+
+    def flight_out_of_time(self, start, material_name, manufacturer_name, deadline):
+        """Record a query whose deadline passed while it waited for the identical query in flight."""
+        self.logger.warning("Deadline of %.0f s exceeded for %s while waiting for the identical query in flight",
+                            deadline.budget, material_name)
+        self.deadline_policy.count("query", "exceeded")
+        loginfo = self.build_loginfo(start, material_name, manufacturer_name, None, None, coalesced=True,
+                                     deadline_exceeded=True)
+        self.store(loginfo)
+        metrics.QUERY_DURATION.labels("false").observe(loginfo["duration"])
+        return QueryResult(loginfo=loginfo, coalesced=True, deadline_exceeded=True, failure="deadline")
+
+    def coalesced_query(self, start, outcome, material_name, manufacturer_name):
+        """Record a query that received the outcome of a concurrent identical query."""
+        if outcome is None:
+            return None
+        self.logger.info("Sharing the in-flight analysis of %s", material_name)
+        loginfo = self.build_loginfo(start, material_name, manufacturer_name, outcome.chemical_composition,
+                                     outcome.result, cached=outcome.cached, coalesced=True,
+                                     deadline_exceeded=outcome.deadline_exceeded)
+        self.store(loginfo)
+        metrics.QUERY_DURATION.labels("true").observe(loginfo["duration"])
+        return QueryResult(result=outcome.result, chemical_composition=outcome.chemical_composition,
+                           pfas=outcome.pfas, loginfo=loginfo, cached=outcome.cached, coalesced=True,
+                           deadline_exceeded=outcome.deadline_exceeded, failure=outcome.failure)
+
+    def complete_query(self, start, cache_key, material_name, manufacturer_name, composition_stage, analysis_stage,
+                       mode="staged", deadline=None, composition_reused=False):
+        """
+        Record the outcome of both LLM stages and cache it when the analysis succeeded.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            cache_key (str): The normalized query key.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+            composition_stage (tuple): The return value of fetch_chemical_composition.
+            analysis_stage (tuple): The return value of run_analysis.
+            mode (str): staged or combined.
+            deadline (Optional[Deadline]): The query's deadline. A query whose analysis failed because it ran out
+                is marked as having exceeded it, and answered with its composition alone.
+            composition_reused (bool): Whether the composition was paid for by an earlier query. It is not charged
+                to this one, but its cost is still cached with the analysis, as a later hit saves it too.
+
+        Returns:
+            QueryResult: The outcome of the query.
+        """
+        chemical_composition, _, composition_tokens, composition_cost = composition_stage
+        tokens_for_cheminfo, cost_for_cheminfo = (0, 0) if composition_reused else composition_stage[2:]
+        result, tokens_for_analysis, cost_for_analysis, failure = analysis_stage
+        pfas = result["decision"] if result else None
+
+        deadline_exceeded = result is None and failure == "deadline"
+        if deadline_exceeded:
+            self.logger.warning("Deadline of %.0f s exceeded for %s, %s", deadline.budget, material_name,
+                                "returning the composition alone" if chemical_composition else "without a result")
+            self.deadline_policy.count("query", "exceeded")
+            if chemical_composition:
+                self.deadline_policy.count("query", "partial")
+
+        loginfo = self.build_loginfo(start, material_name, manufacturer_name, chemical_composition, result,
+                                     tokens_for_cheminfo, tokens_for_analysis, cost_for_cheminfo, cost_for_analysis,
+                                     mode=mode, deadline_exceeded=deadline_exceeded)
+
+        self.store(loginfo)  # Append the record to the record store
+        metrics.QUERY_DURATION.labels("false").observe(loginfo["duration"])
+
+        if result and self.result_cache:  # Failed analyses are retried on the next request instead of cached
+            self.result_cache.set(cache_key, {"result": result, "chemical_composition": chemical_composition,
+                                              "pfas": pfas, "tokens": composition_tokens + tokens_for_analysis,
+                                              "cost": composition_cost + cost_for_analysis})
+
+        return QueryResult(result=result, chemical_composition=chemical_composition, pfas=pfas, loginfo=loginfo,
+                           deadline_exceeded=deadline_exceeded, failure=failure if result is None else None)
+
+    def build_loginfo(self, start, material_name, manufacturer_name, chemical_composition, result,
+                      tokens_for_cheminfo=0, tokens_for_analysis=0, cost_for_cheminfo=0, cost_for_analysis=0,
+                      cached=False, coalesced=False, similar_to=None, mode=None, deadline_exceeded=False,
+                      stale=False):
+        """
+        Build the record of a query kept in the record store.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            material_name (str): The name of the material.
+            manufacturer_name (str): The name of the manufacturer.
+            chemical_composition (Optional[dict]): The composition found by the first LLM call.
+            result (Optional[dict]): The analysis found by the second LLM call.
+            tokens_for_cheminfo (int): Tokens used for the chemical composition.
+            tokens_for_analysis (int): Tokens used for the analysis.
+            cost_for_cheminfo (float): Cost of the chemical composition.
+            cost_for_analysis (float): Cost of the analysis.
+            cached (bool): Whether the analysis was served from the result cache.
+            coalesced (bool): Whether the analysis was shared by a concurrent identical query.
+            similar_to (Optional[str]): The material whose past analysis was reused.
+            mode (Optional[str]): staged or combined, for queries that ran the LLM.
+            deadline_exceeded (bool): Whether the deadline passed before the analysis finished.
+            stale (bool): Whether an expired cached analysis was served while Azure OpenAI was failing.
+
+        Returns:
+            dict: The record.
+        """
+        return {
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
             "duration": time.perf_counter() - start,
             "material": material_name,
@@ -201,16 +1267,18 @@ class AskViridium:
             "cost_chemical_composition": cost_for_cheminfo,
             "cost_analysis": cost_for_analysis,
             "total_cost": cost_for_cheminfo + cost_for_analysis,
-            "chemical_composition": self.chemical_composition,
-            "PFAS_status": self.pfas,
-            "result": self.result
+            "chemical_composition": chemical_composition,
+            "PFAS_status": result["decision"] if result else None,
+            "result": result,
+            "cached": cached,
+            "coalesced": coalesced,
+            "similar_to": similar_to,
+            "mode": mode,
+            "deadline_exceeded": deadline_exceeded,
+            "stale": stale
         }
 
-        self.store()  # Store the result in data.json
-
-        return self.result
-
-    def handle_user_query(self, additional_info, material, manufacturer, work_content, chemicals_list):
+    def handle_user_query(self, additional_info, material, manufacturer, work_content, chemicals_list=None):
         """
         Handle user query with additional information.
 
@@ -219,47 +1287,69 @@ class AskViridium:
             material (str): The name of the material.
             manufacturer (str): The name of the manufacturer.
             work_content (str): The use case or context.
-            chemicals_list (list): List of chemicals.
+            chemicals_list (Optional[list]): List of chemicals. Looked up (usually from the composition cache)
+                when not given.
+
+        Returns:
+            dict: The analysis result, or None if the analysis failed.
         """
-        try:
-            with get_openai_callback() as cb:
-                self.logger.info("Handling user query with additional info")
-                self.result = self.analysis_chain.invoke(
-                    {"material": material, "manufacturer": manufacturer, "usecase": work_content,
-                     "chemical_composition": chemicals_list, "example": self.constants.analysis_example,
-                     "additional_info": additional_info})
-                self.logger.info("Result of user query with additional info: %s", self.result)
-        except Exception as e:
-            self.logger.exception("Unexpected error during user query handling: %s", e)
+        self.logger.info("Handling user query with additional info")
+        if chemicals_list is None:
+            _, chemicals_list, _, _ = self.fetch_chemical_composition(material)
+        result, _, _ = self.run_analysis(material, manufacturer, work_content, chemicals_list, additional_info)
+        return result
 
-    def store(self):
+    def store(self, loginfo):
         """
-        Store the result in a JSON file.
+        Append the record of a query to the record store.
+
+        Args:
+            loginfo (dict): The record of a query.
 
         Returns:
-            str: Confirmation message indicating that the results are saved.
+            bool: Whether the record was stored.
         """
         try:
-            with open("data_dump/data.json", 'r') as file:
-                data = json.load(file)
-        except FileNotFoundError:
-            self.logger.warning("data.json not found, creating a new one")
-            data = []
-
-        try:
-            data.append(self.loginfo)
-
-            with open("data_dump/data.json", 'w') as file:
-                json.dump(data, file, indent=4)
-
-            self.logger.info("Results stored in data.json")
+            with metrics.stage_timer("store"):
+                self.record_store.append(loginfo)
+            self.logger.info("Results stored in %s", self.record_store.path)
             return True
         except Exception as e:
             self.logger.exception("Data could not be stored due to the following exception: %s", e)
+            metrics.record_error("store", e)
             return False
 
 
+_shared_engine = None  # Process-wide AskViridium, created lazily by get_ask_viridium
+_shared_engine_lock = threading.Lock()
+
+
+def get_ask_viridium():
+    """
+    Return the AskViridium engine shared by every request in this process, building it on first use.
+
+    Returns:
+        AskViridium: The shared engine.
+    """
+    global _shared_engine
+    if _shared_engine is None:
+        with _shared_engine_lock:
+            if _shared_engine is None:  # Another thread may have built it while we waited
+                _shared_engine = AskViridium()
+    return _shared_engine
+
+
+def _reset_shared_engine():
+    """Drop the inherited engine in forked children so each gunicorn worker builds its own clients."""
+    global _shared_engine, _shared_engine_lock
+    _shared_engine = None
+    _shared_engine_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_shared_engine)
+
+
 if __name__ == '__main__':
-    ask_vai = AskViridium()
+    ask_vai = get_ask_viridium()
     ans = ask_vai.query("Nitrogen, Cryogenic Liquid", "Matheson Tri-Gas, Inc.",
                         "Heat Treatment, Hipping, Annealing and Tempering")  # Query the system with specific parameters
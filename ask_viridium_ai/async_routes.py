@@ -0,0 +1,299 @@
+import json
+import time
+
+from global_constants import GlobalConstants
+from . import metrics
+from .ask_viridium_ai import get_ask_viridium
+from .constants import AskViridiumConstants
+from .request_logging import get_request_logger
+from .tracking import AppInsightsConnector
+from utils.exceptions import RateLimitExceededException
+
+logger = AppInsightsConnector().get_logger()
+request_logger = get_request_logger(logger)
+
+
+class AsyncRoutes:
+    """
+    Native ASGI routes for the LLM-bound endpoints of Ask Viridium AI Service.
+
+    These handlers await the LLM instead of holding a thread, so one worker keeps many analyses in flight.
+    Every other request is passed on to the Flask application.
+    """
+
+    def __init__(self, main_routes):
+        """
+        Initializes the route table.
+
+        Args:
+            main_routes (MainRoutes): The Flask routes, reused for request validation and response bodies.
+        """
+        self.main_routes = main_routes
+        self.global_constants = GlobalConstants
+        self.constants = AskViridiumConstants
+
+        api_version = self.global_constants.api_version
+        post = self.global_constants.rest_api_methods.post
+        self.routes = {
+            (post, f"{api_version}/ask-viridium-ai"): self.ask_viridium_ai,
+            (post, f"{api_version}/ask-viridium-ai/stream"): self.ask_viridium_ai_stream,
+            (post, f"{api_version}/ask-viridium-ai/batch"): self.ask_viridium_ai_batch,
+        }
+
+    def asgi_app(self, fallback_app):
+        """
+        Builds the ASGI application.
+
+        Args:
+            fallback_app (Callable): ASGI application serving every route not handled here.
+
+        Returns:
+            Callable: The ASGI application.
+        """
+
+        async def app(scope, receive, send):
+            if scope["type"] == "lifespan":
+                await self.lifespan(receive, send)
+                return
+            handler = self.routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+            if handler is None:
+                await fallback_app(scope, receive, send)
+                return
+            await self.handle(handler, scope, receive, send)
+
+        return app
+
+    async def handle(self, handler, scope, receive, send):
+        """
+        Runs a route handler, recording its metrics and logging the request and response as the request logging
+        mode asks.
+
+        Args:
+            handler (Callable): The route handler.
+            scope (dict): The ASGI connection scope.
+            receive (Callable): The ASGI receive callable.
+            send (Callable): The ASGI send callable.
+        """
+        detail = request_logger.detail()
+        full = detail == request_logger.FULL
+        start = time.perf_counter()
+        request_body, response = [], {"status": None, "headers": [], "body": [], "size": 0, "streamed": False}
+
+        async def logged_receive():
+            message = await receive()
+            if full:
+                request_body.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    request_logger.log_request(detail, scope["method"], scope["path"], scope["headers"],
+                                               b"".join(request_body))
+            return message
+
+        async def logged_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+                response["streamed"] = response["streamed"] or message.get("more_body", False)
+                if full:
+                    response["body"].append(message.get("body", b""))
+            await send(message)
+
+        metrics.HTTP_IN_PROGRESS.inc()
+        try:
+            await handler(scope, logged_receive, logged_send)
+        finally:
+            metrics.HTTP_IN_PROGRESS.dec()
+            duration = time.perf_counter() - start
+            metrics.HTTP_DURATION.labels(scope["method"], scope["path"], response["status"]).observe(duration)
+        request_logger.log_response(detail, scope["method"], scope["path"], response["status"], duration,
+                                    None if response["streamed"] else response["size"], response["headers"],
+                                    None if response["streamed"] else b"".join(response["body"]))
+
+    async def lifespan(self, receive, send):
+        """Acknowledges server startup and shutdown; the engine is built lazily on the first request."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_json(self, receive):
+        """
+        Reads and decodes a JSON request body.
+
+        Returns:
+            Any: The decoded body, or None if it is not valid JSON.
+        """
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    async def send_api_response(self, send, status, message, result=None, additional_data=None, headers=None):
+        """
+        Sends a JSON response with the same body as the Flask routes.
+
+        Args:
+            send (Callable): The ASGI send callable.
+            status (int): The status code of the response.
+            message (str): The message of the response.
+            result (Any, optional): The result of the response. Defaults to None.
+            additional_data (dict, optional): Additional data to include in the response. Defaults to None.
+            headers (dict, optional): Extra response headers. Defaults to None.
+        """
+        body = json.dumps(self.main_routes.build_api_response(status, message, result, additional_data)).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            + [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def ask_viridium_ai(self, scope, receive, send):
+        """
+        Handles AI query requests without blocking the worker.
+        """
+        try:
+            request_data = await self.read_json(receive)
+            if not isinstance(request_data, dict):
+                await self.send_api_response(
+                    send,
+                    self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.invalid_request_data,
+                )
+                return
+
+            required_params = [self.constants.input_parameters["material_name"]]
+
+            valid_request, missing_params = self.main_routes.validate_request_data(request_data, required_params)
+            if not valid_request:
+                await self.send_api_response(
+                    send,
+                    self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.missing_required_parameters,
+                    f"{self.global_constants.api_response_parameters.missing_parameters}: {missing_params}",
+                )
+                return
+
+            error, mode = self.main_routes.validate_mode(request_data)
+            if error:
+                await self.send_api_response(send, *error)
+                return
+            error, deadline = self.main_routes.validate_deadline(request_data)
+            if error:
+                await self.send_api_response(send, *error)
+                return
+
+            outcome = await get_ask_viridium().aquery(
+                request_data[self.constants.input_parameters["material_name"]],
+                request_data.get(self.constants.input_parameters["manufacturer_name"]),
+                request_data.get(self.constants.input_parameters["work_content"]),
+                mode,
+                deadline
+            )
+
+            await self.send_api_response(send, *self.main_routes.query_response(outcome))
+        except RateLimitExceededException as e:
+            status, message, headers = self.main_routes.rate_limit_response(e)
+            await self.send_api_response(send, status, message, headers=headers)
+        except Exception:
+            logger.exception("Unhandled exception occurred")
+            await self.send_api_response(
+                send,
+                self.global_constants.api_status_codes.internal_server_error,
+                "An unexpected error occurred. Please try again later."
+            )
+
+    async def ask_viridium_ai_stream(self, scope, receive, send):
+        """
+        Handles AI query requests, streaming NDJSON lines: the chemical composition as soon as it is found,
+        then the analysis.
+        """
+        request_data = await self.read_json(receive)
+        if not isinstance(request_data, dict):
+            await self.send_api_response(
+                send,
+                self.global_constants.api_status_codes.bad_request,
+                self.global_constants.api_response_messages.invalid_request_data,
+            )
+            return
+
+        required_params = [self.constants.input_parameters["material_name"]]
+
+        valid_request, missing_params = self.main_routes.validate_request_data(request_data, required_params)
+        if not valid_request:
+            await self.send_api_response(
+                send,
+                self.global_constants.api_status_codes.bad_request,
+                self.global_constants.api_response_messages.missing_required_parameters,
+                f"{self.global_constants.api_response_parameters.missing_parameters}: {missing_params}",
+            )
+            return
+
+        error, mode = self.main_routes.validate_mode(request_data)
+        if error:
+            await self.send_api_response(send, *error)
+            return
+        error, deadline = self.main_routes.validate_deadline(request_data)
+        if error:
+            await self.send_api_response(send, *error)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": self.global_constants.api_status_codes.ok,
+            "headers": [(b"content-type", b"application/x-ndjson")],
+        })
+        try:
+            async for stage, payload in get_ask_viridium().astream_query(
+                    request_data[self.constants.input_parameters["material_name"]],
+                    request_data.get(self.constants.input_parameters["manufacturer_name"]),
+                    request_data.get(self.constants.input_parameters["work_content"]),
+                    mode, deadline):
+                await send({"type": "http.response.body", "body": self.main_routes.stream_event(stage, payload),
+                            "more_body": True})
+        except RateLimitExceededException as e:
+            await send({"type": "http.response.body", "more_body": True, "body": self.main_routes.stream_event(
+                "error", self.main_routes.rate_limit_response(e)[1])})
+        except Exception:
+            logger.exception("Unhandled exception occurred while streaming")
+            await send({"type": "http.response.body", "more_body": True, "body": self.main_routes.stream_event(
+                "error", "An unexpected error occurred. Please try again later.")})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def ask_viridium_ai_batch(self, scope, receive, send):
+        """
+        Handles batch AI query requests, running each stage through the chains' abatch.
+        """
+        try:
+            error, items, max_concurrency = self.main_routes.parse_batch_request(await self.read_json(receive))
+            if error:
+                await self.send_api_response(send, *error)
+                return
+
+            results, totals = await get_ask_viridium().aquery_batch(items, max_concurrency)
+
+            await self.send_api_response(
+                send,
+                self.global_constants.api_status_codes.ok,
+                self.global_constants.api_response_messages.success,
+                results,
+                additional_data={"totals": totals},
+            )
+        except Exception:
+            logger.exception("Unhandled exception occurred")
+            await self.send_api_response(
+                send,
+                self.global_constants.api_status_codes.internal_server_error,
+                "An unexpected error occurred. Please try again later."
+            )
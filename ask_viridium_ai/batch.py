@@ -0,0 +1,180 @@
+"""
+Bookkeeping for batch analyses.
+
+QueryBatch deduplicates the submitted items, serves what it can from the caches and tells the engine which
+compositions and analyses are still needed. The engine runs those through the chains' batch/abatch and hands
+the outputs back, so the sync and async batch paths share everything except the LLM calls.
+"""
+
+import time
+
+from . import metrics
+from .cache import make_cache_key
+
+
+class QueryBatch:
+    def __init__(self, engine, items):
+        """
+        Plan a batch of queries.
+
+        Args:
+            engine (AskViridium): The engine running the batch.
+            items (list): Dicts with material_name and optional manufacturer_name and work_content. Items that
+                are not valid carry an "error" message instead and are not analysed.
+        """
+        self.engine = engine
+        self.items = items
+        self.start = time.perf_counter()
+
+        self.item_keys = [None] * len(items)  # Query key of each valid item
+        self.queries = dict()  # key -> (material, manufacturer, work_content), one per distinct query
+        self.outcomes = dict()  # key -> QueryResult
+        self.errors = dict()  # key -> error message of a failed stage
+        self.compositions = dict()  # material key -> return value of fetch_chemical_composition
+        self.paid_compositions = set()  # material keys whose composition was charged or came from the cache
+
+        for index, item in enumerate(items):
+            if item.get("error"):
+                continue
+            query = (item["material_name"], item.get("manufacturer_name"), item.get("work_content"))
+            key = make_cache_key(*query)
+            self.item_keys[index] = key
+            self.queries.setdefault(key, query)
+
+        for key, (material, manufacturer, _) in self.queries.items():
+            outcome = engine.cached_query(self.start, key, material, manufacturer)
+            if outcome is not None:
+                self.outcomes[key] = outcome
+
+    def materials_to_look_up(self):
+        """
+        Materials whose composition is neither cached nor already known in this batch.
+
+        Returns:
+            list: One material name per distinct material.
+        """
+        materials = dict()
+        for key, (material, _, _) in self.queries.items():
+            material_key = make_cache_key(material)
+            if key in self.outcomes or material_key in self.compositions or material_key in materials:
+                continue
+            cached = self.engine.cached_chemical_composition(material)
+            if cached is not None:
+                self.compositions[material_key] = cached
+                self.paid_compositions.add(material_key)
+            else:
+                materials[material_key] = material
+        return list(materials.values())
+
+    def add_compositions(self, materials, outputs, callbacks):
+        """
+        Record the compositions returned by the chemical info chain.
+
+        Args:
+            materials (list): The materials returned by materials_to_look_up.
+            outputs (list): The batch outputs, exceptions for failed calls.
+            callbacks (list): The OpenAICallbackHandler that tracked each call.
+        """
+        for material, output, cb in zip(materials, outputs, callbacks):
+            if isinstance(output, Exception):
+                self.engine.logger.error("Chemical composition retrieval failed for %s: %s", material, output)
+                metrics.record_error("composition", output)
+                self.compositions[make_cache_key(material)] = (None, list(), 0, 0)
+            else:
+                self.compositions[make_cache_key(material)] = self.engine.composition_received(material, output, cb)
+
+    def composition_reused(self, material_key):
+        """
+        Whether a query's composition was already paid for, by the cache or an earlier query of the same material.
+        The first query of each material is charged for its composition, the others are not.
+
+        Args:
+            material_key (str): The normalized material name.
+
+        Returns:
+            bool: The value to give complete_query.
+        """
+        reused = material_key in self.paid_compositions
+        self.paid_compositions.add(material_key)
+        return reused
+
+    def queries_to_analyse(self):
+        """
+        Queries that still need the analysis call. Those decided without it are completed here.
+
+        Returns:
+            list: (key, analysis chain inputs) pairs.
+        """
+        pending = list()
+        for key, (material, manufacturer, work_content) in self.queries.items():
+            if key in self.outcomes:
+                continue
+            material_key = make_cache_key(material)
+            composition_stage = self.compositions[material_key]
+            analysis_stage, chemicals_list = self.engine.local_analysis(material, composition_stage)
+            if analysis_stage is not None:
+                self.outcomes[key] = self.engine.complete_query(
+                    self.start, key, material, manufacturer, composition_stage, analysis_stage,
+                    composition_reused=self.composition_reused(material_key))
+                continue
+            pending.append((key, self.engine.analysis_inputs(material, manufacturer, work_content, chemicals_list)))
+        return pending
+
+    def add_analyses(self, pending, outputs, callbacks):
+        """
+        Record the analyses returned by the analysis chain and complete those queries.
+
+        Args:
+            pending (list): The pairs returned by queries_to_analyse.
+            outputs (list): The batch outputs, exceptions for failed calls.
+            callbacks (list): The OpenAICallbackHandler that tracked each call.
+        """
+        for (key, _), output, cb in zip(pending, outputs, callbacks):
+            material, manufacturer, _ = self.queries[key]
+            if isinstance(output, Exception):
+                self.engine.logger.error("Analysis failed for %s: %s", material, output)
+                metrics.record_error("analysis", output)
+                self.errors[key] = f"{type(output).__name__}: {output}"
+                analysis_stage = (None, 0, 0, None)
+            else:
+                metrics.record_usage("analysis", cb.total_tokens, cb.total_cost, cb.prompt_tokens,
+                                     cb.completion_tokens)
+                analysis_stage = (output, cb.total_tokens, cb.total_cost, None)
+            material_key = make_cache_key(material)
+            self.outcomes[key] = self.engine.complete_query(
+                self.start, key, material, manufacturer, self.compositions[material_key], analysis_stage,
+                composition_reused=self.composition_reused(material_key))
+
+    def response(self):
+        """
+        Per-item results in submission order, plus aggregate totals.
+
+        Returns:
+            tuple: The list of item results and the dict of totals.
+        """
+        results = list()
+        totals = {"items": len(self.items), "unique_items": len(self.queries), "cached": 0, "failed": 0,
+                  "total_tokens": 0, "total_cost": 0.0}
+        for index, (item, key) in enumerate(zip(self.items, self.item_keys)):
+            outcome = self.outcomes.get(key)
+            error = item.get("error") if key is None else self.errors.get(key)
+            if error is None and (outcome is None or outcome.result is None):
+                error = "Analysis could not be completed"
+            results.append({
+                "index": index,
+                "material_name": item.get("material_name"),
+                "manufacturer_name": item.get("manufacturer_name"),
+                "work_content": item.get("work_content"),
+                "result": outcome.result if outcome else None,
+                "cached": outcome.cached if outcome else False,
+                "error": error,
+            })
+            totals["failed"] += error is not None
+
+        for outcome in self.outcomes.values():  # Duplicated items are only paid for once
+            totals["cached"] += outcome.cached
+            totals["total_tokens"] += (outcome.loginfo["tokens_used_for_chemical_composition"]
+                                       + outcome.loginfo["tokens_used_for_analysis"])
+            totals["total_cost"] += outcome.loginfo["total_cost"]
+        totals["total_cost"] = round(totals["total_cost"], 6)
+        return results, totals
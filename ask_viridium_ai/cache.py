@@ -0,0 +1,265 @@
+"""
+Two-tier cache for material analyses.
+
+A small in-memory LRU sits in front of a SQLite file. The SQLite tier survives restarts and is shared by
+every gunicorn worker on the host, so a material analysed by one worker is served from cache by all of them.
+Expired entries are kept on disk for stale_seconds more, to be served by get_stale while Azure is failing.
+
+Usage:
+    cache = ResultCache("data_dump/result_cache.sqlite3", ttl_seconds=86400, max_entries=100000)
+    key = make_cache_key("Vitrified Bonded Stick", "Norton", None)
+    value = cache.get(key)
+    if value is None:
+        cache.set(key, {"result": ...})
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+from .tracking import AppInsightsConnector
+
+logger = AppInsightsConnector().get_logger()
+
+# Values the UI and API send when an optional field was not filled in
+_EMPTY_VALUES = {"", "not available", "n a", "na", "none", "null"}
+
+
+def normalize_key_part(value):
+    """
+    Fold case, punctuation and whitespace so trivially different spellings share a cache entry.
+
+    Args:
+        value (Optional[str]): A raw query input.
+
+    Returns:
+        str: The normalized value, empty for missing inputs.
+    """
+    if value is None:
+        return ""
+    value = re.sub(r"[^\w]+", " ", str(value).casefold())
+    value = " ".join(value.replace("_", " ").split())
+    return "" if value in _EMPTY_VALUES else value
+
+
+def make_cache_key(*parts):
+    """
+    Build a cache key from query inputs.
+
+    Args:
+        *parts (Optional[str]): The query inputs, e.g. material, manufacturer and work content.
+
+    Returns:
+        str: The normalized key.
+    """
+    return "|".join(normalize_key_part(part) for part in parts)
+
+
+class ResultCache:
+    """In-memory LRU backed by a SQLite store, with TTL and size-based eviction."""
+
+    prune_interval = 100  # Number of writes between size-based eviction passes
+
+    def __init__(self, path, ttl_seconds, max_entries, memory_entries=1024, name="result", stale_seconds=0):
+        """
+        Initialize the cache.
+
+        Args:
+            path (str): Location of the SQLite file shared by all workers.
+            ttl_seconds (int): Lifetime of an entry in seconds.
+            max_entries (int): Maximum number of entries kept on disk.
+            memory_entries (int): Maximum number of entries kept in the in-process LRU.
+            name (str): Label of the cache in the metrics.
+            stale_seconds (int): Time expired entries are kept for get_stale.
+        """
+        self.path = path
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.stale_seconds = stale_seconds
+
+        self.memory = OrderedDict()  # key -> (expires_at, value), most recently used last
+        self.lock = threading.Lock()  # Guards the memory tier and the counters
+        self.local = threading.local()  # One SQLite connection per thread
+        self.writes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stale_hits": 0, "stores": 0, "evictions": 0,
+                         "errors": 0, "saved_tokens": 0, "saved_cost": 0.0}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            self.connection().execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)")
+            self.connection().execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        except sqlite3.Error as e:
+            logger.warning("Result cache disabled, SQLite store could not be initialised: %s", e)
+            self.increment("errors")
+
+    def connection(self):
+        """Return this thread's SQLite connection, opening it on first use."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def increment(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+        metrics.CACHE_EVENTS.labels(self.name, counter).inc(value)
+
+    def get(self, key):
+        """
+        Look a key up in memory, then on disk.
+
+        Args:
+            key (str): A key built with make_cache_key.
+
+        Returns:
+            Optional[dict]: The cached value, or None on a miss or expired entry.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    metrics.CACHE_EVENTS.labels(self.name, "memory_hits").inc()
+                    return entry[1]
+                del self.memory[key]
+
+        try:
+            row = self.connection().execute(
+                "SELECT value, expires_at FROM results WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is not None:
+                self.connection().execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning("Result cache read failed: %s", e)
+            self.increment("errors")
+            row = None
+
+        if row is None:
+            self.increment("misses")
+            return None
+
+        value = json.loads(row[0])
+        self.remember(key, row[1], value)
+        self.increment("disk_hits")
+        return value
+
+    def get_stale(self, key):
+        """
+        Look a key up on disk, including entries expired for less than stale_seconds.
+
+        Args:
+            key (str): A key built with make_cache_key.
+
+        Returns:
+            Optional[dict]: The cached value, or None if there is none, even stale.
+        """
+        try:
+            row = self.connection().execute("SELECT value FROM results WHERE key = ? AND expires_at > ?",
+                                            (key, time.time() - self.stale_seconds)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Result cache read failed: %s", e)
+            self.increment("errors")
+            return None
+        if row is None:
+            return None
+        self.increment("stale_hits")
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Store a value in both tiers.
+
+        Args:
+            key (str): A key built with make_cache_key.
+            value (dict): A JSON-serialisable value.
+        """
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self.remember(key, expires_at, value)
+
+        try:
+            self.connection().execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now))
+        except sqlite3.Error as e:
+            logger.warning("Result cache write failed: %s", e)
+            self.increment("errors")
+            return
+
+        with self.lock:
+            self.counters["stores"] += 1
+            self.writes += 1
+            prune = self.writes % self.prune_interval == 0
+        metrics.CACHE_EVENTS.labels(self.name, "stores").inc()
+        if prune:
+            self.prune(now)
+
+    def remember(self, key, expires_at, value):
+        """Put an entry in the memory tier, evicting the least recently used one when full."""
+        with self.lock:
+            self.memory[key] = (expires_at, value)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def prune(self, now=None):
+        """Delete entries stale for longer than stale_seconds and the least recently used ones beyond max_entries."""
+        now = now or time.time()
+        try:
+            connection = self.connection()
+            expired = connection.execute("DELETE FROM results WHERE expires_at <= ?",
+                                         (now - self.stale_seconds,)).rowcount
+            overflow = connection.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)).rowcount
+        except sqlite3.Error as e:
+            logger.warning("Result cache eviction failed: %s", e)
+            self.increment("errors")
+            return
+        self.increment("evictions", expired + overflow)
+
+    def record_saving(self, tokens, cost):
+        """
+        Account for the LLM usage a cache hit avoided.
+
+        Args:
+            tokens (int): Tokens the cached value cost when it was computed.
+            cost (float): Cost of the cached value when it was computed.
+        """
+        with self.lock:
+            self.counters["saved_tokens"] += tokens
+            self.counters["saved_cost"] += cost
+        metrics.CACHE_SAVED_TOKENS.labels(self.name).inc(tokens)
+        metrics.CACHE_SAVED_COST.labels(self.name).inc(cost)
+
+    def stats(self):
+        """
+        Snapshot the hit/miss counters of this worker.
+
+        Returns:
+            dict: The counters along with the hit ratio and the worker pid.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["saved_cost"] = round(stats["saved_cost"], 6)
+        stats["pid"] = os.getpid()
+        return stats
@@ -0,0 +1,233 @@
+"""
+Circuit breaker around the Azure OpenAI calls.
+
+When Azure fails, every query still waits for its calls to fail or time out, records an empty result and
+answers 200, so clients retry straight away and every worker keeps waiting on the failing backend. The breaker
+watches the outcome of the LLM calls of the worker over the last window_seconds. Once at least min_calls were
+made and failure_ratio of them failed, it opens: calls fail fast with CircuitOpenException (503 to the client,
+with Retry-After), and queries found in the result cache, even expired, are served from it. After open_seconds
+it half-opens and lets half_open_probes calls through. It closes if they succeed and opens again if one fails.
+
+Failures are the errors that show Azure is unhealthy: connection errors and timeouts, 5xx answers, throttling
+that outlasted the retries, and calls cut by the query's deadline. Any other answer, such as a 400 from the
+content filter, shows Azure is up and counts as a success. Errors raised before a call was made, such as a
+refusal by our own rate limiter, count as neither.
+
+Each worker has its own breaker, so a worker that opened it stops calling Azure at once, while the other
+workers follow as soon as their own calls fail.
+
+Usage:
+    breaker = CircuitBreaker(failure_ratio=0.5, min_calls=10, window_seconds=60, open_seconds=30)
+    model = circuit_guarded(rate_limited(model, limiter, "analysis"), breaker, "analysis")
+    chain = prompt | model | parser
+"""
+
+import threading
+import time
+from collections import deque
+
+from langchain_core.runnables import RunnableLambda
+from openai import APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+
+from . import metrics
+from .tracking import AppInsightsConnector
+from utils.exceptions import CircuitOpenException, MaxProcessingTimeExceededException, UpstreamThrottledException
+
+logger = AppInsightsConnector().get_logger()
+
+STATES = {"closed": 0, "half_open": 1, "open": 2}  # Values of askvai_circuit_breaker_state
+TRANSITIONS = {"closed": "closed", "half_open": "half_opened", "open": "opened"}  # Event counted on entering a state
+
+
+def is_failure(error):
+    """
+    Whether an error raised by an LLM call shows Azure is unhealthy.
+
+    Args:
+        error (BaseException): The error the call raised.
+
+    Returns:
+        Optional[bool]: True for a failure, False for an answer from a healthy Azure, None if no call was made.
+    """
+    if isinstance(error, MaxProcessingTimeExceededException):
+        return isinstance(error.__cause__, TimeoutError) or None  # Cancelled mid-call, or never started
+    if isinstance(error, (UpstreamThrottledException, APIConnectionError, InternalServerError, RateLimitError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return False
+    return None  # Refused by our rate limiter, cancelled, or failed before reaching Azure
+
+
+class CircuitBreaker:
+    def __init__(self, failure_ratio=0.5, min_calls=10, window_seconds=60.0, open_seconds=30.0, half_open_probes=1):
+        """
+        Initialize the circuit breaker, closed.
+
+        Args:
+            failure_ratio (float): Share of failed calls in the window that opens the breaker.
+            min_calls (int): Calls needed in the window before the breaker may open.
+            window_seconds (float): Length of the sliding window of call outcomes.
+            open_seconds (float): Time the breaker stays open before letting probes through.
+            half_open_probes (int): Calls let through at once while half-open.
+        """
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.lock = threading.Lock()  # Guards the state, the window and the counters
+        self.state = "closed"
+        self.outcomes = deque()  # (time, failed) of the calls in the window, oldest first
+        self.opened_at = 0.0
+        self.probes = 0  # Probes in flight while half-open
+        self.counters = {"opened": 0, "half_opened": 0, "closed": 0, "rejected": 0, "stale_served": 0}
+        metrics.CIRCUIT_BREAKER_STATE.set(STATES["closed"])
+
+    def transition(self, state, now):
+        """Move to a state; the lock must be held."""
+        self.state = state
+        self.counters[TRANSITIONS[state]] += 1
+        if state == "open":
+            self.opened_at = now
+            logger.warning("Circuit breaker opened after %d failures in %d calls, retrying Azure OpenAI in %.0f s",
+                           sum(failed for _, failed in self.outcomes), len(self.outcomes), self.open_seconds)
+        else:
+            logger.info("Circuit breaker %s", state.replace("_", "-"))
+        self.outcomes.clear()
+        metrics.CIRCUIT_BREAKER_EVENTS.labels(TRANSITIONS[state]).inc()
+        metrics.CIRCUIT_BREAKER_STATE.set(STATES[state])
+
+    def refresh(self, now):
+        """Half-open the breaker once it has been open for open_seconds; the lock must be held."""
+        if self.state == "open" and now - self.opened_at >= self.open_seconds:
+            self.transition("half_open", now)
+        return self.state
+
+    def retry_after(self):
+        """Seconds until the breaker lets probes through, 0 if it already does."""
+        with self.lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.opened_at + self.open_seconds - time.time())
+
+    def rejecting(self):
+        """Whether a call made now would be refused."""
+        with self.lock:
+            state = self.refresh(time.time())
+            return state == "open" or (state == "half_open" and self.probes >= self.half_open_probes)
+
+    def acquire(self):
+        """
+        Let a call through, or refuse it.
+
+        Returns:
+            bool: Whether the call is a half-open probe, to be given back to record.
+
+        Raises:
+            CircuitOpenException: If the breaker is open, or half-open with all its probes in flight.
+        """
+        with self.lock:
+            state = self.refresh(time.time())
+            if state == "closed":
+                return False
+            if state == "half_open" and self.probes < self.half_open_probes:
+                self.probes += 1
+                return True
+        raise self.refusal()
+
+    def refusal(self):
+        """Count a refused call or query, and build the exception it is refused with."""
+        self.count("rejected")
+        return CircuitOpenException(details={"state": self.state}, retry_after=max(1.0, self.retry_after()))
+
+    def record(self, failed, probe=False):
+        """
+        Record the outcome of a call let through by acquire.
+
+        Args:
+            failed (Optional[bool]): The value of is_failure, or False for a call that succeeded.
+            probe (bool): The value returned by acquire.
+        """
+        with self.lock:
+            now = time.time()
+            if probe:
+                self.probes -= 1
+            if failed is None:
+                return
+            if probe and self.state == "half_open":
+                self.transition("open" if failed else "closed", now)
+                return
+            if self.state != "closed":
+                return  # A call made before the breaker opened
+            self.outcomes.append((now, failed))
+            while self.outcomes and self.outcomes[0][0] <= now - self.window_seconds:
+                self.outcomes.popleft()
+            failures = sum(failed for _, failed in self.outcomes)
+            if len(self.outcomes) >= self.min_calls and failures >= self.failure_ratio * len(self.outcomes):
+                self.transition("open", now)
+
+    def count(self, event):
+        """
+        Record a breaker event.
+
+        Args:
+            event (str): rejected (a call or query was refused) or stale_served (a query was served an expired
+                result).
+        """
+        with self.lock:
+            self.counters[event] += 1
+        metrics.CIRCUIT_BREAKER_EVENTS.labels(event).inc()
+
+    def stats(self):
+        """
+        Circuit breaker state and counters of this worker.
+
+        Returns:
+            dict: The state, the seconds until probes are let through, the calls and failures in the window and
+                the counters.
+        """
+        retry_after = self.retry_after()
+        with self.lock:
+            stats = dict(self.counters)
+            stats["state"] = self.refresh(time.time())
+            stats["calls_in_window"] = len(self.outcomes)
+            stats["failures_in_window"] = sum(failed for _, failed in self.outcomes)
+        stats["retry_after"] = round(retry_after, 1)
+        return stats
+
+
+def circuit_guarded(model, breaker, stage):
+    """
+    Wrap a chat model so every call goes through the circuit breaker.
+
+    Args:
+        model (Runnable): The chat model, with its functions bound and any other wrappers applied.
+        breaker (CircuitBreaker): The worker's breaker.
+        stage (str): composition, analysis or combined.
+
+    Returns:
+        Runnable: The wrapped model.
+    """
+
+    def call(messages, config):
+        probe = breaker.acquire()
+        try:
+            message = model.invoke(messages, config)
+        except BaseException as e:
+            breaker.record(is_failure(e), probe)
+            raise
+        breaker.record(False, probe)
+        return message
+
+    async def acall(messages, config):
+        probe = breaker.acquire()
+        try:
+            message = await model.ainvoke(messages, config)
+        except BaseException as e:
+            breaker.record(is_failure(e), probe)
+            raise
+        breaker.record(False, probe)
+        return message
+
+    return RunnableLambda(call, afunc=acall, name=f"circuit_guarded_{stage}")
@@ -0,0 +1,251 @@
+"""
+Single-flight coalescing of identical queries in flight at the same time.
+
+When several requests ask about the same material at once, e.g. a batch upload racing the UI, each of them
+would miss the result cache and pay for both LLM calls. Instead, the first request for a cache key leads a
+flight and runs the query; requests for the same key arriving while it runs join the flight and receive the
+leader's outcome. Sync and async requests of a worker share the same flights. A request waits for a flight
+only until its own deadline passes.
+
+Across workers, flights are optionally coordinated through leases in a SQLite file. A worker whose leader
+finds another worker holding the lease waits for it to finish and then reads the outcome from the result
+cache the workers share, so this requires the result cache. Leases expire after lease_seconds, so a worker
+that died mid-query does not block the key.
+
+The coalesce ratio is the share of queries that joined a flight instead of running it:
+    sum(rate(askvai_coalesce_total{role=~"joined.*"}[5m]))
+      / sum(rate(askvai_coalesce_total{role=~"led|joined"}[5m]))
+
+Usage:
+    coalescer = QueryCoalescer()
+    flight = coalescer.join(cache_key)
+    if flight.leader:
+        with coalescer.lead(flight) as resolve:
+            resolve(run_the_query())
+    else:
+        outcome = flight.future.result()  # None if the leader gave up
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+
+from . import metrics
+from .tracking import AppInsightsConnector
+
+logger = AppInsightsConnector().get_logger()
+
+
+@dataclass
+class Flight:
+    """A query in flight for a cache key, as seen by one request."""
+    key: str
+    future: Future  # Resolved with the leader's QueryResult, None if it gave up, or its exception
+    leader: bool  # Whether this request runs the query
+    remote: bool = False  # Whether another worker holds the lease of the key
+    owner: str = None  # Identifier of the lease this request holds
+
+
+class QueryCoalescer:
+    def __init__(self, path=None, poll_interval=0.2, lease_seconds=120):
+        """
+        Initialize the coalescer.
+
+        Args:
+            path (Optional[str]): SQLite file holding the leases shared by all workers; None to coalesce within
+                this worker only.
+            poll_interval (float): Seconds between checks for a lease held by another worker.
+            lease_seconds (float): Lifetime of a lease, longer than any query is expected to take.
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+
+        self.flights = dict()  # key -> Future of the flight led by this worker
+        self.lock = threading.Lock()  # Guards the flights and the counters
+        self.local = threading.local()  # One SQLite connection per thread
+        self.counters = {"led": 0, "joined": 0, "joined_remote": 0, "abandoned": 0}
+
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection().execute(
+                "CREATE TABLE IF NOT EXISTS flights (key TEXT PRIMARY KEY, owner TEXT NOT NULL, "
+                "expires_at REAL NOT NULL)")
+
+    def connection(self):
+        """Return this thread's SQLite connection, opening it on first use."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def count(self, role):
+        with self.lock:
+            self.counters[role] += 1
+        metrics.COALESCE_EVENTS.labels(role).inc()
+
+    def join(self, key):
+        """
+        Join the flight of a key, or start one.
+
+        Args:
+            key (str): The normalized query key.
+
+        Returns:
+            Flight: The flight, led by this request if no other request of this worker runs the key.
+        """
+        with self.lock:
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = Future()
+        if not leader:
+            self.count("joined")
+            return Flight(key, future, leader=False)
+
+        self.count("led")
+        flight = Flight(key, future, leader=True)
+        if self.path:
+            owner = uuid.uuid4().hex
+            flight.remote = not self.claim(key, owner)
+            flight.owner = None if flight.remote else owner
+        return flight
+
+    def claim(self, key, owner):
+        """Take the lease of a key unless another worker holds it; True if taken."""
+        now = time.time()
+        try:
+            connection = self.connection()
+            connection.execute("DELETE FROM flights WHERE key = ? AND expires_at <= ?", (key, now))
+            return connection.execute("INSERT OR IGNORE INTO flights (key, owner, expires_at) VALUES (?, ?, ?)",
+                                      (key, owner, now + self.lease_seconds)).rowcount == 1
+        except sqlite3.Error as e:
+            logger.warning("Flight lease could not be taken: %s", e)
+            return True  # Run the query rather than wait on a store we cannot read
+
+    def held_elsewhere(self, key):
+        """Whether another worker still holds the lease of a key."""
+        try:
+            return self.connection().execute("SELECT 1 FROM flights WHERE key = ? AND expires_at > ?",
+                                             (key, time.time())).fetchone() is not None
+        except sqlite3.Error as e:
+            logger.warning("Flight lease could not be read: %s", e)
+            return False
+
+    def wait_remote(self, flight, deadline=None):
+        """
+        Wait until the worker holding the lease of a flight finished or its lease expired.
+
+        Args:
+            flight (Flight): The flight.
+            deadline (Optional[Deadline]): The deadline of the waiting query, ending the wait once it runs out.
+
+        Returns:
+            bool: Whether the lease was released, False if the deadline ran out first.
+        """
+        while self.held_elsewhere(flight.key):
+            if deadline is not None and deadline.exhausted():
+                return False
+            time.sleep(self.poll_interval if deadline is None else min(self.poll_interval, deadline.remaining()))
+        return True
+
+    async def await_remote(self, flight, deadline=None):
+        """Async version of wait_remote."""
+        while await asyncio.to_thread(self.held_elsewhere, flight.key):
+            if deadline is not None and deadline.exhausted():
+                return False
+            await asyncio.sleep(self.poll_interval if deadline is None else min(self.poll_interval,
+                                                                                 deadline.remaining()))
+        return True
+
+    def land(self, flight, outcome=None, error=None):
+        """
+        End a flight led by this request, handing its outcome to the requests that joined it.
+
+        Args:
+            flight (Flight): The flight.
+            outcome (Optional[QueryResult]): The outcome, None if the leader gave up before finishing.
+            error (Optional[Exception]): The exception the leader failed with.
+        """
+        with self.lock:
+            if self.flights.get(flight.key) is flight.future:  # A later flight of the key may have started
+                del self.flights[flight.key]
+        if not flight.future.done():
+            if error is not None:
+                flight.future.set_exception(error)
+            else:
+                flight.future.set_result(outcome)
+                if outcome is None:
+                    self.count("abandoned")
+        if flight.owner:
+            owner, flight.owner = flight.owner, None
+            try:
+                self.connection().execute("DELETE FROM flights WHERE key = ? AND owner = ?", (flight.key, owner))
+            except sqlite3.Error as e:
+                logger.warning("Flight lease could not be released: %s", e)  # It expires after lease_seconds
+
+    @contextmanager
+    def lead(self, flight):
+        """
+        Run a flight as its leader. Yields a function to call with the outcome as soon as it is known; the
+        flight lands when the block exits, also when the leader fails or its stream is abandoned.
+        """
+        outcome = None
+
+        def resolve(result):
+            nonlocal outcome
+            outcome = result
+            self.land(flight, outcome)
+
+        try:
+            yield resolve
+        except Exception as e:
+            self.land(flight, error=e)
+            raise
+        finally:
+            self.land(flight, outcome)
+
+    @asynccontextmanager
+    async def alead(self, flight):
+        """Async version of lead, releasing the shared lease in a worker thread."""
+        outcome = None
+
+        async def resolve(result):
+            nonlocal outcome
+            outcome = result
+            await asyncio.to_thread(self.land, flight, outcome)
+
+        try:
+            yield resolve
+        except Exception as e:
+            await asyncio.to_thread(self.land, flight, None, e)
+            raise
+        finally:
+            if not flight.future.done() or flight.owner:
+                await asyncio.to_thread(self.land, flight, outcome)
+
+    def stats(self):
+        """
+        Coalescing counters of this process.
+
+        Returns:
+            dict: The counters, the flights in flight and the share of queries that joined a flight.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self.flights)
+        queries = stats["led"] + stats["joined"]
+        joined = stats["joined"] + stats["joined_remote"]
+        stats["coalesce_ratio"] = round(joined / queries, 4) if queries else 0.0
+        return stats
@@ -4,3 +4,13 @@ class AskViridiumConstants:
         "manufacturer_name": "manufacturer_name",
         "work_content": "work_content"
     }
+
+    query_parameters = {
+        "mode": "mode",
+        "deadline": "deadline_seconds"
+    }
+
+    batch_parameters = {
+        "items": "items",
+        "max_concurrency": "max_concurrency"
+    }
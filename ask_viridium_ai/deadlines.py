@@ -0,0 +1,189 @@
+"""
+End-to-end deadlines of queries.
+
+Every query gets a time budget, the one the request asked for with deadline_seconds or
+REQUEST_DEADLINE_SECONDS, counted from the moment it was received. Each LLM call of the query is bound just
+before it starts, after any wait for the rate limiter, with its stage's timeout capped at the time left, so a
+hung Azure call is cut when the query runs out of time instead of holding the worker. The OpenAI SDK would
+retry a timed-out call with the same timeout, so these calls are made by a model without SDK retries, and
+retried here only while the query has time left. A call is not started at all with less than min_call_seconds
+left; MaxProcessingTimeExceededException is raised instead. Async calls are also cancelled when the deadline
+passes.
+
+A query whose analysis did not finish within its deadline keeps the chemical composition, if that call
+finished, and is answered with it alone (504 to the client).
+
+Usage:
+    policy = DeadlinePolicy(default_seconds=120, max_seconds=300, min_call_seconds=2)
+    deadline = policy.start(time.perf_counter(), requested=30)
+    model = deadline_bound(llm.bind_functions(...), deadline, GlobalConstants.llm_http, "analysis")  # max_retries=0
+    chain = prompt | model | parser
+"""
+
+import asyncio
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from . import metrics
+from .http_clients import stage_timeout
+from .tracking import AppInsightsConnector
+from utils.exceptions import MaxProcessingTimeExceededException
+
+logger = AppInsightsConnector().get_logger()
+
+
+class Deadline:
+    def __init__(self, start, budget, min_call_seconds=0.0):
+        """
+        Initialize the deadline of a query.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            budget (float): Seconds the query may take.
+            min_call_seconds (float): Time an LLM call needs left to be worth starting.
+        """
+        self.budget = budget
+        self.expires_at = start + budget
+        self.min_call_seconds = min_call_seconds
+
+    def remaining(self):
+        """Seconds left before the deadline, 0 once it passed."""
+        return max(0.0, self.expires_at - time.perf_counter())
+
+    def exhausted(self):
+        """Whether too little time is left to start another LLM call."""
+        return self.remaining() < self.min_call_seconds
+
+    def slack(self):
+        """Seconds an LLM call may still wait before it starts, negative once too little time is left."""
+        return self.remaining() - self.min_call_seconds
+
+    def timeout(self, config, stage):
+        """
+        Timeout of an LLM call starting now.
+
+        Args:
+            config (DotAccessDict): GlobalConstants.llm_http.
+            stage (str): composition, analysis or combined.
+
+        Returns:
+            httpx.Timeout: The stage's timeout, capped at the time left.
+
+        Raises:
+            MaxProcessingTimeExceededException: If too little time is left to start the call.
+        """
+        if self.exhausted():
+            raise MaxProcessingTimeExceededException(
+                details=f"{self.remaining():.2f} s left of {self.budget:.0f} s, the {stage} call was not started")
+        return stage_timeout(config, stage, self.remaining())
+
+
+def retry_delay(attempt, deadline):
+    """Backoff before retrying a failed call, as the OpenAI SDK's, but never past the deadline."""
+    return min(0.5 * 2 ** attempt, 8.0, deadline.remaining())
+
+
+def deadline_bound(model, deadline, llm_http, stage, retry=True):
+    """
+    Wrap a chat model so each call is bound with a timeout capped at the time the query has left.
+
+    Args:
+        model (Runnable): The chat model, with its functions bound, from a client without SDK retries.
+        deadline (Deadline): The query's deadline.
+        llm_http (DotAccessDict): GlobalConstants.llm_http, giving the timeouts and max_retries.
+        stage (str): composition, analysis or combined.
+        retry (bool): Whether to retry failed calls, left to the rate limiter when it is on so that every attempt
+            reserves its share of the quota.
+
+    Returns:
+        Runnable: The wrapped model.
+    """
+    retryable = (APIConnectionError, InternalServerError, RateLimitError)
+    retries = llm_http.max_retries if retry else 0
+
+    def call(messages, config):
+        for attempt in range(retries + 1):
+            try:
+                return model.bind(timeout=deadline.timeout(llm_http, stage)).invoke(messages, config)
+            except retryable as e:
+                if attempt == retries or deadline.exhausted():
+                    raise
+                logger.warning("The %s call failed with %s, retrying", stage, type(e).__name__)
+                time.sleep(retry_delay(attempt, deadline))
+
+    async def acall(messages, config):
+        for attempt in range(retries + 1):
+            bound = model.bind(timeout=deadline.timeout(llm_http, stage))
+            try:
+                return await asyncio.wait_for(bound.ainvoke(messages, config), deadline.remaining())
+            except TimeoutError as e:  # Still reading when the deadline passed
+                raise MaxProcessingTimeExceededException(
+                    details=f"the {stage} call was cancelled at the {deadline.budget:.0f} s deadline") from e
+            except retryable as e:
+                if attempt == retries or deadline.exhausted():
+                    raise
+                logger.warning("The %s call failed with %s, retrying", stage, type(e).__name__)
+                await asyncio.sleep(retry_delay(attempt, deadline))
+
+    return RunnableLambda(call, afunc=acall, name=f"deadline_bound_{stage}")
+
+
+class DeadlinePolicy:
+    def __init__(self, default_seconds=120.0, max_seconds=300.0, min_call_seconds=2.0):
+        """
+        Initialize the deadline policy.
+
+        Args:
+            default_seconds (float): Budget of queries that do not ask for one.
+            max_seconds (float): Longest budget a query may ask for.
+            min_call_seconds (float): Time an LLM call needs left to be worth starting.
+        """
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+        self.min_call_seconds = min_call_seconds
+        self.lock = threading.Lock()
+        self.counters = {"timed_out": 0, "aborted": 0, "exceeded": 0, "partial": 0}
+
+    def start(self, start, requested=None):
+        """
+        Start the deadline of a query.
+
+        Args:
+            start (float): perf_counter value taken when the query started.
+            requested (Optional[float]): Budget the request asked for, None for the default.
+
+        Returns:
+            Deadline: The query's deadline.
+        """
+        budget = min(requested or self.default_seconds, self.max_seconds)
+        return Deadline(start, budget, self.min_call_seconds)
+
+    def count(self, stage, event):
+        """
+        Record a deadline event.
+
+        Args:
+            stage (str): composition, analysis, combined, or query for the query-level events.
+            event (str): timed_out (an LLM call hit its timeout), aborted (a call was not started or was
+                cancelled for lack of time), exceeded (a query missed its deadline without an analysis) or
+                partial (such a query was answered with the composition alone).
+        """
+        with self.lock:
+            self.counters[event] += 1
+        metrics.DEADLINE_EVENTS.labels(stage, event).inc()
+
+    def stats(self):
+        """
+        Deadline counters of this process.
+
+        Returns:
+            dict: The counters and the configured budgets.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats["default_seconds"] = self.default_seconds
+        stats["max_seconds"] = self.max_seconds
+        return stats
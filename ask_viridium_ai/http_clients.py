@@ -0,0 +1,72 @@
+"""
+Pooled HTTP clients of the Azure OpenAI calls.
+
+The engine is built once per worker, and so are these clients: every LLM call of the worker goes through the
+same connection pool, so a call reuses a warm TLS connection instead of paying the TCP and TLS handshakes
+again. The OpenAI SDK's own clients already pool, but they drop idle connections after 5 seconds, so under
+light traffic most calls still open a new connection. Here idle connections are kept for
+LLM_HTTP_KEEPALIVE_SECONDS, and HTTP/2 is negotiated when the h2 package is installed, multiplexing concurrent
+calls over one connection.
+
+Each stage also gets its own timeout, bound to its model, instead of the SDK's default of 10 minutes. A query
+with a deadline caps the timeout of each call at the time it has left.
+
+Usage:
+    http_client, http_async_client = build_http_clients(GlobalConstants.llm_http)
+    llm = AzureChatOpenAI(..., http_client=http_client, http_async_client=http_async_client)
+    model = llm.bind_functions(..., timeout=stage_timeout(GlobalConstants.llm_http, "analysis"))
+"""
+
+import httpx
+
+from .tracking import AppInsightsConnector
+
+logger = AppInsightsConnector().get_logger()
+
+
+def http2_available():
+    """Whether httpx can speak HTTP/2, which needs the h2 package."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_http_clients(config):
+    """
+    Build the pooled sync and async clients of a worker.
+
+    Args:
+        config (DotAccessDict): GlobalConstants.llm_http.
+
+    Returns:
+        tuple: The httpx.Client and httpx.AsyncClient.
+    """
+    http2 = config.http2 and http2_available()
+    if config.http2 and not http2:
+        logger.warning("LLM_HTTP2_ENABLED is set but the h2 package is missing, using HTTP/1.1")
+    limits = httpx.Limits(max_connections=config.max_connections,
+                          max_keepalive_connections=config.max_keepalive_connections,
+                          keepalive_expiry=config.keepalive_expiry)
+    timeout = stage_timeout(config, "default")
+    return (httpx.Client(limits=limits, timeout=timeout, http2=http2),
+            httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2))
+
+
+def stage_timeout(config, stage, remaining=None):
+    """
+    Timeout of the LLM calls of a stage.
+
+    Args:
+        config (DotAccessDict): GlobalConstants.llm_http.
+        stage (str): composition, analysis, combined or default.
+        remaining (Optional[float]): Seconds left to the query's deadline, capping both timeouts.
+
+    Returns:
+        httpx.Timeout: The stage's timeout for reading the answer, and the shared connect timeout.
+    """
+    read, connect = config[f"{stage}_timeout"], config.connect_timeout
+    if remaining is not None:
+        read, connect = min(read, remaining), min(connect, remaining)
+    return httpx.Timeout(read, connect=connect)
@@ -0,0 +1,317 @@
+"""
+SQLite-backed job queue for long-running analyses.
+
+Clients submit a query and get a job id back immediately; a pool of background threads runs AskViridium.query
+and stores the result for the client to poll. The queue lives in a SQLite file, so every gunicorn worker on the
+host shares it without external services, and a burst of submissions waits in the queue instead of tying up
+web workers.
+
+Usage:
+    queue = get_job_queue()
+    job_id = queue.submit({"material_name": "Nitrogen, Cryogenic Liquid"})
+    queue.get(job_id)  # {"job_id": ..., "status": "queued" | "running" | "succeeded" | "failed", ...}
+
+Consumers can also run outside the web workers:
+    python -m ask_viridium_ai.jobs
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from global_constants import GlobalConstants
+from .ask_viridium_ai import get_ask_viridium
+from .constants import AskViridiumConstants
+from .tracking import AppInsightsConnector
+from utils.exceptions import JobQueueFullException, RateLimitExceededException
+
+logger = AppInsightsConnector().get_logger()
+
+
+class JobQueue:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(self, path, poll_interval=1.0, visibility_timeout=600, retention_seconds=86400, max_queued=10000,
+                 max_requeues=10):
+        """
+        Initialize the job queue.
+
+        Args:
+            path (str): Location of the SQLite file shared by all workers.
+            poll_interval (float): Seconds an idle consumer waits before checking for jobs from other processes.
+            visibility_timeout (int): Seconds after which a running job whose consumer died is queued again.
+            retention_seconds (int): Seconds finished jobs are kept for polling.
+            max_queued (int): Maximum number of queued jobs before submissions are refused.
+            max_requeues (int): Times a job is put back in the queue while Azure is saturated or failing before it
+                fails.
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.retention_seconds = retention_seconds
+        self.max_queued = max_queued
+        self.max_requeues = max_requeues
+
+        self.local = threading.local()  # One SQLite connection per thread
+        self.wakeup = threading.Event()  # Set on submit so local consumers pick the job up at once
+        self.stopping = threading.Event()
+        self.threads = []
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, worker TEXT, flags TEXT, "
+            "requeues INTEGER NOT NULL DEFAULT 0)")
+        self.connection().execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+        columns = {column["name"] for column in self.connection().execute("PRAGMA table_info(jobs)")}
+        for name, definition in [("flags", "TEXT"), ("requeues", "INTEGER NOT NULL DEFAULT 0")]:
+            if name not in columns:  # Queue created by an earlier version
+                try:
+                    self.connection().execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+                except sqlite3.OperationalError:
+                    pass  # Added by another worker meanwhile
+
+    def connection(self):
+        """Return this thread's SQLite connection, opening it on first use."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return connection
+
+    def submit(self, payload):
+        """
+        Queue a query.
+
+        Args:
+            payload (dict): The query parameters (material_name, manufacturer_name, work_content).
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            JobQueueFullException: If max_queued jobs are already waiting.
+        """
+        connection = self.connection()
+        queued = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (self.QUEUED,)).fetchone()[0]
+        if queued >= self.max_queued:
+            raise JobQueueFullException(details={"queued": queued})
+
+        job_id = uuid.uuid4().hex
+        connection.execute("INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                           (job_id, self.QUEUED, json.dumps(payload), time.time()))
+        self.wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Look a job up.
+
+        Args:
+            job_id (str): The job id returned by submit.
+
+        Returns:
+            Optional[dict]: The job status, its result once finished, or None if the job is unknown.
+        """
+        row = self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        flags = json.loads(row["flags"]) if row["flags"] else dict()
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "deadline_exceeded": flags.get("deadline_exceeded", False),
+            "stale": flags.get("stale", False),
+            "requeues": row["requeues"],
+        }
+        if row["status"] == self.QUEUED:
+            job["position"] = self.connection().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?",
+                (self.QUEUED, row["created_at"])).fetchone()[0]
+        return job
+
+    def claim(self, worker):
+        """
+        Atomically take the oldest queued job.
+
+        Args:
+            worker (str): Identifier of the consumer claiming the job.
+
+        Returns:
+            Optional[sqlite3.Row]: The claimed job, or None if the queue is empty.
+        """
+        connection = self.connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")  # Serialises claims across processes
+        try:
+            # Jobs whose consumer died mid-run become visible again
+            connection.execute("UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND started_at < ?",
+                               (self.QUEUED, self.RUNNING, now - self.visibility_timeout))
+            row = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                     (self.QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET status = ?, started_at = ?, worker = ? WHERE id = ?",
+                                   (self.RUNNING, now, worker, row["id"]))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def finish(self, job_id, result=None, error=None, flags=None):
+        """
+        Store the outcome of a job and drop finished jobs past their retention.
+
+        Args:
+            job_id (str): The job id.
+            result (Optional[dict]): The analysis of a job that succeeded.
+            error (Optional[str]): Why the job failed.
+            flags (Optional[dict]): The deadline_exceeded and stale flags of the query's outcome.
+        """
+        now = time.time()
+        connection = self.connection()
+        connection.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, flags = ? WHERE id = ?",
+            (self.FAILED if error else self.SUCCEEDED, json.dumps(result), error, now, json.dumps(flags or {}), job_id))
+        connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                           (self.SUCCEEDED, self.FAILED, now - self.retention_seconds))
+
+    def requeue(self, job_id):
+        """Put a claimed job back in the queue, keeping its place."""
+        self.connection().execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, worker = NULL, requeues = requeues + 1 WHERE id = ?",
+            (self.QUEUED, job_id))
+
+    def run_job(self, job):
+        """
+        Run one claimed job through AskViridium.query.
+
+        Args:
+            job (sqlite3.Row): The claimed job.
+        """
+        input_parameters = AskViridiumConstants.input_parameters
+        payload = json.loads(job["payload"])
+        try:
+            outcome = get_ask_viridium().query(
+                payload[input_parameters["material_name"]],
+                payload.get(input_parameters["manufacturer_name"]),
+                payload.get(input_parameters["work_content"]),
+                payload.get(AskViridiumConstants.query_parameters["mode"])
+            )
+        except RateLimitExceededException as e:
+            if job["requeues"] >= self.max_requeues:  # Azure has stayed saturated or failing for too long
+                logger.warning("Job %s failed after %d requeues: %s", job["id"], job["requeues"], e)
+                self.finish(job["id"], error=f"{type(e).__name__}: {e}")
+                return
+            # Azure is saturated, so the job waits in the queue rather than failing
+            logger.warning("Job %s requeued: %s", job["id"], e)
+            self.requeue(job["id"])
+            self.stopping.wait(e.retry_after or self.poll_interval)
+            return
+        except Exception as e:
+            logger.exception("Job %s failed: %s", job["id"], e)
+            self.finish(job["id"], error=f"{type(e).__name__}: {e}")
+            return
+        flags = {"deadline_exceeded": outcome.deadline_exceeded, "stale": outcome.stale}
+        if outcome.result is None:  # Azure failed or the deadline passed; the engine already logged why
+            error = (GlobalConstants.api_response_messages.deadline_exceeded if outcome.deadline_exceeded
+                     else GlobalConstants.api_response_messages.service_unavailable if outcome.failure == "unavailable"
+                     else "Analysis could not be completed")
+            logger.warning("Job %s failed: %s", job["id"], error)
+            self.finish(job["id"], error=error, flags=flags)
+            return
+        self.finish(job["id"], result=outcome.result, flags=flags)
+
+    def consume(self):
+        """Consumer loop: claim and run jobs until the queue is stopped."""
+        worker = f"{os.getpid()}-{threading.get_ident()}"
+        while not self.stopping.is_set():
+            try:
+                job = self.claim(worker)
+            except sqlite3.Error as e:
+                logger.warning("Job queue claim failed: %s", e)
+                job = None
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+            self.run_job(job)
+
+    def start(self, workers):
+        """
+        Start background consumer threads.
+
+        Args:
+            workers (int): Number of consumer threads.
+        """
+        for index in range(workers):
+            thread = threading.Thread(target=self.consume, name=f"job-consumer-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+
+_job_queue = None  # Process-wide JobQueue, created lazily by get_job_queue
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Return the job queue of this process, starting its consumer threads on first use.
+
+    Returns:
+        JobQueue: The shared job queue.
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                config = GlobalConstants.job_queue
+                job_queue = JobQueue(config.path, config.poll_interval, config.visibility_timeout,
+                                     config.retention_seconds, config.max_queued, config.max_requeues)
+                job_queue.start(config.workers)
+                _job_queue = job_queue
+    return _job_queue
+
+
+def _reset_job_queue():
+    """Consumer threads do not survive a fork, so each gunicorn worker starts its own."""
+    global _job_queue, _job_queue_lock
+    _job_queue = None
+    _job_queue_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_job_queue)
+
+
+if __name__ == '__main__':
+    config = GlobalConstants.job_queue
+    standalone_queue = JobQueue(config.path, config.poll_interval, config.visibility_timeout,
+                                config.retention_seconds, config.max_queued, config.max_requeues)
+    logger.info("Running %d job consumers on %s", config.workers, config.path)
+    standalone_queue.start(config.workers)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        standalone_queue.stop()
@@ -0,0 +1,137 @@
+"""
+Prometheus metrics of Ask Viridium AI Service, served in text format on /v1/metrics.
+
+Under gunicorn every worker is its own process, so a scrape reaching one worker would only see that worker's
+numbers. When PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it for the master before any worker
+starts), each worker writes its samples to memory-mapped files in that directory and the /v1/metrics handler
+sums them across live and exited workers. Without it, as under the Flask development server, the metrics of
+the single process are served directly.
+
+Usage:
+    from . import metrics
+
+    with metrics.stage_timer("analysis"):
+        ...
+    metrics.record_usage("analysis", cb.total_tokens, cb.total_cost)
+"""
+
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               generate_latest)
+from prometheus_client import multiprocess
+
+from global_constants import GlobalConstants
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 16000)
+COST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2)
+
+STAGE_DURATION = Histogram("askvai_stage_duration_seconds", "Time spent in each stage of a query",
+                           ["stage"], buckets=LATENCY_BUCKETS)
+STAGE_TOKENS = Histogram("askvai_stage_tokens", "Tokens used by each LLM call", ["stage"], buckets=TOKEN_BUCKETS)
+STAGE_TOKENS_BY_KIND = Histogram("askvai_stage_tokens_by_kind", "Prompt and completion tokens of each LLM call",
+                                 ["stage", "kind"], buckets=TOKEN_BUCKETS)
+STAGE_COST = Histogram("askvai_stage_cost_usd", "Cost of each LLM call in USD", ["stage"], buckets=COST_BUCKETS)
+STAGE_ERRORS = Counter("askvai_stage_errors_total", "Failed stages by exception type", ["stage", "error"])
+
+QUERY_DURATION = Histogram("askvai_query_duration_seconds", "End-to-end time of a query",
+                           ["cached"], buckets=LATENCY_BUCKETS)
+
+HTTP_DURATION = Histogram("askvai_http_request_duration_seconds", "Time spent handling HTTP requests",
+                          ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+HTTP_IN_PROGRESS = Gauge("askvai_http_requests_in_progress", "HTTP requests being handled",
+                         multiprocess_mode="livesum")
+
+CACHE_EVENTS = Counter("askvai_cache_events_total", "Cache lookups, stores, evictions and errors",
+                       ["cache", "event"])
+CACHE_SAVED_TOKENS = Counter("askvai_cache_saved_tokens_total", "Tokens avoided by cache hits", ["cache"])
+CACHE_SAVED_COST = Counter("askvai_cache_saved_cost_usd_total", "LLM cost in USD avoided by cache hits", ["cache"])
+
+SPECULATION_EVENTS = Counter("askvai_speculation_total", "Speculative analyses by outcome", ["outcome"])
+SPECULATION_WASTED_TOKENS = Counter("askvai_speculation_wasted_tokens_total",
+                                    "Tokens spent on discarded speculative analyses")
+
+COALESCE_EVENTS = Counter("askvai_coalesce_total", "Queries that led, joined or abandoned a shared run",
+                          ["role"])
+
+REFERENCE_EVENTS = Counter("askvai_reference_resolutions_total",
+                           "Compositions decided, annotated or left unresolved by the CAS reference", ["outcome"])
+
+PRESCREEN_EVENTS = Counter("askvai_prescreen_total",
+                           "Compositions decided by the fluorine pre-screen or sent to the analysis call", ["outcome"])
+
+DEADLINE_EVENTS = Counter("askvai_deadline_events_total",
+                          "LLM calls that timed out or ran out of budget, and queries that missed their deadline",
+                          ["stage", "event"])
+
+CIRCUIT_BREAKER_EVENTS = Counter("askvai_circuit_breaker_events_total",
+                                 "Circuit breaker transitions, calls it refused and stale results served", ["event"])
+CIRCUIT_BREAKER_STATE = Gauge("askvai_circuit_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+                              multiprocess_mode="livemax")
+
+RATE_LIMIT_WAIT = Histogram("askvai_rate_limit_wait_seconds", "Time LLM calls waited for the rate limiter",
+                            buckets=LATENCY_BUCKETS)
+RATE_LIMIT_EVENTS = Counter("askvai_rate_limit_events_total",
+                            "LLM calls refused by the rate limiter or throttled by Azure", ["event"])
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a stage, whether it succeeds or fails.
+
+    Args:
+        stage (str): composition, analysis or store.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_usage(stage, tokens, cost, prompt_tokens=None, completion_tokens=None):
+    """
+    Record the tokens and cost of an LLM call.
+
+    Args:
+        stage (str): composition or analysis.
+        tokens (int): Total tokens reported by the OpenAI callback.
+        cost (float): Total cost reported by the OpenAI callback.
+        prompt_tokens (Optional[int]): Prompt tokens reported by the OpenAI callback.
+        completion_tokens (Optional[int]): Completion tokens reported by the OpenAI callback.
+    """
+    STAGE_TOKENS.labels(stage).observe(tokens)
+    STAGE_COST.labels(stage).observe(cost)
+    if prompt_tokens is not None:
+        STAGE_TOKENS_BY_KIND.labels(stage, "prompt").observe(prompt_tokens)
+    if completion_tokens is not None:
+        STAGE_TOKENS_BY_KIND.labels(stage, "completion").observe(completion_tokens)
+
+
+def record_error(stage, error):
+    """
+    Count a failed stage.
+
+    Args:
+        stage (str): composition, analysis or store.
+        error (BaseException): The exception the stage failed with.
+    """
+    STAGE_ERRORS.labels(stage, type(error).__name__).inc()
+
+
+def render():
+    """
+    Render every metric in Prometheus text format, summed across workers in multiprocess mode.
+
+    Returns:
+        tuple: The body and its content type.
+    """
+    if GlobalConstants.metrics.multiprocess_dir:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,194 @@
+"""
+Rule-based pre-screen of compositions that cannot contain fluorine.
+
+Every PFAS contains fully fluorinated carbon, so a material whose chemicals cannot contain fluorine is not PFAS.
+Many compositions are plainly fluorine-free, such as silicon carbide, aluminum oxide or nitrogen, yet each of
+them costs a full analysis call. This pre-screen classifies each chemical from its name, formula and CAS number:
+
+    fluorine: the name carries a fluorine marker (fluoro, fluoride, PTFE, PFOA, Teflon, ...), the formula contains
+        F, or the CAS reference lists the number as PFAS.
+    fluorine_free: the CAS reference lists the number as not PFAS, the name is a formula without F, or every word of
+        the name is a known fluorine-free element, compound, mineral or polymer name or a qualifier (liquid,
+        fiber, ...) alongside at least one of those.
+    unknown: anything else, such as trade names and vague terms like "Resin" or "Dye".
+
+Systematic names of fluorinated compounds always carry a fluorine morpheme, and trade names are never in the
+vocabulary, so unknown words keep a chemical out of fluorine_free. Only when every chemical is fluorine_free is
+the material decided as PFAS (No) without the analysis call; otherwise the analysis runs as usual.
+
+Usage:
+    prescreen = PreScreen()
+    prescreen.classify({"name": "Aluminum Oxide", "cas_no": "1344-28-1"})  # "fluorine_free"
+    result = prescreen.screen("Vitrified Bonded Stick", chemical_composition)  # MaterialInfo dict or None
+"""
+
+import re
+import threading
+
+from . import metrics
+from .reference import NOT_PFAS, PFAS
+
+FLUORINE, FLUORINE_FREE, UNKNOWN = "fluorine", "fluorine_free", "unknown"
+
+# Names and acronyms of fluorinated substances and fluoropolymer brands that do not spell out fluorine
+FLUORINE_MARKERS = {
+    "ptfe", "pvdf", "pvf", "fep", "pfa", "etfe", "ectfe", "pctfe", "fkm", "ffkm", "fepm", "pfpe", "pfoa", "pfos",
+    "pfas", "pfc", "pfcs", "pfhxs", "pfhxa", "pfna", "pfda", "pfba", "pfbs", "genx", "hfpo", "hfp", "tfe", "vdf",
+    "teflon", "viton", "nafion", "krytox", "fomblin", "zonyl", "capstone", "kynar", "halar", "tefzel", "kalrez",
+    "aflas", "dyneon", "fluon", "hostaflon", "scotchgard", "goretex", "gore", "opteon", "freon", "novec",
+}
+
+ELEMENTS = {
+    "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K", "Ca",
+    "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga", "Ge", "As", "Se", "Br", "Kr", "Rb", "Sr", "Y",
+    "Zr", "Nb", "Mo", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe", "Cs", "Ba", "La", "Ce", "Nd",
+    "Hf", "Ta", "W", "Re", "Os", "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi",
+}
+FORMULA_PATTERN = re.compile(r"^(?:[A-Z][a-z]?\d*)+$")
+ELEMENT_PATTERN = re.compile(r"([A-Z][a-z]?)\d*")
+
+SUBSTANCES = {
+    # Elements other than fluorine
+    "hydrogen", "helium", "lithium", "boron", "carbon", "nitrogen", "oxygen", "neon", "sodium", "magnesium",
+    "aluminum", "aluminium", "silicon", "phosphorus", "sulfur", "sulphur", "chlorine", "argon", "potassium",
+    "calcium", "titanium", "vanadium", "chromium", "manganese", "iron", "cobalt", "nickel", "copper", "zinc",
+    "bromine", "krypton", "strontium", "zirconium", "molybdenum", "silver", "tin", "antimony", "iodine", "xenon",
+    "barium", "cerium", "tungsten", "platinum", "gold", "lead", "bismuth", "ferric", "ferrous", "cupric",
+    # Inorganic compounds
+    "oxide", "dioxide", "trioxide", "monoxide", "carbide", "nitride", "boride", "carbonate", "bicarbonate",
+    "hydroxide", "sulfate", "sulphate", "sulfide", "sulfite", "chloride", "bromide", "iodide", "nitrate",
+    "nitrite", "phosphate", "silicate", "aluminate", "titanate", "borate", "acetate", "citrate", "stearate",
+    "oxalate", "hydrate", "peroxide", "alumina", "silica", "zirconia", "ammonia", "ammonium", "water",
+    # Minerals and materials
+    "kaolin", "clay", "feldspar", "mica", "talc", "quartz", "glass", "cement", "gypsum", "limestone", "dolomite",
+    "graphite", "corundum", "bentonite", "wollastonite", "diamond", "steel", "brass", "bronze", "cotton",
+    # Organic compounds and nomenclature
+    "methyl", "ethyl", "propyl", "butyl", "pentyl", "hexyl", "octyl", "isopropyl", "isobutyl", "monobutyl",
+    "phenyl", "benzyl", "vinyl", "methanol", "ethanol", "propanol", "butanol", "alcohol", "glycol", "ether",
+    "ester", "ketone", "acetone", "toluene", "xylene", "benzene", "hexane", "heptane", "methane", "ethane",
+    "propane", "butane", "ethylene", "propylene", "styrene", "phenol", "phenolic", "formaldehyde", "glycerol",
+    "glycerin", "urea", "acrylic", "acrylate", "methacrylate", "epoxy", "bisphenol", "silicone", "siloxane",
+    "cellulose", "starch", "naphtha", "paraffin", "petroleum", "distillates", "hydrocarbon", "acetic", "citric",
+    "stearic", "carbonic", "sulfuric", "nitric", "phosphoric", "hydrochloric",
+    # Polymers
+    "polyester", "nylon", "polyamide", "polyethylene", "polypropylene", "polystyrene", "polyurethane",
+    "polycarbonate", "polyvinyl", "rubber", "latex", "neoprene", "rayon",
+}
+QUALIFIERS = {
+    "fiber", "fibre", "fibers", "cloth", "fabric", "backing", "liquid", "solid", "powder", "cryogenic",
+    "compressed", "gas", "grade", "pure", "fused", "natural", "synthetic", "resin", "polymer", "copolymer",
+    "aqueous", "solution", "crystalline", "amorphous", "anhydrous", "black", "white", "grey", "gray", "mineral",
+    "oil", "wax", "acid", "and", "of", "with", "in", "mono", "di", "tri", "n", "iso", "tert", "sec", "alpha", "beta",
+}
+
+
+class PreScreen:
+    def __init__(self, reference=None):
+        """
+        Initialize the pre-screen.
+
+        Args:
+            reference (Optional[CasReference]): CAS reference consulted before the names.
+        """
+        self.reference = reference
+        self.lock = threading.Lock()  # Guards the counters
+        self.counters = {"decided": 0, "fluorine": 0, "unknown": 0}
+
+    def classify(self, chemical):
+        """
+        Classify a chemical of a composition.
+
+        Args:
+            chemical (dict): A ChemicalInfo dict with name and cas_no.
+
+        Returns:
+            str: FLUORINE, FLUORINE_FREE or UNKNOWN.
+        """
+        if self.reference is not None:
+            status = self.reference.statuses([chemical.get("cas_no")])[0]
+            if status == PFAS:
+                return FLUORINE
+            if status == NOT_PFAS:
+                return FLUORINE_FREE
+
+        name = str(chemical.get("name") or "")
+        if "fluor" in name.casefold():
+            return FLUORINE
+        tokens = [token for token in re.split(r"[^A-Za-z0-9]+", name) if token and not token.isdigit()]
+        words = [token.casefold() for token in tokens]
+        if any(word in FLUORINE_MARKERS for word in words):
+            return FLUORINE
+
+        substance = False
+        for token, word in zip(tokens, words):
+            if FORMULA_PATTERN.match(token) and word not in SUBSTANCES and word not in QUALIFIERS:
+                elements = ELEMENT_PATTERN.findall(token)
+                if not set(elements) <= ELEMENTS:
+                    return UNKNOWN
+                if "F" in elements:
+                    return FLUORINE
+                substance = True
+            elif word in SUBSTANCES:
+                substance = True
+            elif word not in QUALIFIERS:
+                return UNKNOWN
+        return FLUORINE_FREE if substance else UNKNOWN
+
+    def count(self, outcome):
+        with self.lock:
+            self.counters[outcome] += 1
+        metrics.PRESCREEN_EVENTS.labels(outcome).inc()
+
+    def screen(self, material, chemical_composition):
+        """
+        Decide a material as PFAS (No) when none of its chemicals can contain fluorine.
+
+        Args:
+            material (str): The name of the material.
+            chemical_composition (Optional[dict]): The composition returned by the chemical info chain.
+
+        Returns:
+            Optional[dict]: A MaterialInfo dict, or None if the analysis call is needed.
+        """
+        chemicals = (chemical_composition or dict()).get("chemicals") or list()
+        classes = [self.classify(chemical) for chemical in chemicals]
+        if FLUORINE in classes:
+            self.count("fluorine")
+            return None
+        if not chemicals or UNKNOWN in classes:
+            self.count("unknown")
+            return None
+
+        self.count("decided")
+        names = ", ".join(chemical["name"] for chemical in chemicals)
+        return {
+            "analyzed_material": material,
+            "composition": names,
+            "analysis_method": "Rule-based fluorine pre-screen of the chemical names, formulas and CAS numbers",
+            "decision": "PFAS (No)",
+            "confidence": 0.85,
+            "primary_reason": f"None of the chemicals of the composition can contain fluorine: {names}.",
+            "secondary_reason": "PFAS contain fully fluorinated carbon atoms, so fluorine-free materials are not PFAS.",
+            "evidence": [f"{chemical['name']} is fluorine-free" for chemical in chemicals],
+            "health_problems": list(),
+            "confidence_level": "High",
+            "recommendation": "No further investigation is needed unless the composition is incomplete.",
+            "suggestion": None,
+            "limitations_and_uncertainties": "The decision relies on the reported composition; undisclosed or "
+                                             "proprietary ingredients and fluorinated surface treatments are not "
+                                             "covered.",
+        }
+
+    def stats(self):
+        """
+        Pre-screen counters of this process.
+
+        Returns:
+            dict: Compositions decided without the analysis call, or sent to it because a chemical may contain
+                fluorine or is unknown.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        screened = sum(stats.values())
+        stats["decided_ratio"] = round(stats["decided"] / screened, 4) if screened else 0.0
+        return stats
@@ -0,0 +1,88 @@
+"""
+Assembly of the prompts of the LLM stages.
+
+Each stage's system prompt is a template file with an {example} placeholder. It is read and rendered once per
+process, and the result goes into the chain as a fixed system message, so it is not formatted again on every
+call. Every call therefore starts with the same bytes: the function schema, then this system message. Only the
+human message after them changes. Azure OpenAI caches prompt prefixes of 1024 tokens or more that repeat
+exactly, and bills cached tokens at a discount.
+
+Two variants exist. "full" renders the original templates the way ChatPromptTemplate always did, with the
+example as a Python dict. "compact" uses condensed templates that keep every rule, and renders the example
+as minified JSON.
+
+Usage:
+    prompt = build_prompt("analysis", "compact")
+    chain = prompt | model | parser
+"""
+
+import json
+import os
+from functools import lru_cache
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import SystemMessage
+
+from global_constants import GlobalConstants
+
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(__file__), "system_prompt_templates")
+VARIANTS = ("full", "compact")
+
+TEMPLATES = {
+    ("composition", "full"): "findchemicals_prompt.txt",
+    ("composition", "compact"): "findchemicals_compact.txt",
+    ("analysis", "full"): "new_prompt.txt",
+    ("analysis", "compact"): "analysis_compact.txt",
+    ("combined", "full"): "combined_prompt.txt",
+    ("combined", "compact"): "combined_compact.txt",
+}
+EXAMPLES = {
+    "composition": GlobalConstants.chemical_composition_example,
+    "analysis": GlobalConstants.analysis_example,
+    "combined": {"chemical_composition": GlobalConstants.chemical_composition_example,
+                 "analysis": GlobalConstants.analysis_example},
+}
+HUMAN_MESSAGES = {
+    "composition": "Material Name: {material}",
+    "analysis": "Material Name: {material}, manufactured by {manufacturer}. "
+                "Its chemical composition is: {chemical_composition}.",
+    "combined": "Material Name: {material}, manufactured by {manufacturer}.",
+}
+
+
+@lru_cache(maxsize=None)
+def system_prompt(stage, variant="full"):
+    """
+    Render the system prompt of a stage, once per process.
+
+    Args:
+        stage (str): composition, analysis or combined.
+        variant (str): full or compact.
+
+    Returns:
+        str: The rendered system prompt.
+    """
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown prompt variant {variant!r}, expected one of {VARIANTS}")
+    with open(os.path.join(TEMPLATE_DIRECTORY, TEMPLATES[stage, variant]), "r") as file:
+        template = file.read()
+    example = EXAMPLES[stage]
+    rendered_example = str(example) if variant == "full" else json.dumps(example, separators=(",", ":"))
+    return template.replace("{example}", rendered_example)
+
+
+def build_prompt(stage, variant="full"):
+    """
+    Build the prompt template of a stage: the rendered system prompt, then the human message of the query.
+
+    Args:
+        stage (str): composition, analysis or combined.
+        variant (str): full or compact.
+
+    Returns:
+        ChatPromptTemplate: The prompt, whose only input variables are those of the human message.
+    """
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=system_prompt(stage, variant)),
+        ("human", HUMAN_MESSAGES[stage]),
+    ])
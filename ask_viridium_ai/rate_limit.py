@@ -0,0 +1,299 @@
+"""
+Client-side rate limiting of the Azure OpenAI calls, shared by every gunicorn worker on the host.
+
+Azure OpenAI deployments have a requests-per-minute and a tokens-per-minute quota. When a burst of queries
+reaches every worker at once, all of them call Azure together, get throttled, and the query fails. Instead,
+each call first reserves one request and its estimated tokens from two token buckets kept in a SQLite file.
+A call that finds a bucket short is given the time until the bucket refills enough and sleeps for it, so a
+burst is queued and spread over the quota instead of being rejected. Reservations may drive a bucket
+negative, which queues later callers behind earlier ones across all workers. When a call finishes, the
+tokens bucket is corrected by the difference between the estimated and the actual usage.
+
+If the wait for a reservation would exceed max_wait, or leave the query too little time before its deadline,
+the call is refused with RateLimitExceededException (429 to the client, with Retry-After). When Azure answers
+429 anyway, e.g. because another host shares the deployment, the buckets are emptied for the Retry-After Azure
+gave so every worker backs off, and the call is retried with jittered exponential backoff. If Azure is still
+throttling after max_retries, UpstreamThrottledException is raised (503 to the client). Connection errors and
+5xx answers are retried the same way, without emptying the buckets. The model must make no retries of its own
+(max_retries=0), so that every attempt reserves its share of the quota.
+
+Usage:
+    limiter = RateLimiter("data_dump/rate_limit.sqlite3", requests_per_minute=360, tokens_per_minute=60000)
+    model = rate_limited(llm.bind_functions(...), limiter, "analysis")  # llm built with max_retries=0
+    chain = prompt | model | parser
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from . import metrics
+from .tracking import AppInsightsConnector
+from utils.exceptions import RateLimitExceededException, UpstreamThrottledException
+
+logger = AppInsightsConnector().get_logger()
+
+# Bucket capacity in seconds of quota. Azure enforces its per-minute quotas over 1-10 second windows, so a short
+# burst allowance keeps a 10 second window within 1.2 times the configured rate; configure the limits a little
+# below the deployment's quota.
+BURST_SECONDS = 2
+
+
+class RateLimiter:
+    """Requests and tokens buckets stored in SQLite, refilled continuously at the per-minute rates."""
+
+    def __init__(self, path, requests_per_minute, tokens_per_minute, max_wait=30.0, max_retries=3,
+                 backoff_seconds=1.0, estimated_tokens=1500):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            path (str): Location of the SQLite file shared by all workers.
+            requests_per_minute (int): Calls allowed per minute across all workers.
+            tokens_per_minute (int): Tokens allowed per minute across all workers.
+            max_wait (float): Longest a call may wait for its reservation before it is refused.
+            max_retries (int): Retries of a call Azure answered with 429.
+            backoff_seconds (float): Base of the exponential backoff between retries.
+            estimated_tokens (int): Tokens reserved for a call of a stage not seen yet.
+        """
+        self.path = path
+        self.rates = {"requests": requests_per_minute / 60, "tokens": tokens_per_minute / 60}  # Per second
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.default_estimate = estimated_tokens
+
+        self.estimates = dict()  # stage -> moving average of the tokens its calls used
+        self.lock = threading.Lock()  # Guards the estimates
+        self.local = threading.local()  # One SQLite connection per thread
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)")
+        for name, rate in self.rates.items():
+            self.connection().execute("INSERT OR IGNORE INTO buckets (name, level, updated_at) VALUES (?, ?, ?)",
+                                      (name, rate * BURST_SECONDS, now))
+
+    def connection(self):
+        """Return this thread's SQLite connection, opening it on first use."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def estimate(self, stage):
+        """Tokens to reserve for a call of a stage."""
+        with self.lock:
+            return self.estimates.get(stage, self.default_estimate)
+
+    def update(self, changes, now):
+        """
+        Refill both buckets and apply changes to their levels in one transaction.
+
+        Args:
+            changes (Callable): Given the refilled levels, returns the new levels or None to keep them.
+            now (float): The current time.
+
+        Returns:
+            dict: The refilled levels, before the changes.
+        """
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")  # Serialises reservations across processes
+        try:
+            levels = dict()
+            for name, level, updated_at in connection.execute("SELECT name, level, updated_at FROM buckets"):
+                rate = self.rates[name]
+                levels[name] = min(rate * BURST_SECONDS, level + max(0.0, now - updated_at) * rate)
+            new_levels = changes(levels)
+            if new_levels is not None:
+                connection.executemany("UPDATE buckets SET level = ?, updated_at = ? WHERE name = ?",
+                                       [(level, now, name) for name, level in new_levels.items()])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return levels
+
+    def reserve(self, tokens, max_wait=None):
+        """
+        Reserve one request and an estimated number of tokens.
+
+        Args:
+            tokens (int): Tokens the call is expected to use.
+            max_wait (Optional[float]): Longest this call may wait, e.g. the slack left by its query's deadline;
+                the limiter's max_wait if it is longer.
+
+        Returns:
+            float: Seconds to wait before making the call.
+
+        Raises:
+            RateLimitExceededException: If the wait would be longer than max_wait; nothing is reserved.
+        """
+        cost = {"requests": 1, "tokens": tokens}
+        limit = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        wait = 0.0
+
+        def take(levels):
+            nonlocal wait
+            wait = max(max(0.0, cost[name] - level) / self.rates[name] for name, level in levels.items())
+            if wait > limit:
+                return None
+            return {name: level - cost[name] for name, level in levels.items()}
+
+        self.update(take, time.time())
+        if wait > limit:
+            metrics.RATE_LIMIT_EVENTS.labels("rejected").inc()
+            raise RateLimitExceededException(details={"wait": round(wait, 1)}, retry_after=wait)
+        metrics.RATE_LIMIT_WAIT.observe(wait)
+        return wait
+
+    def settle(self, stage, reserved, used):
+        """
+        Correct the tokens bucket once the actual usage of a call is known.
+
+        Args:
+            stage (str): composition or analysis.
+            reserved (int): Tokens reserved for the call.
+            used (int): Tokens the call used.
+        """
+        if used:  # Failed calls report no usage and say nothing about the next call
+            with self.lock:
+                previous = self.estimates.get(stage)
+                self.estimates[stage] = used if previous is None else round(0.8 * previous + 0.2 * used)
+        if used != reserved:  # Never above the burst allowance, which the refill may have reached meanwhile
+            capacity = self.rates["tokens"] * BURST_SECONDS
+            self.update(lambda levels: dict(levels, tokens=min(capacity, levels["tokens"] + reserved - used)),
+                        time.time())
+
+    def throttled(self, retry_after):
+        """
+        Empty both buckets for retry_after seconds, so every worker backs off after Azure answered 429.
+
+        Args:
+            retry_after (float): Seconds Azure asked to wait.
+        """
+        metrics.RATE_LIMIT_EVENTS.labels("throttled").inc()
+        self.update(lambda levels: {name: min(level, -self.rates[name] * retry_after)
+                                    for name, level in levels.items()}, time.time())
+
+    def backoff(self, attempt, error):
+        """
+        Seconds to wait before retrying a call Azure answered with 429, or that failed on a connection error or 5xx.
+
+        Args:
+            attempt (int): Retries made so far.
+            error (Exception): The error the call failed with.
+
+        Returns:
+            float: Azure's Retry-After when given, else full-jitter exponential backoff.
+        """
+        retry_after = retry_after_seconds(error)
+        backoff = random.uniform(0, self.backoff_seconds * 2 ** attempt)
+        return (retry_after + random.uniform(0, self.backoff_seconds)) if retry_after is not None else backoff
+
+
+def retry_after_seconds(error):
+    """The Retry-After Azure sent with a 429, in seconds, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or dict()
+    for header, scale in [("retry-after-ms", 1000), ("retry-after", 1)]:
+        try:
+            return float(headers[header]) / scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def total_tokens(message):
+    """Tokens reported in the usage of a chat model response."""
+    usage = getattr(message, "response_metadata", dict()).get("token_usage") or dict()
+    return usage.get("total_tokens") or 0
+
+
+def rate_limited(model, limiter, stage, deadline=None):
+    """
+    Wrap a chat model so every call goes through the rate limiter.
+
+    The wrapper is a Runnable, so the chains' invoke, ainvoke, batch and abatch are all limited, and the
+    callbacks given to the chain still see the model call.
+
+    Args:
+        model (Runnable): The chat model, with its functions bound, from a client without SDK retries.
+        limiter (RateLimiter): The shared limiter.
+        stage (str): composition or analysis, whose token usage is estimated separately.
+        deadline (Optional[Deadline]): The query's deadline. A call is refused rather than queued past it.
+
+    Returns:
+        Runnable: The wrapped model.
+    """
+
+    def call(messages, config):
+        for attempt in range(limiter.max_retries + 1):
+            reserved = limiter.estimate(stage)
+            wait = limiter.reserve(reserved, deadline.slack() if deadline else None)
+            try:
+                time.sleep(wait)
+                message = model.invoke(messages, config)
+            except RateLimitError as e:
+                limiter.settle(stage, reserved, 0)
+                if attempt == limiter.max_retries:
+                    raise UpstreamThrottledException(details=str(e), retry_after=retry_after_seconds(e)) from e
+                delay = limiter.backoff(attempt, e)
+                logger.warning("Azure OpenAI throttled the %s call, retrying in %.1f s", stage, delay)
+                limiter.throttled(delay)
+                continue
+            except (APIConnectionError, InternalServerError) as e:
+                limiter.settle(stage, reserved, 0)
+                if attempt == limiter.max_retries or (deadline is not None and deadline.exhausted()):
+                    raise
+                delay = limiter.backoff(attempt, e)
+                logger.warning("The %s call failed with %s, retrying in %.1f s", stage, type(e).__name__, delay)
+                time.sleep(min(delay, deadline.remaining()) if deadline else delay)
+                continue
+            except BaseException:
+                limiter.settle(stage, reserved, 0)  # Cut by the deadline, timed out, failed or cancelled
+                raise
+            limiter.settle(stage, reserved, total_tokens(message))
+            return message
+
+    async def acall(messages, config):
+        for attempt in range(limiter.max_retries + 1):
+            reserved = limiter.estimate(stage)
+            wait = await asyncio.to_thread(limiter.reserve, reserved, deadline.slack() if deadline else None)
+            try:
+                await asyncio.sleep(wait)
+                message = await model.ainvoke(messages, config)
+            except RateLimitError as e:
+                await asyncio.to_thread(limiter.settle, stage, reserved, 0)
+                if attempt == limiter.max_retries:
+                    raise UpstreamThrottledException(details=str(e), retry_after=retry_after_seconds(e)) from e
+                delay = limiter.backoff(attempt, e)
+                logger.warning("Azure OpenAI throttled the %s call, retrying in %.1f s", stage, delay)
+                await asyncio.to_thread(limiter.throttled, delay)
+                continue
+            except (APIConnectionError, InternalServerError) as e:
+                await asyncio.to_thread(limiter.settle, stage, reserved, 0)
+                if attempt == limiter.max_retries or (deadline is not None and deadline.exhausted()):
+                    raise
+                delay = limiter.backoff(attempt, e)
+                logger.warning("The %s call failed with %s, retrying in %.1f s", stage, type(e).__name__, delay)
+                await asyncio.sleep(min(delay, deadline.remaining()) if deadline else delay)
+                continue
+            except BaseException:
+                await asyncio.to_thread(limiter.settle, stage, reserved, 0)
+                raise
+            await asyncio.to_thread(limiter.settle, stage, reserved, total_tokens(message))
+            return message
+
+    return RunnableLambda(call, afunc=acall, name=f"rate_limited_{stage}")
@@ -0,0 +1,199 @@
+"""
+Lookup of CAS numbers against a reference list of known PFAS and known non-PFAS chemicals.
+
+The composition stage returns a CAS number for every chemical, but the analysis stage asks the LLM to decide
+the PFAS status from scratch. When the reference list knows the chemicals, the decision does not need the LLM.
+If one chemical is a listed PFAS, the material is PFAS (Yes). If every chemical is listed as non-PFAS, it is
+PFAS (No). Otherwise the analysis call runs, and the chemicals the list knows are annotated with their status.
+
+The list is a CSV (cas_no, name, pfas) compiled into two NumPy arrays: the CAS numbers as sorted int64, and
+the PFAS flag of each. Workers memory-map the compiled arrays, so they share one copy in the page cache
+however long the list is, and look numbers up with np.searchsorted. The arrays are recompiled when the CSV
+is newer, e.g. after merging an export of the EPA CompTox PFAS lists into it.
+
+Usage:
+    reference = CasReference.load("data_dump/cas_reference", "ask_viridium_ai/reference_data/cas_reference.csv")
+    reference.statuses(["9002-84-0", "7732-18-5", "not a CAS number"])  # [1, 0, -1]
+"""
+
+import csv
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+from . import metrics
+from .tracking import AppInsightsConnector
+
+logger = AppInsightsConnector().get_logger()
+
+UNKNOWN, NOT_PFAS, PFAS = -1, 0, 1
+LABELS = {PFAS: "listed as PFAS", NOT_PFAS: "listed as not PFAS", UNKNOWN: "not in the reference list"}
+CAS_PATTERN = re.compile(r"^(\d{2,7})-(\d{2})-(\d)$")
+
+
+def parse_cas(cas_no):
+    """
+    Parse a CAS registry number, checking its check digit.
+
+    Args:
+        cas_no (Optional[str]): The number as written, e.g. "335-67-1".
+
+    Returns:
+        int: The digits as an integer, e.g. 335671, or -1 if the number is malformed.
+    """
+    match = CAS_PATTERN.match(str(cas_no or "").strip())
+    if match is None:
+        return -1
+    digits = match.group(1) + match.group(2)
+    checksum = sum(position * int(digit) for position, digit in enumerate(reversed(digits), 1)) % 10
+    return int(digits + match.group(3)) if checksum == int(match.group(3)) else -1
+
+
+def compile_reference(source, directory):
+    """
+    Compile a reference CSV into the arrays CasReference memory-maps.
+
+    Args:
+        source (str): CSV with cas_no, name and pfas (yes/no) columns.
+        directory (str): Directory receiving cas_numbers.npy and pfas.npy.
+
+    Returns:
+        int: The number of CAS numbers compiled.
+    """
+    entries = dict()
+    with open(source, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            number = parse_cas(row["cas_no"])
+            if number < 0:
+                logger.warning("Skipping malformed CAS number in %s: %s", source, row["cas_no"])
+                continue
+            # A number listed as PFAS anywhere stays PFAS
+            entries[number] = max(entries.get(number, NOT_PFAS), PFAS if row["pfas"].lower() == "yes" else NOT_PFAS)
+
+    numbers = np.array(sorted(entries), dtype=np.int64)
+    flags = np.array([entries[number] for number in numbers], dtype=np.int8)
+    os.makedirs(directory, exist_ok=True)
+    for name, array in [("cas_numbers.npy", numbers), ("pfas.npy", flags)]:
+        # Written aside and renamed, so a worker never maps a half-written file
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".npy")
+        with os.fdopen(descriptor, "wb") as file:
+            np.save(file, array)
+        os.replace(temporary, os.path.join(directory, name))
+    return len(numbers)
+
+
+class CasReference:
+    def __init__(self, numbers, flags):
+        """
+        Initialize the reference from compiled arrays.
+
+        Args:
+            numbers (np.ndarray): Sorted CAS numbers as int64.
+            flags (np.ndarray): PFAS (1) or NOT_PFAS (0) for each number.
+        """
+        self.numbers = numbers
+        self.flags = flags
+        self.lock = threading.Lock()  # Guards the counters
+        self.counters = {"decided": 0, "annotated": 0, "unresolved": 0}
+
+    @classmethod
+    def load(cls, directory, source=None):
+        """
+        Memory-map the compiled reference, compiling it first if it is missing or older than its source.
+
+        Args:
+            directory (str): Directory holding the compiled arrays.
+            source (Optional[str]): The reference CSV.
+
+        Returns:
+            CasReference: The reference.
+        """
+        numbers_path = os.path.join(directory, "cas_numbers.npy")
+        if source and (not os.path.exists(numbers_path)
+                       or os.path.getmtime(numbers_path) < os.path.getmtime(source)):
+            logger.info("Compiled %d CAS numbers from %s", compile_reference(source, directory), source)
+        return cls(np.load(numbers_path, mmap_mode="r"), np.load(os.path.join(directory, "pfas.npy"), mmap_mode="r"))
+
+    def statuses(self, cas_numbers):
+        """
+        Look CAS numbers up.
+
+        Args:
+            cas_numbers (list): CAS numbers as written.
+
+        Returns:
+            np.ndarray: PFAS, NOT_PFAS or UNKNOWN for each number.
+        """
+        numbers = np.fromiter((parse_cas(cas_no) for cas_no in cas_numbers), dtype=np.int64, count=len(cas_numbers))
+        if not len(self.numbers):
+            return np.full(len(numbers), UNKNOWN, dtype=np.int8)
+        positions = np.minimum(np.searchsorted(self.numbers, numbers), len(self.numbers) - 1)
+        return np.where(self.numbers[positions] == numbers, self.flags[positions], UNKNOWN).astype(np.int8)
+
+    def count(self, outcome):
+        with self.lock:
+            self.counters[outcome] += 1
+        metrics.REFERENCE_EVENTS.labels(outcome).inc()
+
+    def resolve(self, material, chemical_composition, decide=True):
+        """
+        Decide the PFAS status of a material from its composition, when the reference knows enough.
+
+        Args:
+            material (str): The name of the material.
+            chemical_composition (Optional[dict]): The composition returned by the chemical info chain.
+            decide (bool): Whether to decide at all, or only annotate the chemicals for the analysis call.
+
+        Returns:
+            tuple: A MaterialInfo dict, or None if the analysis call is needed, and the chemicals list to give
+                that call, with the status of the chemicals the reference knows.
+        """
+        chemicals = (chemical_composition or dict()).get("chemicals") or list()
+        statuses = self.statuses([chemical.get("cas_no") for chemical in chemicals])
+        described = [chemical["name"] if status == UNKNOWN else
+                     f"{chemical['name']} (CAS {chemical['cas_no']}, {LABELS[status]})"
+                     for chemical, status in zip(chemicals, statuses)]
+
+        if not decide or not chemicals or (PFAS not in statuses and UNKNOWN in statuses):
+            self.count("annotated" if (statuses != UNKNOWN).any() else "unresolved")
+            return None, described
+
+        self.count("decided")
+        pfas = [chemical for chemical, status in zip(chemicals, statuses) if status == PFAS]
+        listed = ", ".join(f"{chemical['name']} ({chemical['cas_no']})" for chemical in (pfas or chemicals))
+        return {
+            "analyzed_material": material,
+            "composition": ", ".join(chemical["name"] for chemical in chemicals),
+            "analysis_method": "CAS number lookup against a reference list of PFAS and non-PFAS chemicals",
+            "decision": "PFAS (Yes)" if pfas else "PFAS (No)",
+            "confidence": 0.9,
+            "primary_reason": (f"The composition contains listed PFAS: {listed}." if pfas else
+                               f"Every chemical of the composition is listed as not PFAS: {listed}."),
+            "secondary_reason": None,
+            "evidence": [f"{chemical['name']} (CAS {chemical['cas_no']}) is {LABELS[status]}"
+                         for chemical, status in zip(chemicals, statuses)],
+            "health_problems": list(),
+            "confidence_level": "High",
+            "recommendation": ("Treat the material as containing PFAS." if pfas else
+                               "No further investigation is needed unless the composition is incomplete."),
+            "suggestion": None,
+            "limitations_and_uncertainties": "The decision relies on the reported composition; undisclosed or "
+                                             "proprietary ingredients are not covered.",
+        }, described
+
+    def stats(self):
+        """
+        Resolution counters of this process.
+
+        Returns:
+            dict: Queries decided without the analysis call, annotated or unresolved, and the listed numbers.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        resolutions = sum(stats.values())
+        stats["decided_ratio"] = round(stats["decided"] / resolutions, 4) if resolutions else 0.0
+        stats["entries"] = len(self.numbers)
+        return stats
@@ -0,0 +1,143 @@
+"""
+Request/response logging for the API entry points.
+
+The amount of detail is set by REQUEST_LOG_MODE:
+    off      nothing is logged
+    summary  one line per request, written with the response: method, path, status, size and duration (the default)
+    sampled  a REQUEST_LOG_SAMPLE_RATIO fraction of requests is logged in full, the rest not at all
+    full     every request is logged with its headers and body
+
+Headers listed in REQUEST_LOG_REDACT_HEADERS are masked, and bodies are cut to REQUEST_LOG_MAX_BODY_BYTES.
+Detail is only gathered for requests that will be logged in full, and all messages use lazy %-formatting, so
+summary mode costs a single log call per request.
+"""
+
+import random
+
+from global_constants import GlobalConstants
+
+REDACTED = "[REDACTED]"
+
+
+class RequestLogger:
+    OFF = "off"
+    SUMMARY = "summary"
+    SAMPLED = "sampled"
+    FULL = "full"
+
+    def __init__(self, logger, mode=SUMMARY, sample_ratio=0.01, max_body_bytes=2048, redacted_headers=()):
+        """
+        Initialize the request logger.
+
+        Args:
+            logger (logging.Logger): The service logger.
+            mode (str): One of off, summary, sampled or full.
+            sample_ratio (float): Fraction of requests logged in full in sampled mode.
+            max_body_bytes (int): Bytes of a body kept in the log; the rest is replaced by its length.
+            redacted_headers (Iterable[str]): Header names, in any case, whose values are masked.
+        """
+        if mode not in (self.OFF, self.SUMMARY, self.SAMPLED, self.FULL):
+            raise ValueError(f"Unknown request logging mode: {mode}")
+        self.logger = logger
+        self.mode = mode
+        self.sample_ratio = sample_ratio
+        self.max_body_bytes = max_body_bytes
+        self.redacted_headers = {name.strip().lower() for name in redacted_headers if name.strip()}
+
+    def detail(self):
+        """
+        Decide how much of the current request to log.
+
+        Returns:
+            Optional[str]: SUMMARY or FULL, or None if the request is not logged.
+        """
+        if self.mode == self.SAMPLED:
+            return self.FULL if random.random() < self.sample_ratio else None
+        if self.mode == self.OFF:
+            return None
+        return self.mode
+
+    def redact(self, headers):
+        """
+        Mask sensitive header values.
+
+        Args:
+            headers (Iterable[tuple]): (name, value) pairs, as str or bytes.
+
+        Returns:
+            dict: The headers with redacted values masked.
+        """
+        redacted = dict()
+        for name, value in headers:
+            if isinstance(name, bytes):
+                name, value = name.decode("latin-1"), value.decode("latin-1")
+            redacted[name] = REDACTED if name.lower() in self.redacted_headers else value
+        return redacted
+
+    def truncate(self, body):
+        """
+        Cap a body to max_body_bytes.
+
+        Args:
+            body (bytes): The body.
+
+        Returns:
+            str: The decoded body, with the size of anything cut off appended.
+        """
+        if len(body) <= self.max_body_bytes:
+            return body.decode("utf-8", errors="replace")
+        return (body[:self.max_body_bytes].decode("utf-8", errors="replace")
+                + f"... [{len(body) - self.max_body_bytes} more bytes]")
+
+    def log_request(self, detail, method, path, headers=(), body=b""):
+        """
+        Log an incoming request. Only full detail logs on arrival; a summary is written with the response.
+
+        Args:
+            detail (Optional[str]): The value returned by detail() for this request.
+            method (str): The HTTP method.
+            path (str): The request path.
+            headers (Iterable[tuple]): The request headers; only read in full detail.
+            body (bytes): The request body; only read in full detail.
+        """
+        if detail == self.FULL:
+            self.logger.info("API REQUEST : %s %s - Headers: %s - Body: %s",
+                             method, path, self.redact(headers), self.truncate(body))
+
+    def log_response(self, detail, method, path, status, duration, size=None, headers=(), body=None):
+        """
+        Log an outgoing response.
+
+        Args:
+            detail (Optional[str]): The value returned by detail() for the request.
+            method (str): The HTTP method of the request.
+            path (str): The request path.
+            status (Union[int, str]): The response status.
+            duration (float): Seconds spent handling the request.
+            size (Optional[int]): Length of the body in bytes, None when streamed.
+            headers (Iterable[tuple]): The response headers; only read in full detail.
+            body (Optional[bytes]): The response body; only read in full detail, None when streamed.
+        """
+        if detail is None:
+            return
+        size = "streamed" if size is None else f"{size} bytes"
+        if detail == self.SUMMARY:
+            self.logger.info("API RESPONSE : %s %s - %s - %s in %.1f ms", method, path, status, size, duration * 1000)
+        else:
+            self.logger.info("API RESPONSE : %s %s - %s - %s in %.1f ms - Headers: %s - Body: %s",
+                             method, path, status, size, duration * 1000, self.redact(headers),
+                             "<streamed>" if body is None else self.truncate(body))
+
+
+def get_request_logger(logger):
+    """
+    Build the request logger configured by the request_logging settings.
+
+    Args:
+        logger (logging.Logger): The service logger.
+
+    Returns:
+        RequestLogger: The request logger.
+    """
+    config = GlobalConstants.request_logging
+    return RequestLogger(logger, config.mode, config.sample_ratio, config.max_body_bytes, config.redacted_headers)
@@ -1,10 +1,17 @@
-from flask import Blueprint, jsonify, render_template, request
+import json
+import math
+
+from flask import Blueprint, Response, jsonify, render_template, request, stream_with_context
 from werkzeug.exceptions import HTTPException
 
 from global_constants import GlobalConstants
-from .ask_viridium_ai import AskViridium
+from . import metrics
+from .ask_viridium_ai import QUERY_MODES, get_ask_viridium
 from .constants import AskViridiumConstants
+from .jobs import get_job_queue
 from .tracking import AppInsightsConnector
+from utils.exceptions import (CircuitOpenException, JobQueueFullException, RateLimitExceededException,
+                              UpstreamThrottledException)
 
 logger = AppInsightsConnector().get_logger()
 
@@ -38,12 +45,41 @@ class MainRoutes:
             methods=[self.global_constants.rest_api_methods.post],
         )
 
+        # Define route for AI requests streaming each stage as it finishes
+        self.blueprint.add_url_rule(
+            "/ask-viridium-ai/stream",
+            view_func=self.ask_viridium_ai_stream,
+            methods=[self.global_constants.rest_api_methods.post],
+        )
+
+        # Define route for batch AI requests
+        self.blueprint.add_url_rule(
+            "/ask-viridium-ai/batch",
+            view_func=self.ask_viridium_ai_batch,
+            methods=[self.global_constants.rest_api_methods.post],
+        )
+
+        # Define routes for submitting AI requests as background jobs and polling them
+        self.blueprint.add_url_rule(
+            "/ask-viridium-ai/jobs",
+            view_func=self.submit_job,
+            methods=[self.global_constants.rest_api_methods.post],
+        )
+        self.blueprint.add_url_rule(
+            "/ask-viridium-ai/jobs/<job_id>",
+            view_func=self.get_job,
+            methods=[self.global_constants.rest_api_methods.get_api],
+        )
+
         # Define route for health check
         self.blueprint.add_url_rule("/health", view_func=self.health_check)
 
-    def return_api_response(self, status, message, result=None, additional_data=None):
+        # Define route for Prometheus metrics
+        self.blueprint.add_url_rule("/metrics", view_func=self.get_metrics)
+
+    def build_api_response(self, status, message, result=None, additional_data=None):
         """
-        Constructs and returns a JSON response.
+        Constructs the body of an API response, shared by the Flask and ASGI entry points.
 
         Args:
             status (int): The status code of the response.
@@ -52,7 +88,7 @@ class MainRoutes:
             additional_data (dict, optional): Additional data to include in the response. Defaults to None.
 
         Returns:
-            tuple: A tuple containing the JSON response and the status code.
+            dict: The response body.
         """
         response_data = {
             self.global_constants.api_response_parameters.status: status,
@@ -62,8 +98,44 @@ class MainRoutes:
         if additional_data:
             response_data.update(additional_data)
 
-        logger.info(f"Returning API response: {response_data}")
-        return jsonify(response_data), status
+        logger.debug("Returning API response: %s", response_data)  # Formatted only when debug logging is on
+        return response_data
+
+    def return_api_response(self, status, message, result=None, additional_data=None, headers=None):
+        """
+        Constructs and returns a JSON response.
+
+        Args:
+            status (int): The status code of the response.
+            message (str): The message of the response.
+            result (Any, optional): The result of the response. Defaults to None.
+            additional_data (dict, optional): Additional data to include in the response. Defaults to None.
+            headers (dict, optional): Extra response headers. Defaults to None.
+
+        Returns:
+            tuple: A tuple containing the JSON response, the status code and the headers.
+        """
+        return jsonify(self.build_api_response(status, message, result, additional_data)), status, headers or {}
+
+    def rate_limit_response(self, error):
+        """
+        Describes the response to a query refused for rate limiting, shared by the Flask and ASGI entry points.
+
+        Args:
+            error (RateLimitExceededException): The exception the query was refused with.
+
+        Returns:
+            tuple: The status code, the message and the headers, with Retry-After when known.
+        """
+        logger.warning(f"Query refused: {error}")
+        if isinstance(error, (UpstreamThrottledException, CircuitOpenException)):  # Azure throttling or failing
+            status = self.global_constants.api_status_codes.service_unavailable
+            message = self.global_constants.api_response_messages.service_unavailable
+        else:  # Our own queue would have made the query wait too long
+            status = self.global_constants.api_status_codes.rate_limit_exceeded
+            message = self.global_constants.api_response_messages.rate_limit_exceeded
+        headers = {"Retry-After": str(max(1, math.ceil(error.retry_after)))} if error.retry_after else {}
+        return status, message, headers
 
     def validate_request_data(self, request_data, required_params):
         """
@@ -82,6 +154,136 @@ class MainRoutes:
             return False, missing_params
         return True, None
 
+    def validate_mode(self, request_data):
+        """
+        Validates the optional query mode of a request, shared by the Flask and ASGI entry points.
+
+        Args:
+            request_data (dict): The request data to validate.
+
+        Returns:
+            tuple: The (status, message, result) of an error response, or None, followed by the mode, None when
+                the request leaves it to QUERY_MODE.
+        """
+        mode_param = self.constants.query_parameters["mode"]
+        mode = request_data.get(mode_param)
+        if mode is not None and mode not in QUERY_MODES:
+            logger.warning(f"Validation failed. Unknown mode: {mode}")
+            return (self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.invalid_request_data,
+                    f"'{mode_param}' must be one of {list(QUERY_MODES)}"), None
+        return None, mode
+
+    def validate_deadline(self, request_data):
+        """
+        Validates the optional deadline of a request, shared by the Flask and ASGI entry points.
+
+        Args:
+            request_data (dict): The request data to validate.
+
+        Returns:
+            tuple: The (status, message, result) of an error response, or None, followed by the deadline in
+                seconds, None when the request leaves it to REQUEST_DEADLINE_SECONDS.
+        """
+        deadline_param = self.constants.query_parameters["deadline"]
+        deadline = request_data.get(deadline_param)
+        max_seconds = self.global_constants.deadline.max_seconds
+        if deadline is not None and (isinstance(deadline, bool) or not isinstance(deadline, (int, float))
+                                     or not 0 < deadline <= max_seconds):
+            logger.warning(f"Validation failed. Invalid deadline: {deadline}")
+            return (self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.invalid_request_data,
+                    f"'{deadline_param}' must be a number of seconds between 0 and {max_seconds:g}"), None
+        return None, deadline
+
+    def query_response(self, outcome):
+        """
+        Describes the response to a query, shared by the Flask and ASGI entry points.
+
+        Args:
+            outcome (QueryResult): The outcome of the query.
+
+        Returns:
+            tuple: The status code, the message, the result, the additional data and the headers. A query that ran
+                out of time before its analysis finished gets a 504 with the chemical composition, if that was
+                found. One whose analysis failed because Azure OpenAI is failing gets a 503 with Retry-After. A
+                stale analysis served while Azure OpenAI is failing is flagged as such.
+        """
+        if outcome.deadline_exceeded:
+            return (self.global_constants.api_status_codes.gateway_timeout,
+                    self.global_constants.api_response_messages.deadline_exceeded, None,
+                    {"chemical_composition": outcome.chemical_composition}, None)
+        if outcome.failure == "unavailable":  # Retry once the circuit breaker would have probed Azure again
+            retry_after = max(1, math.ceil(self.global_constants.circuit_breaker.open_seconds))
+            return (self.global_constants.api_status_codes.service_unavailable,
+                    self.global_constants.api_response_messages.service_unavailable, None, None,
+                    {"Retry-After": str(retry_after)})
+        return (self.global_constants.api_status_codes.ok, self.global_constants.api_response_messages.success,
+                outcome.result, {"stale": True} if outcome.stale else None, None)
+
+    def stream_event(self, stage, payload):
+        """
+        Encodes one stage of a streamed query as a line of NDJSON, shared by the Flask and ASGI entry points.
+
+        Args:
+            stage (str): "composition", "analysis" or "error".
+            payload (Any): The chemical composition, the QueryResult or the error message.
+
+        Returns:
+            bytes: The encoded line.
+        """
+        if stage == "analysis":
+            event = {"stage": stage, self.global_constants.api_response_parameters.result: payload.result,
+                     "cached": payload.cached, "deadline_exceeded": payload.deadline_exceeded, "stale": payload.stale,
+                     "failure": payload.failure}
+        elif stage == "error":
+            event = {"stage": stage, self.global_constants.api_response_parameters.message: payload}
+        else:
+            event = {"stage": stage, self.global_constants.api_response_parameters.result: payload}
+        return (json.dumps(event) + "\n").encode(self.global_constants.utf_8)
+
+    def parse_batch_request(self, request_data):
+        """
+        Validates a batch request and normalises its items, shared by the Flask and ASGI entry points.
+
+        Args:
+            request_data (dict): The request data, holding the list of items and an optional max_concurrency.
+
+        Returns:
+            tuple: The (status, message, result) of an error response, or None, followed by the items and the
+                maximum concurrency. Invalid items are kept with an "error" message so results stay aligned.
+        """
+        items_param = self.constants.batch_parameters["items"]
+        if not isinstance(request_data, dict) or not isinstance(request_data.get(items_param), list):
+            return (self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.invalid_request_data,
+                    f"'{items_param}' must be a list of materials"), None, None
+
+        max_items = self.global_constants.batch.max_items
+        if len(request_data[items_param]) > max_items:
+            return (self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.batch_too_large,
+                    f"At most {max_items} items are accepted per batch"), None, None
+
+        required_params = [self.constants.input_parameters["material_name"]]
+        items = []
+        for item in request_data[items_param]:
+            if not isinstance(item, dict):
+                items.append({"error": self.global_constants.api_response_messages.invalid_request_data})
+                continue
+            valid_item, missing_params = self.validate_request_data(item, required_params)
+            item = {param: item.get(param) for param in self.constants.input_parameters.values()}
+            if not valid_item:
+                item["error"] = f"{self.global_constants.api_response_parameters.missing_parameters}: {missing_params}"
+            items.append(item)
+
+        max_concurrency = self.global_constants.batch.max_concurrency
+        try:
+            requested = int(request_data.get(self.constants.batch_parameters["max_concurrency"]) or max_concurrency)
+        except (TypeError, ValueError):
+            requested = max_concurrency
+        return None, items, max(1, min(requested, max_concurrency))
+
     def home(self):
         """
         Renders the home page.
@@ -111,18 +313,159 @@ class MainRoutes:
                     self.global_constants.api_response_messages.missing_required_parameters,
                     f"{self.global_constants.api_response_parameters.missing_parameters}: {missing_params}",
                 )
+            error, mode = self.validate_mode(request_data)
+            if error:
+                return self.return_api_response(*error)
+            error, deadline = self.validate_deadline(request_data)
+            if error:
+                return self.return_api_response(*error)
 
-            ask_vai = AskViridium()
-            ask_vai.query(
+            outcome = get_ask_viridium().query(
                 request_data[self.constants.input_parameters["material_name"]],
                 request_data.get(self.constants.input_parameters["manufacturer_name"]),
-                request_data.get(self.constants.input_parameters["work_content"])
+                request_data.get(self.constants.input_parameters["work_content"]),
+                mode,
+                deadline
+            )
+
+            return self.return_api_response(*self.query_response(outcome))
+        except RateLimitExceededException as e:
+            status, message, headers = self.rate_limit_response(e)
+            return self.return_api_response(status, message, headers=headers)
+        except HTTPException as e:
+            logger.error(f"HTTP exception: {e}")
+            return self.return_api_response(e.code, str(e))
+        except Exception as e:
+            logger.exception("Unhandled exception occurred")
+            return self.return_api_response(
+                self.global_constants.api_status_codes.internal_server_error,
+                "An unexpected error occurred. Please try again later."
+            )
+
+    def ask_viridium_ai_stream(self):
+        """
+        Handles AI query requests, streaming NDJSON lines: the chemical composition as soon as it is found,
+        then the analysis.
+
+        Returns:
+            flask.Response: The streamed response.
+        """
+        try:
+            request_data = request.get_json()
+
+            required_params = [self.constants.input_parameters["material_name"]]
+
+            valid_request, missing_params = self.validate_request_data(request_data, required_params)
+            if not valid_request:
+                return self.return_api_response(
+                    self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.missing_required_parameters,
+                    f"{self.global_constants.api_response_parameters.missing_parameters}: {missing_params}",
+                )
+            error, mode = self.validate_mode(request_data)
+            if error:
+                return self.return_api_response(*error)
+            error, deadline = self.validate_deadline(request_data)
+            if error:
+                return self.return_api_response(*error)
+        except HTTPException as e:
+            logger.error(f"HTTP exception: {e}")
+            return self.return_api_response(e.code, str(e))
+        except Exception as e:
+            logger.exception("Unhandled exception occurred")
+            return self.return_api_response(
+                self.global_constants.api_status_codes.internal_server_error,
+                "An unexpected error occurred. Please try again later."
             )
 
+        stages = get_ask_viridium().stream_query(
+            request_data[self.constants.input_parameters["material_name"]],
+            request_data.get(self.constants.input_parameters["manufacturer_name"]),
+            request_data.get(self.constants.input_parameters["work_content"]),
+            mode,
+            deadline
+        )
+
+        def generate():
+            try:
+                for stage, payload in stages:
+                    yield self.stream_event(stage, payload)
+            except RateLimitExceededException as e:
+                yield self.stream_event("error", self.rate_limit_response(e)[1])
+            except Exception:
+                logger.exception("Unhandled exception occurred while streaming")
+                yield self.stream_event("error", "An unexpected error occurred. Please try again later.")
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    def ask_viridium_ai_batch(self):
+        """
+        Handles batch AI query requests.
+
+        Returns:
+            flask.Response: The API response, with one result per submitted item and aggregate totals.
+        """
+        try:
+            error, items, max_concurrency = self.parse_batch_request(request.get_json())
+            if error:
+                return self.return_api_response(*error)
+
+            results, totals = get_ask_viridium().query_batch(items, max_concurrency)
+
             return self.return_api_response(
                 self.global_constants.api_status_codes.ok,
                 self.global_constants.api_response_messages.success,
-                ask_vai.result,
+                results,
+                additional_data={"totals": totals},
+            )
+        except HTTPException as e:
+            logger.error(f"HTTP exception: {e}")
+            return self.return_api_response(e.code, str(e))
+        except Exception as e:
+            logger.exception("Unhandled exception occurred")
+            return self.return_api_response(
+                self.global_constants.api_status_codes.internal_server_error,
+                "An unexpected error occurred. Please try again later."
+            )
+
+    def submit_job(self):
+        """
+        Queues an AI query request and returns its job id without waiting for the analysis.
+
+        Returns:
+            flask.Response: The API response, with the job id and the URL to poll.
+        """
+        try:
+            request_data = request.get_json()
+
+            required_params = [self.constants.input_parameters["material_name"]]
+
+            valid_request, missing_params = self.validate_request_data(request_data, required_params)
+            if not valid_request:
+                return self.return_api_response(
+                    self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.missing_required_parameters,
+                    f"{self.global_constants.api_response_parameters.missing_parameters}: {missing_params}",
+                )
+            error, mode = self.validate_mode(request_data)
+            if error:
+                return self.return_api_response(*error)
+
+            payload = {param: request_data.get(param) for param in self.constants.input_parameters.values()}
+            payload[self.constants.query_parameters["mode"]] = mode
+            job_id = get_job_queue().submit(payload)
+
+            return self.return_api_response(
+                self.global_constants.api_status_codes.accepted,
+                self.global_constants.api_response_messages.accepted,
+                {"job_id": job_id, "status": "queued",
+                 "status_url": f"{self.global_constants.api_version}/ask-viridium-ai/jobs/{job_id}"},
+            )
+        except JobQueueFullException as e:
+            logger.warning(f"Job rejected: {e}")
+            return self.return_api_response(
+                self.global_constants.api_status_codes.service_unavailable,
+                self.global_constants.api_response_messages.service_unavailable,
             )
         except HTTPException as e:
             logger.error(f"HTTP exception: {e}")
@@ -134,6 +477,28 @@ class MainRoutes:
                 "An unexpected error occurred. Please try again later."
             )
 
+    def get_job(self, job_id):
+        """
+        Returns the status of a queued AI query request, and its result once finished.
+
+        Args:
+            job_id (str): The id returned when the job was submitted.
+
+        Returns:
+            flask.Response: The API response.
+        """
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return self.return_api_response(
+                self.global_constants.api_status_codes.not_found,
+                self.global_constants.api_response_messages.job_not_found,
+            )
+        return self.return_api_response(
+            self.global_constants.api_status_codes.ok,
+            self.global_constants.api_response_messages.success,
+            job,
+        )
+
     def health_check(self):
         """
         Returns a simple health check response.
@@ -142,7 +507,29 @@ class MainRoutes:
             tuple: A tuple containing the JSON response and the status code.
         """
         logger.info("Health check endpoint called")
+        ask_vai = get_ask_viridium()
         return self.return_api_response(
             self.global_constants.api_status_codes.ok,
             self.global_constants.api_response_messages.server_is_running,
+            additional_data={
+                "result_cache": ask_vai.result_cache.stats() if ask_vai.result_cache else None,
+                "composition_cache": ask_vai.composition_cache.stats() if ask_vai.composition_cache else None,
+                "speculation": ask_vai.speculation.stats() if ask_vai.speculation else None,
+                "coalescing": ask_vai.coalescer.stats() if ask_vai.coalescer else None,
+                "similarity": ask_vai.similarity_index.stats() if ask_vai.similarity_index else None,
+                "cas_reference": ask_vai.cas_reference.stats() if ask_vai.cas_reference else None,
+                "prescreen": ask_vai.prescreen.stats() if ask_vai.prescreen else None,
+                "deadlines": ask_vai.deadline_policy.stats(),
+                "circuit_breaker": ask_vai.circuit_breaker.stats() if ask_vai.circuit_breaker else None,
+            },
         )
+
+    def get_metrics(self):
+        """
+        Returns the service metrics in Prometheus text format, summed across all workers.
+
+        Returns:
+            flask.Response: The metrics.
+        """
+        body, content_type = metrics.render()
+        return Response(body, mimetype=content_type)
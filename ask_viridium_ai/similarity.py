@@ -0,0 +1,319 @@
+"""
+Near-duplicate lookup of past analyses by material name.
+
+The result cache only matches queries whose normalized inputs are identical, so "Nitrogen, Cryogenic Liquid"
+misses the analysis of "Liquid Nitrogen (cryogenic)". This index represents every analysed material name as a
+TF-IDF vector of character trigrams, taken per word so word order does not matter, and finds the most similar
+past analysis of the same manufacturer by cosine similarity.
+
+Trigrams are hashed into a fixed number of buckets. Their postings (document ids and term counts) are kept in
+NumPy arrays sorted by bucket, so a lookup gathers the postings of the query's trigrams and sums their weights
+per document with np.bincount. Common trigrams carry little weight and have long postings, so only the query's
+rarest trigrams are gathered, up to max_postings postings; a name similar enough to be reused shares them.
+The best candidates are then rescored exactly against their stored names before the threshold is applied.
+
+The index follows the record store: a background thread reads the records appended by every worker, adds
+their successful analyses to a small delta segment and merges it into the main segment once it grows past
+merge_ratio of it. New postings are sorted on their own and inserted at the end of their buckets, so a refresh
+costs time in the size of what it adds plus one copy of the delta segment, and no segment is sorted again.
+Lookups read an immutable snapshot of both segments, so they never wait for the thread. Documents keep the byte
+offset of their record, whose result is read back from the record store on a hit.
+
+The TF-IDF norm of a document is computed with the document frequencies of the refresh that added it, and the
+norms of all documents are only recomputed when the segments merge. Between merges the norms drift from the
+current frequencies by at most merge_ratio of the documents. They only rank the candidates; the similarity
+compared with min_similarity is computed exactly with the current frequencies.
+
+Usage:
+    index = SimilarityIndex(record_store, min_similarity=0.9)
+    index.start()
+    match = index.lookup("Liquid Nitrogen (cryogenic)", "Matheson Tri-Gas, Inc.")
+    if match is not None:
+        record, similarity = match
+"""
+
+import hashlib
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import metrics
+from .cache import normalize_key_part
+from .tracking import AppInsightsConnector
+
+logger = AppInsightsConnector().get_logger()
+
+DIMENSION = 2 ** 20  # Hash buckets of the trigrams
+
+
+def trigrams(name):
+    """Character trigrams of each word of a normalized name, padded so word boundaries count."""
+    return [f" {word} "[index:index + 3] for word in normalize_key_part(name).split() for index in range(len(word))]
+
+
+def trigram_ids(name):
+    """Hash buckets of the trigrams of a name, stable across processes."""
+    return np.fromiter((zlib.crc32(gram.encode()) % DIMENSION for gram in trigrams(name)), dtype=np.int64)
+
+
+def manufacturer_id(manufacturer):
+    """64-bit id of a normalized manufacturer name; missing manufacturers share one id."""
+    return int.from_bytes(hashlib.blake2b(normalize_key_part(manufacturer).encode(), digest_size=8).digest(), "big")
+
+
+def appended(array, size, values):
+    """
+    Write values after the first size entries of array, doubling its capacity when it is full.
+
+    Entries before size are never modified, so snapshots holding a view of them stay valid.
+    """
+    if size + len(values) > len(array):
+        grown = np.zeros(max(2 * len(array), size + len(values)), dtype=array.dtype)
+        grown[:size] = array[:size]
+        array = grown
+    array[size:size + len(values)] = values
+    return array
+
+
+@dataclass
+class Segment:
+    """Postings of a range of documents, sorted by trigram bucket."""
+    offsets: np.ndarray  # Start of each bucket's postings, DIMENSION + 1 entries
+    docs: np.ndarray  # Document id of each posting
+    counts: np.ndarray  # Occurrences of the trigram in the document
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(DIMENSION + 1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint8))
+
+    def grams(self):
+        """Trigram bucket of each posting."""
+        return np.repeat(np.arange(DIMENSION, dtype=np.int32), np.diff(self.offsets))
+
+    def extend(self, grams, docs, counts):
+        """
+        A new segment holding these postings followed by those of later documents.
+
+        The added postings are sorted on their own and inserted at the end of their buckets, keeping each
+        bucket ordered by document, so the existing postings are copied but not sorted again.
+        """
+        order = np.argsort(grams, kind="stable")
+        grams = grams[order]
+        where = self.offsets[grams.astype(np.int64) + 1]
+        offsets = self.offsets.copy()
+        offsets[1:] += np.cumsum(np.bincount(grams, minlength=DIMENSION))
+        return Segment(offsets, np.insert(self.docs, where, docs[order].astype(np.int32)),
+                       np.insert(self.counts, where, counts[order].astype(np.uint8)))
+
+
+@dataclass
+class Snapshot:
+    """Immutable view of the index used by lookups."""
+    main: Segment
+    delta: Segment
+    size: int  # Documents in both segments
+    document_frequency: np.ndarray  # Documents containing each bucket
+    norms: np.ndarray  # TF-IDF norm of each document
+    manufacturers: np.ndarray  # manufacturer_id of each document
+    positions: np.ndarray  # Record store offset of each document
+
+
+class SimilarityIndex:
+    def __init__(self, record_store, min_similarity=0.9, top_k=5, max_postings=50000, merge_ratio=0.1,
+                 refresh_interval=5.0):
+        """
+        Initialize the similarity index.
+
+        Args:
+            record_store (RecordStore): The record store the index follows.
+            min_similarity (float): Cosine similarity from which a past analysis is reused.
+            top_k (int): Candidates rescored exactly per lookup.
+            max_postings (int): Postings gathered per lookup, from the query's rarest trigrams on.
+            merge_ratio (float): Size of the delta segment, relative to the main one, that triggers a merge.
+            refresh_interval (float): Seconds between reads of newly appended records.
+        """
+        self.record_store = record_store
+        self.min_similarity = min_similarity
+        self.top_k = top_k
+        self.max_postings = max_postings
+        self.merge_ratio = merge_ratio
+        self.refresh_interval = refresh_interval
+
+        self.snapshot = None  # Replaced as a whole by the refresh thread
+        self.position = 0  # Record store offset read up to
+        self.size = 0  # Documents in both segments
+        self.main = Segment.empty()
+        self.delta = Segment.empty()
+        self.delta_size = 0  # Documents in the delta segment
+        self.document_frequency = np.zeros(DIMENSION, dtype=np.int32)  # Replaced, not modified, on each refresh
+        # Per-document arrays with spare capacity, only written past self.size
+        self.norms = np.zeros(0, dtype=np.float64)
+        self.manufacturers = np.zeros(0, dtype=np.uint64)
+        self.positions = np.zeros(0, dtype=np.int64)
+
+        self.lock = threading.Lock()  # Guards the counters
+        self.refresh_lock = threading.Lock()  # Serialises refreshes
+        self.counters = {"hits": 0, "misses": 0}
+        self.thread = None
+
+    def start(self):
+        """Index the stored records and follow new ones on a background thread."""
+        self.thread = threading.Thread(target=self.follow, name="similarity-index", daemon=True)
+        self.thread.start()
+
+    def follow(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception("Similarity index refresh failed: %s", e)
+            time.sleep(self.refresh_interval)
+
+    def refresh(self):
+        """
+        Add the analyses appended to the record store since the last refresh.
+
+        Returns:
+            int: The number of documents added.
+        """
+        with self.refresh_lock:
+            documents = list()
+            for offset, end, record in self.record_store.tail(self.position):
+                self.position = end
+                # Failed, cached and shared analyses repeat nothing new
+                if record.get("result") and not record.get("cached") and not record.get("coalesced"):
+                    documents.append((record.get("material"), record.get("manufacturer"), offset))
+            if documents:
+                self.add(documents)
+            return len(documents)
+
+    def add(self, documents):
+        """
+        Add documents and publish a new snapshot. Callers other than refresh must hold refresh_lock.
+
+        Args:
+            documents (list): (material name, manufacturer, record store offset) of each document.
+        """
+        first, size = self.size, self.size + len(documents)
+        grams, docs, counts = self.postings([material for material, _, _ in documents], first)
+        self.document_frequency = self.document_frequency + np.bincount(grams, minlength=DIMENSION).astype(np.int32)
+        self.manufacturers = appended(self.manufacturers, first, np.fromiter(
+            (manufacturer_id(manufacturer) for _, manufacturer, _ in documents), dtype=np.uint64))
+        self.positions = appended(self.positions, first, np.fromiter(
+            (offset for _, _, offset in documents), dtype=np.int64))
+        self.size = size
+
+        self.delta = self.delta.extend(grams, docs, counts)
+        self.delta_size += len(documents)
+        idf = self.idf(self.document_frequency, size)
+        if self.delta_size > max(1000, self.merge_ratio * (size - self.delta_size)):
+            self.main = self.main.extend(self.delta.grams(), self.delta.docs, self.delta.counts)
+            self.delta, self.delta_size = Segment.empty(), 0
+            # Bring the norms of every document up to date with the document frequencies
+            weights = (self.main.counts * idf[self.main.grams()]) ** 2
+            self.norms = np.sqrt(np.bincount(self.main.docs, weights=weights, minlength=max(len(self.norms), size)))
+        else:
+            weights = (counts * idf[grams]) ** 2
+            self.norms = appended(self.norms, first, np.sqrt(np.bincount(docs - first, weights=weights,
+                                                                         minlength=len(documents))))
+        self.snapshot = Snapshot(self.main, self.delta, size, self.document_frequency, self.norms[:size],
+                                 self.manufacturers[:size], self.positions[:size])
+
+    @staticmethod
+    def postings(materials, first):
+        """
+        Trigram postings of documents numbered from first on.
+
+        Returns:
+            tuple: The bucket, document and count of each distinct trigram of each document.
+        """
+        ids = [trigram_ids(material) for material in materials]
+        docs = np.repeat(np.arange(first, first + len(ids), dtype=np.int64), [len(grams) for grams in ids])
+        keys, counts = np.unique(docs * DIMENSION + np.concatenate(ids), return_counts=True)
+        return ((keys % DIMENSION).astype(np.int32), (keys // DIMENSION).astype(np.int32),
+                np.minimum(counts, 255).astype(np.uint8))
+
+    @staticmethod
+    def idf(document_frequency, size):
+        return np.log((1 + size) / (1 + document_frequency)) + 1
+
+    def candidates(self, snapshot, ids, weights, manufacturer):
+        """Documents of the manufacturer sharing the query's rarest trigrams, best approximate score first."""
+        # The rarest trigrams weigh the most, so a near-duplicate shares them; stop before the common ones
+        frequency = snapshot.document_frequency[ids]
+        rarest = np.argsort(frequency, kind="stable")
+        kept = max(1, np.searchsorted(np.cumsum(frequency[rarest]), self.max_postings, side="right"))
+        ids, weights = ids[rarest[:kept]], weights[rarest[:kept]]
+
+        docs, contributions = list(), list()
+        for segment in [snapshot.main, snapshot.delta]:
+            starts, ends = segment.offsets[ids], segment.offsets[ids + 1]
+            for start, end, weight in zip(starts, ends, weights):
+                if end > start:
+                    docs.append(segment.docs[start:end])
+                    contributions.append(segment.counts[start:end] * weight)
+        if not docs:
+            return np.zeros(0, dtype=np.int64)
+
+        docs, contributions = np.concatenate(docs), np.concatenate(contributions)
+        same_manufacturer = snapshot.manufacturers[docs] == np.uint64(manufacturer)
+        found, postings = np.unique(docs[same_manufacturer], return_inverse=True)
+        scores = np.bincount(postings, weights=contributions[same_manufacturer]) / snapshot.norms[found]
+        best = np.argpartition(-scores, self.top_k)[:self.top_k] if len(found) > self.top_k else np.arange(len(found))
+        return found[best[np.argsort(-scores[best], kind="stable")]]
+
+    def similarity(self, snapshot, ids, weights, material):
+        """Exact cosine similarity between the query's weighted trigrams and a stored material name."""
+        other_ids, other_counts = np.unique(trigram_ids(material), return_counts=True)
+        other_weights = other_counts * self.idf(snapshot.document_frequency[other_ids], snapshot.size)
+        _, mine, theirs = np.intersect1d(ids, other_ids, assume_unique=True, return_indices=True)
+        norm = np.linalg.norm(weights) * np.linalg.norm(other_weights)
+        return float(weights[mine] @ other_weights[theirs] / norm) if norm else 0.0
+
+    def lookup(self, material, manufacturer):
+        """
+        Find the past analysis of the most similar material of the same manufacturer.
+
+        Args:
+            material (str): The name of the material.
+            manufacturer (Optional[str]): The name of the manufacturer.
+
+        Returns:
+            Optional[tuple]: The stored record and its similarity, or None if no analysis is similar enough.
+        """
+        snapshot = self.snapshot
+        match = None
+        with metrics.stage_timer("similarity"):
+            ids, counts = np.unique(trigram_ids(material), return_counts=True)
+            if snapshot is not None and snapshot.size and ids.size:
+                weights = counts * self.idf(snapshot.document_frequency[ids], snapshot.size)
+                for doc in self.candidates(snapshot, ids, weights, manufacturer_id(manufacturer)):
+                    record = self.record_store.read_at(int(snapshot.positions[doc]))
+                    similarity = self.similarity(snapshot, ids, weights, record["material"])
+                    if similarity >= self.min_similarity and (match is None or similarity > match[1]):
+                        match = record, similarity
+        self.count("hits" if match else "misses")
+        return match
+
+    def count(self, event):
+        with self.lock:
+            self.counters[event] += 1
+        metrics.CACHE_EVENTS.labels("similarity", event).inc()
+
+    def stats(self):
+        """
+        Lookup counters of this process and the size of the index.
+
+        Returns:
+            dict: The counters, the hit ratio and the documents indexed.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        snapshot = self.snapshot
+        stats["documents"] = snapshot.size if snapshot else 0
+        return stats
@@ -0,0 +1,122 @@
+"""
+Speculative analysis for materials that are recognizable by name.
+
+The analysis stage normally waits for the chemical composition. For a pure chemical such as
+"Nitrogen, Cryogenic Liquid", the composition is the material itself, so the analysis can start straight away
+using the name as its composition while the composition call runs. Once the composition arrives it is compared
+with the guess. If they match, the speculative analysis is kept and the query finishes one LLM round trip
+sooner. If they differ, the speculative analysis is discarded and the analysis runs again on the fetched
+composition.
+
+Usage:
+    speculation = Speculation(max_words=3, min_similarity=1.0, max_in_flight=8)
+    guess = speculation.guess("Nitrogen, Cryogenic Liquid")  # ["Nitrogen"]
+    speculation.matches(guess, ["Nitrogen"])  # True
+"""
+
+import re
+import threading
+
+from . import metrics
+from .cache import normalize_key_part
+
+
+class Speculation:
+    def __init__(self, max_words=3, min_similarity=1.0, max_in_flight=8):
+        """
+        Initialize the speculation policy.
+
+        Args:
+            max_words (int): Longest material name, in words before the first comma, treated as a pure chemical.
+            min_similarity (float): Jaccard similarity between the guessed and fetched chemicals needed to keep
+                the speculative analysis.
+            max_in_flight (int): Speculative analyses running at once per process; queries beyond this run
+                serially so speculation never queues behind itself.
+        """
+        self.max_words = max_words
+        self.min_similarity = min_similarity
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.counters = {"started": 0, "accepted": 0, "discarded": 0, "skipped": 0, "wasted_tokens": 0,
+                         "wasted_cost": 0.0}
+
+    def guess(self, material):
+        """
+        Guess the chemicals of a material from its name alone.
+
+        Args:
+            material (str): The name of the material.
+
+        Returns:
+            Optional[list]: The guessed chemical names, or None if the name does not look like a pure chemical.
+        """
+        name = material.split(",")[0].strip()
+        if not name or len(name.split()) > self.max_words or re.search(r"\d", name):
+            return None  # Part numbers and long trade names need the composition call
+        return [name]
+
+    def chemical_names(self, chemicals_list):
+        """Normalized chemical names, ignoring parenthesised qualifiers such as formulas."""
+        return {normalize_key_part(re.sub(r"\(.*?\)", " ", name)) for name in chemicals_list} - {""}
+
+    def matches(self, guessed, fetched):
+        """
+        Whether the fetched composition agrees with the guess closely enough to keep the speculative analysis.
+
+        Args:
+            guessed (list): The chemicals returned by guess.
+            fetched (list): The chemicals returned by the composition call.
+
+        Returns:
+            bool: True if the speculative analysis can be kept.
+        """
+        guessed, fetched = self.chemical_names(guessed), self.chemical_names(fetched)
+        if not guessed or not fetched:
+            return False
+        return len(guessed & fetched) / len(guessed | fetched) >= self.min_similarity
+
+    def acquire(self):
+        """
+        Reserve a slot for a speculative analysis.
+
+        Returns:
+            bool: True if the analysis may start; release must then be called once it is settled.
+        """
+        if self.slots.acquire(blocking=False):
+            self.count("started")
+            return True
+        self.count("skipped")
+        return False
+
+    def release(self):
+        self.slots.release()
+
+    def count(self, outcome, tokens=0, cost=0.0):
+        """
+        Record a speculation event.
+
+        Args:
+            outcome (str): started, accepted, discarded or skipped.
+            tokens (int): Tokens spent on a discarded analysis.
+            cost (float): Cost of a discarded analysis.
+        """
+        with self.lock:
+            self.counters[outcome] += 1
+            self.counters["wasted_tokens"] += tokens
+            self.counters["wasted_cost"] += cost
+        metrics.SPECULATION_EVENTS.labels(outcome).inc()
+        metrics.SPECULATION_WASTED_TOKENS.inc(tokens)
+
+    def stats(self):
+        """
+        Speculation counters of this process.
+
+        Returns:
+            dict: The counters and the share of settled speculations that were accepted.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        settled = stats["accepted"] + stats["discarded"]
+        stats["acceptance_ratio"] = round(stats["accepted"] / settled, 4) if settled else 0.0
+        stats["wasted_cost"] = round(stats["wasted_cost"], 6)
+        return stats
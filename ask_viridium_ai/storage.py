@@ -0,0 +1,173 @@
+"""
+Append-only record store for query logs.
+
+Records are written as JSON Lines. Every append is a single write to a file opened in append mode while
+holding an exclusive file lock, so appends cost the same however large the file grows and concurrent gunicorn
+workers never interleave or lose records. Readers stream the file line by line.
+
+Usage:
+    store = RecordStore("data_dump/data.jsonl")
+    store.append({"material": "Nitrogen", ...})
+    for record in store.iter_records():
+        ...
+
+The old data.json array is converted once with:
+    python -m ask_viridium_ai.storage migrate data_dump/data.json data_dump/data.jsonl
+"""
+
+import argparse
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines; production runs on Linux
+    fcntl = None
+
+
+class RecordStore:
+    """JSON Lines file with locked, constant-time appends and streaming reads."""
+
+    def __init__(self, path):
+        """
+        Initialize the record store.
+
+        Args:
+            path (str): Location of the JSON Lines file.
+        """
+        self.path = path
+        self.lock = threading.Lock()  # flock is per process, this serialises the threads of one worker
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        """
+        Append one record to the store.
+
+        Args:
+            record (dict): A JSON-serialisable record.
+        """
+        line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, line)
+            finally:
+                os.close(fd)  # Closing the descriptor releases the lock
+
+    def iter_records(self):
+        """
+        Stream the stored records without loading the whole file.
+
+        Yields:
+            dict: One record per line, in the order they were appended.
+        """
+        try:
+            file = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                if not line.endswith(b"\n"):  # A record still being written by another worker
+                    break
+                if line.strip():
+                    yield json.loads(line)
+
+    def tail(self, position=0):
+        """
+        Stream the records appended from a byte offset on, so a reader can follow the store as it grows.
+
+        Args:
+            position (int): Offset to start at, 0 or the end of a record returned earlier.
+
+        Yields:
+            tuple: The offset of each record, the offset just past it and the record.
+        """
+        try:
+            file = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            file.seek(position)
+            for line in file:
+                if not line.endswith(b"\n"):  # A record still being written by another worker
+                    break
+                end = position + len(line)
+                if line.strip():
+                    yield position, end, json.loads(line)
+                position = end
+
+    def read_at(self, offset):
+        """
+        Read the record starting at a byte offset returned by tail.
+
+        Args:
+            offset (int): The offset of the record.
+
+        Returns:
+            dict: The record.
+        """
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return json.loads(file.readline())
+
+    def extend(self, records):
+        """
+        Append many records under a single lock, used by the migrator.
+
+        Args:
+            records (Iterable[dict]): JSON-serialisable records.
+
+        Returns:
+            int: The number of records written.
+        """
+        count = 0
+        with self.lock, open(self.path, "ab") as file:
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            for record in records:
+                file.write((json.dumps(record, default=str) + "\n").encode("utf-8"))
+                count += 1
+        return count
+
+
+def migrate_json_array(source, destination):
+    """
+    Convert the legacy data.json array into a JSON Lines record store.
+
+    Args:
+        source (str): Path of the legacy JSON array file.
+        destination (str): Path of the JSON Lines file to create.
+
+    Returns:
+        int: The number of records migrated.
+
+    Raises:
+        FileExistsError: If the destination already holds records, to keep the migration one-shot.
+    """
+    if os.path.exists(destination) and os.path.getsize(destination) > 0:
+        raise FileExistsError(f"{destination} already contains records")
+    with open(source, "r") as file:
+        records = json.load(file)
+    return RecordStore(destination).extend(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the append-only query record store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Convert a data.json array into a JSON Lines store")
+    migrate.add_argument("source", nargs="?", default="data_dump/data.json")
+    migrate.add_argument("destination", nargs="?", default="data_dump/data.jsonl")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        count = migrate_json_array(args.source, args.destination)
+        print(f"Migrated {count} records from {args.source} to {args.destination}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,47 @@
+import atexit
 import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
 import pandas as pd
 from opencensus.ext.azure.log_exporter import AzureLogHandler
 
 from global_constants import GlobalConstants
 
 
-class Logger:
-    def __init__(self):
-        """Initialize the Logger class."""
-        self.columns = [
-            'time', 'user_id', 'material_name',
-            'tokens_used_for_chemical_composition', 'cost_chemical_composition',
-            'tokens_used_for_analysis', 'cost_analysis', 'total_cost', 'chemical_composition', 'PFAS_status'
-        ]
-        self.df = pd.DataFrame(columns=self.columns)
+class RecordLog:
+    """
+    Collects log rows in memory and writes them out in chunks.
+
+    Rows are kept as a list of dicts and turned into a DataFrame only when a chunk is written, so logging n rows
+    costs O(n) instead of the O(n^2) of concatenating one-row DataFrames. When a path is given, every chunk_rows
+    rows are appended to it and dropped from memory, which bounds memory however many rows are logged.
+
+    Files ending in .parquet are written with pyarrow, one row group per chunk; anything else is written as CSV.
+    Parquet files cannot be appended to once closed, so a Parquet log always starts a new file and save should
+    only be called once the logging is done.
+    """
+
+    def __init__(self, columns, path=None, chunk_rows=10000, append=True):
+        """
+        Initialize the record log.
+
+        Args:
+            columns (list): Columns of the log, in order. Keys of a logged row outside them are added after them,
+                as long as they appear before the first chunk is written.
+            path (Optional[str]): File to write chunks to; without one, rows stay in memory until save.
+            chunk_rows (int): Rows buffered before a chunk is written to path.
+            append (bool): Append to an existing file instead of replacing it on the first write.
+        """
+        self.columns = list(columns)
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.append = append
+        self.rows = []  # Rows logged since the last write
+        self.header = None  # Columns of the file being written, fixed by its first chunk
+        self.parquet_writer = None
 
     def log(self, info):
         """Log information provided in the 'info' dictionary.
@@ -21,56 +49,161 @@ class Logger:
         Args:
             info (dict): A dictionary containing information to log.
         """
-        tdf = pd.DataFrame(info, index=[0])
-        self.df = pd.concat([self.df, tdf])
+        self.rows.append(dict(info))
+        if self.path is not None and len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    @property
+    def df(self):
+        """The rows not yet written out, as a DataFrame."""
+        return self.frame(self.rows)
+
+    def frame(self, rows):
+        columns = self.header or self.columns + [key for key in dict.fromkeys(k for row in rows for k in row)
+                                                 if key not in self.columns]
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    def flush(self):
+        """Write the buffered rows to path and drop them from memory."""
+        if not self.rows:
+            return
+        if self.path.endswith(".parquet"):
+            self.write_parquet()
+        else:
+            self.write_csv()
+        self.rows = []
+
+    def write_csv(self):
+        existing = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if self.header is None:
+            if self.append and existing:
+                self.header = list(pd.read_csv(self.path, nrows=0).columns)  # Match the columns of earlier runs
+            else:
+                existing = False
+        chunk = self.frame(self.rows)
+        self.header = list(chunk.columns)
+        chunk.to_csv(self.path, mode="a" if existing else "w", header=not existing, index=False)
+
+    def write_parquet(self):
+        import pyarrow as pa  # Optional dependency, only needed for Parquet logs
+        import pyarrow.parquet as pq
+
+        chunk = self.frame(self.rows)
+        self.header = list(chunk.columns)
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+
+    def save(self, filename=None):
+        """
+        Write every remaining row and close the file.
 
-    def experiment_log(self, info):
-        tdf = pd.DataFrame(info, index=[0])
+        Args:
+            filename (Optional[str]): File to write to, when no path was given at construction.
+        """
+        if filename is not None and filename != self.path:
+            self.close()
+            self.path = filename
+            self.header = None
+        self.flush()
+        self.close()
 
-        self.df = pd.concat([self.df, tdf])
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
 
-    def save(self, filename):
-        # tdf = pd.read_csv(filename)
-        # self.df = pd.concat([tdf, self.df])
-        self.df.to_csv(filename, index=False)
 
+class Logger(RecordLog):
+    def __init__(self, path=None, chunk_rows=10000):
+        """Initialize the Logger class."""
+        super().__init__([
+            'time', 'user_id', 'material_name',
+            'tokens_used_for_chemical_composition', 'cost_chemical_composition',
+            'tokens_used_for_analysis', 'cost_analysis', 'total_cost', 'chemical_composition', 'PFAS_status'
+        ], path, chunk_rows, append=False)
 
-class ExperimentLogger():
-    def __init__(self):
-        self.columns = ["material_id", "material_name", "manufacturer_id", "manufacturer_name", "pfas_status"]
-        self.df = pd.DataFrame(columns=self.columns)
-        self.logger = Logger()
+    def experiment_log(self, info):
+        self.log(info)
 
-    def log(self, info):
-        tdf = pd.DataFrame(info, index=[0])
-        self.df = pd.concat([self.df, tdf])
 
-    def save(self, filename):
-        tdf = pd.read_csv(filename)
-        self.df = pd.concat([tdf, self.df])
-        self.df.to_csv(filename, index=False)  # saving
+class ExperimentLogger(RecordLog):
+    def __init__(self, path=None, chunk_rows=10000):
+        # Appends to the log of earlier runs
+        super().__init__(["material_id", "material_name", "manufacturer_id", "manufacturer_name", "pfas_status"],
+                         path, chunk_rows, append=True)
 
 
 class AppInsightsConnector():
+    """
+    Gives access to the service logger, configuring its handlers once per process.
+
+    Records are put on an in-memory queue by a QueueHandler; a QueueListener thread formats them and hands them
+    to the console and Azure handlers, so neither console writes nor Azure export run on the request thread.
+    Creating more connectors reuses the same handlers instead of stacking duplicates.
+    """
+    configure_lock = threading.Lock()
+    queue_handler = None  # QueueHandler attached to the logger, None until configured
+    listener = None  # QueueListener feeding the console and Azure handlers
+
     def __init__(self):
         # Configure logger
         self.global_constants = GlobalConstants
         self.logger = logging.getLogger(__name__)
+        self.configure(self.logger)
 
-        # Set log level to INFO
-        self.logger.setLevel(logging.INFO)
-
-        formatter = logging.Formatter("[%(process)d] [%(levelname)s] %(message)s")
-        # Add AzureLogHandler to the logger
-        self.azure_handler = AzureLogHandler(connection_string=self.global_constants.azure_app_insights_connector)
-        self.azure_handler.setFormatter(formatter)
-        self.logger.addHandler(self.azure_handler)
+    @classmethod
+    def configure(cls, logger):
+        """
+        Attach the queue handler and start the listener, unless this process already did.
 
-        # Add Console Handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
+        Args:
+            logger (logging.Logger): The service logger.
+        """
+        with cls.configure_lock:
+            if cls.queue_handler is not None:
+                return
+
+            # Set log level to INFO
+            logger.setLevel(logging.INFO)
+
+            formatter = logging.Formatter("[%(process)d] [%(levelname)s] %(message)s")
+            handlers = []
+
+            # Add Console Handler
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.INFO)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+            # Add AzureLogHandler, when App Insights is configured
+            if GlobalConstants.azure_app_insights_connector:
+                azure_handler = AzureLogHandler(connection_string=GlobalConstants.azure_app_insights_connector)
+                azure_handler.setFormatter(formatter)
+                handlers.append(azure_handler)
+
+            log_queue = queue.SimpleQueue()
+            cls.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            cls.listener.start()
+            cls.queue_handler = QueueHandler(log_queue)
+            logger.addHandler(cls.queue_handler)
+            atexit.register(cls.listener.stop)  # Flush queued records on shutdown
+
+    @classmethod
+    def reconfigure_after_fork(cls):
+        """The listener and Azure export threads do not survive a fork, so a forked worker sets up its own."""
+        cls.configure_lock = threading.Lock()
+        if cls.queue_handler is None:
+            return
+        logger = logging.getLogger(__name__)
+        logger.removeHandler(cls.queue_handler)
+        cls.queue_handler = None
+        cls.listener = None
+        cls.configure(logger)
 
     def get_logger(self):
         return self.logger
+
+
+os.register_at_fork(after_in_child=AppInsightsConnector.reconfigure_after_fork)
@@ -0,0 +1,117 @@
+"""
+A/B comparison of the staged (two-call) and combined (single-call) query modes on the stored past queries.
+
+Every distinct material of data_dump/data.json is queried in both modes, with the caches off so every query
+reaches the LLM. For each mode, the harness reports latency, tokens and cost per query, failed queries, and
+how often the decision agrees with the decision stored for that material. It then reports how often the two
+modes agree with each other, and lists the materials where they differ. The stored records that kept their
+duration and tokens are summarised too, as the production baseline of the staged mode.
+
+By default the queries go to a local fake OpenAI server, which costs nothing and shows the latency and
+tokens the extra call costs, but answers canned decisions. With --live they go to the Azure OpenAI
+deployment configured in .env, which measures decision agreement for real and spends tokens.
+
+Usage (from the repository root):
+    python -m benchmarks.ab_query_modes --limit 20
+    python -m benchmarks.ab_query_modes --live --limit 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+
+from benchmarks.bench_speculation import configure_environment, percentile
+
+MODES = ["staged", "combined"]
+
+
+def stored_queries(data_path):
+    """
+    Distinct materials of the stored past queries, with their stored decision.
+
+    Returns:
+        tuple: (material, manufacturer, stored decision) per material, and the stored records that kept their
+            duration and tokens.
+    """
+    with open(data_path) as file:
+        stored = json.load(file)
+    queries, records, seen = list(), list(), set()
+    for entry in stored:
+        if "result" in entry:  # A full record
+            material, manufacturer = entry.get("material"), entry.get("manufacturer") or None
+            decision = (entry["result"] or dict()).get("decision")
+            records.append(entry)
+        else:  # A bare MaterialInfo
+            material, manufacturer, decision = entry.get("analyzed_material"), None, entry.get("decision")
+        if material and decision and material.casefold() not in seen:
+            seen.add(material.casefold())
+            queries.append((material, manufacturer, decision))
+    return queries, records
+
+
+def summarise(name, durations, tokens, costs):
+    print(f"{name:<18} queries={len(durations):<4} p50={percentile(durations, 0.5):6.2f}s "
+          f"p95={percentile(durations, 0.95):6.2f}s mean={statistics.mean(durations):6.2f}s "
+          f"tokens/query={statistics.mean(tokens):7.1f} cost/query=${statistics.mean(costs):.5f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data_dump/data.json", help="Stored past queries, read only")
+    parser.add_argument("--limit", type=int, default=None, help="Query at most this many materials")
+    parser.add_argument("--live", action="store_true", help="Query the Azure OpenAI deployment configured in .env")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.015,
+                        help="Further fake LLM latency per completion token, in seconds")
+    parser.add_argument("--fake-port", type=int, default=8914)
+    args = parser.parse_args()
+
+    queries, records = stored_queries(args.data)
+    queries = queries[:args.limit]
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.live:
+            os.environ.update({"RESULT_CACHE_ENABLED": "false", "COMPOSITION_CACHE_ENABLED": "false",
+                               "RECORD_STORE_PATH": os.path.join(directory, "records.jsonl")})
+        else:
+            configure_environment(args.fake_port, directory)
+        sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+        from ask_viridium_ai.ask_viridium_ai import AskViridium
+        from benchmarks.fake_openai_server import start_in_thread
+
+        if not args.live:
+            start_in_thread(args.fake_port, latency=args.latency, token_latency=args.token_latency)
+        engine = AskViridium()
+
+        decisions = {mode: dict() for mode in MODES}
+        for mode in MODES:
+            durations, tokens, costs, failed, agreed = list(), list(), list(), 0, 0
+            for material, manufacturer, stored_decision in queries:
+                loginfo = engine.query(material, manufacturer, None, mode).loginfo
+                durations.append(loginfo["duration"])
+                tokens.append(loginfo["tokens_used_for_chemical_composition"] + loginfo["tokens_used_for_analysis"])
+                costs.append(loginfo["total_cost"])
+                decisions[mode][material] = loginfo["PFAS_status"]
+                failed += loginfo["PFAS_status"] is None
+                agreed += loginfo["PFAS_status"] == stored_decision
+            summarise(mode, durations, tokens, costs)
+            print(f"{'':<18} failed={failed} agrees_with_stored={agreed / len(queries):.1%}")
+
+        if records:
+            summarise("stored (staged)", [record["duration"] for record in records],
+                      [record["tokens_used_for_chemical_composition"] + record["tokens_used_for_analysis"]
+                       for record in records], [record["total_cost"] for record in records])
+
+        differing = [(material, decisions["staged"][material], decisions["combined"][material])
+                     for material, _, _ in queries if decisions["staged"][material] != decisions["combined"][material]]
+        print(f"modes agree on {1 - len(differing) / len(queries):.1%} of {len(queries)} materials")
+        for material, staged, combined in differing:
+            print(f"    {material}: staged={staged} combined={combined}")
+
+
+if __name__ == '__main__':
+    main()
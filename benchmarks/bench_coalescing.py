@@ -0,0 +1,78 @@
+"""
+Measures how many LLM calls request coalescing saves when the same materials are queried concurrently.
+
+Every round sends --concurrency queries at once, spread over --materials distinct materials, from threads (sync
+path) and as tasks (async path). A local fake OpenAI server answers after a fixed delay and counts the calls it
+received. Caches are disabled, so without coalescing every query makes both LLM calls; with it each material
+is analysed once per round.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_coalescing --rounds 5 --concurrency 20 --materials 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_speculation import configure_environment
+
+
+def material(index, materials, round_index):
+    return f"Coalesced Material {round_index}-{index % materials}"
+
+
+def run_sync(engine, args):
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for round_index in range(args.rounds):
+            list(executor.map(lambda index: engine.query(material(index, args.materials, round_index)),
+                              range(args.concurrency)))
+
+
+async def run_async(engine, args):
+    for round_index in range(args.rounds):
+        await asyncio.gather(*(engine.aquery(material(index, args.materials, f"async-{round_index}"))
+                               for index in range(args.concurrency)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20, help="Queries sent at once per round")
+    parser.add_argument("--materials", type=int, default=4, help="Distinct materials per round")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--fake-port", type=int, default=8916)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args.fake_port, directory)
+        sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+        from benchmarks.fake_openai_server import start_in_thread
+        from ask_viridium_ai.ask_viridium_ai import AskViridium
+        from global_constants import GlobalConstants
+
+        server = start_in_thread(args.fake_port, latency=args.latency)
+        queries = args.rounds * args.concurrency
+        for path in ["sync", "async"]:
+            for enabled in [False, True]:
+                GlobalConstants.coalescing["enabled"] = enabled
+                engine = AskViridium()
+                calls_before = server.requests
+                start = time.perf_counter()
+                if path == "sync":
+                    run_sync(engine, args)
+                else:
+                    asyncio.run(run_async(engine, args))
+                elapsed = time.perf_counter() - start
+                stats = engine.coalescer.stats() if engine.coalescer else {"coalesce_ratio": 0.0}
+                print(f"{path:<6} coalescing={'on' if enabled else 'off':<4} queries={queries:<5} "
+                      f"llm_calls={server.requests - calls_before:<5} coalesce_ratio={stats['coalesce_ratio']:<7} "
+                      f"elapsed={elapsed:6.2f} s", flush=True)
+
+
+if __name__ == '__main__':
+    main()
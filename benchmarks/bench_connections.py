@@ -0,0 +1,119 @@
+"""
+Measures connection reuse of the LLM calls against a local TLS stub of Azure OpenAI.
+
+The fake OpenAI server is served over HTTPS with a self-signed certificate, and counts the connections clients
+open. The same queries run with three pool settings of the engine's HTTP clients:
+
+    no keep-alive: every call opens a new TLS connection, as when each request built its own client.
+    5 s keep-alive: the OpenAI SDK's default, where connections idle for longer than 5 s are closed.
+    pooled: the service's default, LLM_HTTP_KEEPALIVE_SECONDS=120.
+
+Queries are spaced by --idle seconds, the way a worker sees light traffic; the default of 6 s is beyond the
+SDK's 5 s keep-alive. Reported per setting: TLS connections opened per query and query latency. Locally a
+handshake costs a few milliseconds; against Azure each one adds the TCP and TLS round trips, typically
+2 x 20-80 ms depending on the region.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_connections --queries 5 --idle 6
+"""
+
+import argparse
+import datetime
+import ipaddress
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_speculation import configure_environment, percentile
+
+SETTINGS = {
+    "no keep-alive": {"max_keepalive_connections": 0},
+    "5 s keep-alive": {"keepalive_expiry": 5.0},
+    "pooled": dict(),
+}
+
+
+def self_signed_certificate(directory):
+    """
+    Write a self-signed certificate for 127.0.0.1.
+
+    Returns:
+        tuple: Paths of the certificate and of its private key.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1)).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+                       critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certificate_path, key_path = os.path.join(directory, "stub.crt"), os.path.join(directory, "stub.key")
+    with open(certificate_path, "wb") as file:
+        file.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption()))
+    return certificate_path, key_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=5, help="Queries per setting")
+    parser.add_argument("--idle", type=float, default=6.0, help="Seconds between queries")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--fake-port", type=int, default=8915)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args.fake_port, directory)
+        certificate_path, key_path = self_signed_certificate(directory)
+        os.environ.update({"AZURE_OPENAI_ENDPOINT": f"https://127.0.0.1:{args.fake_port}",
+                           "SSL_CERT_FILE": certificate_path})  # Trusted by httpx
+        sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+        from ask_viridium_ai.ask_viridium_ai import AskViridium
+        from benchmarks.fake_openai_server import start_in_thread
+        from global_constants import GlobalConstants
+
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(certificate_path, key_path)
+        server = start_in_thread(args.fake_port, ssl_context=ssl_context, latency=args.latency)
+
+        defaults = dict(GlobalConstants.llm_http)
+        means = dict()
+        print(f"{'setting':<15} {'queries':>7} {'calls':>6} {'connections':>12} {'per query':>10} "
+              f"{'p50 s':>7} {'mean s':>7}")
+        for setting, overrides in SETTINGS.items():
+            GlobalConstants.llm_http.update(defaults, **overrides)
+            engine = AskViridium()
+            requests, connections = server.requests, len(server.connections)
+            durations = list()
+            for index in range(args.queries):
+                start = time.perf_counter()
+                engine.query("Grinding Wheel", "Benchmark Inc.", f"Use case {index}")
+                durations.append(time.perf_counter() - start)
+                time.sleep(args.idle)
+            engine.http_client.close()
+            opened = len(server.connections) - connections
+            means[setting] = statistics.mean(durations)
+            print(f"{setting:<15} {args.queries:7d} {server.requests - requests:6d} {opened:12d} "
+                  f"{opened / args.queries:10.2f} {percentile(durations, 0.5):7.3f} {means[setting]:7.3f}")
+        print(f"latency saved per query by pooling: {1000 * (means['no keep-alive'] - means['pooled']):.1f} ms "
+              f"locally, vs no keep-alive")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures the per-request overhead of building an AskViridium engine versus reusing the shared one.
+
+No LLM call is made: the benchmark only times what the route does before the first request leaves the
+process (prompt loading, AzureChatOpenAI construction, function conversion and binding, logger setup).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_engine_reuse --requests 200
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+# Construction needs Azure settings to be present, but never contacts Azure.
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9/")
+os.environ.setdefault("OPENAI_API_VERSION", "2024-02-01")
+os.environ.setdefault("AZURE_DEPLOYMENT_NAME", "benchmark")
+os.environ.setdefault("AZURE_APP_INSIGHTS_CONNECTION_STRING",
+                      "InstrumentationKey=00000000-0000-0000-0000-000000000000;IngestionEndpoint=http://127.0.0.1:9/")
+
+from ask_viridium_ai.ask_viridium_ai import AskViridium, get_ask_viridium  # noqa: E402
+
+
+def time_calls(func, requests):
+    """Call func once per simulated request and return the per-call durations in milliseconds."""
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def summarise(label, durations):
+    durations = sorted(durations)
+    p95 = durations[int(len(durations) * 0.95) - 1]
+    print(f"{label:<28} mean={statistics.mean(durations):9.3f} ms  p50={statistics.median(durations):9.3f} ms  "
+          f"p95={p95:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Number of simulated requests")
+    args = parser.parse_args()
+
+    summarise("per-request AskViridium()", time_calls(AskViridium, args.requests))
+    get_ask_viridium()  # The first request of a worker pays for construction once
+    summarise("shared get_ask_viridium()", time_calls(get_ask_viridium, args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Checks that logging overhead per request stays flat as requests accumulate.
+
+Each simulated request does what a request to the service does: create an AppInsightsConnector (as modules and
+the engine used to on every request) and log a handful of lines. The per-request time, the number of handlers
+on the logger and the number of live threads are reported for each window of requests; all three should stay
+flat. Console output goes to /dev/null and Azure export to an unreachable local endpoint.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_logging --requests 10000 --window 1000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault("AZURE_APP_INSIGHTS_CONNECTION_STRING",
+                      "InstrumentationKey=00000000-0000-0000-0000-000000000000;IngestionEndpoint=http://127.0.0.1:9/")
+
+from ask_viridium_ai.tracking import AppInsightsConnector  # noqa: E402
+
+LINES_PER_REQUEST = 6
+
+
+def simulate_request(index):
+    logger = AppInsightsConnector().get_logger()
+    logger.info("API REQUEST : POST /v1/ask-viridium-ai")
+    logger.info("Received query: Material=%s, Manufacturer=%s, Work Content=%s", f"Material {index}", "Inc.", None)
+    logger.info("Invoking chemical information chain")
+    logger.info("Invoking analysis chain")
+    logger.info("Results stored in %s", "data_dump/data.jsonl")
+    logger.info("API RESPONSE : 200 OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--window", type=int, default=1000, help="Requests per reported window")
+    args = parser.parse_args()
+
+    results = sys.stdout
+    sys.stderr = open(os.devnull, "w")  # The console handler binds to stderr when first configured
+
+    print(f"{'requests':>10} {'mean us/request':>16} {'p99 us/request':>15} {'handlers':>9} {'threads':>8}",
+          file=results)
+    durations = []
+    for index in range(1, args.requests + 1):
+        start = time.perf_counter()
+        simulate_request(index)
+        durations.append((time.perf_counter() - start) * 1e6)
+        if index % args.window == 0:
+            durations.sort()
+            logger = AppInsightsConnector().get_logger()
+            print(f"{index:>10} {statistics.mean(durations):>16.1f} {durations[int(len(durations) * 0.99)]:>15.1f} "
+                  f"{len(logger.handlers):>9} {threading.active_count():>8}", file=results)
+            durations = []
+
+
+if __name__ == '__main__':
+    main()
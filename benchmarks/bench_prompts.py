@@ -0,0 +1,130 @@
+"""
+Compares the prompt tokens of the full and compact prompt variants.
+
+Offline, every stage's system prompt and function schema is counted with tiktoken's o200k_base encoding, the
+encoding of the gpt-4o deployments, or estimated as characters / 4 where tiktoken cannot fetch it. The static
+prefix is what Azure OpenAI can cache: it must be at least 1024 tokens, and identical across calls, which is
+checked by rendering two different queries.
+
+Then the benchmark materials are queried against a local fake OpenAI server with each variant, and the prompt and
+completion tokens the engine recorded in askvai_stage_tokens_by_kind are reported. The fake server estimates
+tokens as characters / 4 of the messages, so compare the variants with each other rather than with Azure bills.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_prompts --queries 10
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.bench_speculation import MATERIALS, PURE_MATERIALS, configure_environment
+
+STAGES = ["composition", "analysis"]
+INPUTS = {
+    "composition": [{"material": "Grinding Wheel"}, {"material": "Thread Sealant"}],
+    "analysis": [
+        {"material": "Grinding Wheel", "manufacturer": "Norton",
+         "chemical_composition": "Silicon Carbide, Aluminum Oxide"},
+        {"material": "Thread Sealant", "manufacturer": "Loctite",
+         "chemical_composition": "Polytetrafluoroethylene, Mineral Oil"},
+    ],
+}
+
+
+def prefix_length(first, second):
+    """Length of the common prefix of two strings."""
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+def token_counter():
+    """Counts tokens with o200k_base, or estimates them as characters / 4 if the encoding is unavailable."""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return "o200k_base", lambda text: len(encoding.encode(text))
+    except Exception:  # No tiktoken, or no network to download the encoding
+        return "characters / 4", lambda text: len(text) // 4
+
+
+def static_prompts(count_tokens):
+    """Token counts of the static prompt prefix per stage and variant."""
+    from langchain_core.utils.function_calling import convert_to_openai_function
+
+    from models import MaterialComposition, MaterialInfo
+    from ask_viridium_ai.prompts import VARIANTS, build_prompt, system_prompt
+
+    schemas = {"composition": MaterialComposition, "analysis": MaterialInfo}
+    rows = list()
+    for stage in STAGES:
+        schema = json.dumps(convert_to_openai_function(schemas[stage]))
+        for variant in VARIANTS:
+            prompt = build_prompt(stage, variant)
+            first, second = ["\n".join(message.content for message in prompt.format_messages(**inputs))
+                             for inputs in INPUTS[stage]]
+            static = count_tokens(first[:prefix_length(first, second)])
+            system = count_tokens(system_prompt(stage, variant))
+            rows.append((stage, variant, count_tokens(schema), system, static,
+                         first.startswith(system_prompt(stage, variant))))
+    return rows
+
+
+def sampled_tokens(registry, stage, kind):
+    """Sum and count of the tokens recorded for a stage and kind."""
+    labels = {"stage": stage, "kind": kind}
+    total = registry.get_sample_value("askvai_stage_tokens_by_kind_sum", labels) or 0.0
+    calls = registry.get_sample_value("askvai_stage_tokens_by_kind_count", labels) or 0.0
+    return total, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=10, help="Queries per material kind and variant")
+    parser.add_argument("--fake-port", type=int, default=8913)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args.fake_port, directory)
+        sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+        from prometheus_client import REGISTRY
+
+        from benchmarks.fake_openai_server import start_in_thread
+        from ask_viridium_ai.ask_viridium_ai import AskViridium
+        from global_constants import GlobalConstants
+
+        counter, count_tokens = token_counter()
+        print(f"Static prompt tokens, counted with {counter}")
+        print(f"{'stage':<12} {'variant':<8} {'schema':>7} {'system':>7} {'static prefix':>14} {'cacheable':>10}")
+        for stage, variant, schema, system, static, leading in static_prompts(count_tokens):
+            cacheable = leading and schema + static >= 1024
+            print(f"{stage:<12} {variant:<8} {schema:7d} {system:7d} {schema + static:14d} {str(cacheable):>10}")
+
+        start_in_thread(args.fake_port, latency=0.0, pure_materials=PURE_MATERIALS)
+        print(f"\n{'variant':<8} {'stage':<12} {'calls':>6} {'prompt/call':>12} {'completion/call':>16}")
+        for variant in ["full", "compact"]:
+            GlobalConstants.prompts["variant"] = variant
+            engine = AskViridium()
+            before = {(stage, kind): sampled_tokens(REGISTRY, stage, kind)
+                      for stage in STAGES for kind in ["prompt", "completion"]}
+            for index in range(args.queries):
+                for materials in MATERIALS.values():
+                    engine.query(materials[index % len(materials)], "Benchmark Inc.", f"Use case {index}")
+            for stage in STAGES:
+                (prompt, calls), (completion, _) = [
+                    [after - earlier for after, earlier in zip(sampled_tokens(REGISTRY, stage, kind),
+                                                               before[stage, kind])]
+                    for kind in ["prompt", "completion"]]
+                print(f"{variant:<8} {stage:<12} {int(calls):6d} {prompt / max(calls, 1):12.1f} "
+                      f"{completion / max(calls, 1):16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares a burst of queries from several worker processes with and without the shared rate limiter.
+
+A local fake OpenAI server accepts --max-rpm requests per minute and answers the rest 429 with Retry-After, the
+way Azure throttles a deployment. Each worker process runs AskViridium.query from a pool of threads, like a
+gunicorn worker under load. Without the limiter every worker calls the server at once and relies on the OpenAI
+client's retries; with it the workers share one SQLite token bucket set to --limit-rpm and queue their calls.
+Reported per mode: answered and failed queries, queries refused with 429/503, the 429s the server sent and
+the latency of answered queries. Caches are disabled, so every query makes both LLM calls.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_rate_limit --workers 3 --queries 50 --max-rpm 600 --limit-rpm 480
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.load_test_async import service_environment
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def worker(args):
+    """Body of a worker process, printing its outcome counts and latencies as JSON."""
+    from ask_viridium_ai.ask_viridium_ai import get_ask_viridium
+    from utils.exceptions import RateLimitExceededException
+
+    engine = get_ask_viridium()
+
+    def query(index):
+        start = time.perf_counter()
+        try:
+            outcome = engine.query(f"Benchmark Material {os.getpid()}-{index}", "Benchmark Inc.", "Benchmark")
+        except RateLimitExceededException:
+            return "refused", time.perf_counter() - start
+        return ("answered" if outcome.result is not None else "failed"), time.perf_counter() - start
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        outcomes = list(executor.map(query, range(args.queries)))
+    print(json.dumps(outcomes))
+
+
+def run_mode(args, environment, limited):
+    environment = dict(environment, RATE_LIMIT_ENABLED="true" if limited else "false")
+    command = [sys.executable, "-m", "benchmarks.bench_rate_limit", "--worker", "--queries", str(args.queries),
+               "--concurrency", str(args.concurrency)]
+    started = time.perf_counter()
+    workers = [subprocess.Popen(command, env=environment, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True) for _ in range(args.workers)]
+    outcomes = []
+    for process in workers:
+        output, _ = process.communicate()
+        outcomes += json.loads(output.splitlines()[-1])
+    return outcomes, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="Worker processes")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per worker")
+    parser.add_argument("--concurrency", type=int, default=8, help="Threads per worker")
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--max-rpm", type=int, default=600, help="Quota of the fake server")
+    parser.add_argument("--limit-rpm", type=int, default=480, help="Requests per minute of the limiter")
+    parser.add_argument("--max-wait", type=float, default=60, help="Longest queue wait before refusing a query")
+    parser.add_argument("--fake-port", type=int, default=8913)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    from benchmarks.fake_openai_server import start_in_thread
+
+    with tempfile.TemporaryDirectory() as directory:
+        environment = service_environment(args.fake_port, os.path.join(directory, "records.jsonl"))
+        environment.update({"RATE_LIMIT_PATH": os.path.join(directory, "rate_limit.sqlite3"),
+                            "RATE_LIMIT_REQUESTS_PER_MINUTE": str(args.limit_rpm),
+                            "RATE_LIMIT_TOKENS_PER_MINUTE": str(10 ** 7),
+                            "RATE_LIMIT_MAX_WAIT_SECONDS": str(args.max_wait)})
+        server = start_in_thread(args.fake_port, latency=args.latency, max_rpm=args.max_rpm)
+
+        for limited in [False, True]:
+            throttled_before = server.throttled
+            outcomes, elapsed = run_mode(args, environment, limited)
+            server.accepted.clear()  # Give the next mode a fresh quota
+            latencies = [latency for outcome, latency in outcomes if outcome == "answered"]
+            counts = {kind: sum(outcome == kind for outcome, _ in outcomes)
+                      for kind in ["answered", "failed", "refused"]}
+            print(f"limiter={'on' if limited else 'off':<3} answered={counts['answered']:<4} "
+                  f"failed={counts['failed']:<4} refused={counts['refused']:<4} "
+                  f"server 429s={server.throttled - throttled_before:<5} p50={percentile(latencies, 0.5):6.2f} s "
+                  f"p95={percentile(latencies, 0.95):6.2f} s  elapsed={elapsed:6.1f} s", flush=True)
+
+
+if __name__ == '__main__':
+    main()
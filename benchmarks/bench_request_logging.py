@@ -0,0 +1,53 @@
+"""
+Measures the per-request cost of each request logging mode on the Flask entry point.
+
+Requests go through run:app's test client to /v1/ask-viridium-ai with a body that fails validation, so no LLM
+call is made and the time measured is routing, validation and logging. Each request carries a few KB of body
+and an Authorization header, like a real client. Console output goes to /dev/null.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_request_logging --requests 2000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("AZURE_APP_INSIGHTS_CONNECTION_STRING",
+                      "InstrumentationKey=00000000-0000-0000-0000-000000000000;IngestionEndpoint=http://127.0.0.1:9/")
+sys.stderr = open(os.devnull, "w")  # Importing run configures the console handler, which binds to stderr
+
+import run  # noqa: E402
+from ask_viridium_ai.request_logging import RequestLogger  # noqa: E402
+from global_constants import GlobalConstants  # noqa: E402
+
+MODES = [RequestLogger.OFF, RequestLogger.SUMMARY, RequestLogger.SAMPLED, RequestLogger.FULL]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--body-bytes", type=int, default=4096, help="Approximate size of each request body")
+    args = parser.parse_args()
+
+    config = GlobalConstants.request_logging
+    body = {"manufacturer_name": "Benchmark Inc.", "work_content": "x" * args.body_bytes}
+    headers = {"Authorization": "Bearer secret-token", "User-Agent": "benchmark"}
+    client = run.app.test_client()
+
+    print(f"{'mode':>8} {'us/request':>11}", file=sys.stdout)
+    for mode in MODES:
+        run.request_logger = RequestLogger(run.logger, mode, config.sample_ratio, config.max_body_bytes,
+                                           config.redacted_headers)
+        for _ in range(100):  # Warm up
+            client.post("/v1/ask-viridium-ai", json=body, headers=headers)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            client.post("/v1/ask-viridium-ai", json=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        print(f"{mode:>8} {elapsed / args.requests * 1e6:>11.1f}", file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
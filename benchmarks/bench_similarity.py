@@ -0,0 +1,105 @@
+"""
+Measures the lookup latency of the similarity index over a large number of past analyses.
+
+A record store is filled with --materials synthetic analyses, with names built from chemistry words so their
+trigrams overlap the way real material names do, spread over --manufacturers manufacturers. The index is built
+from it once, then --lookups queries are timed: rewordings of stored names (word order shuffled, a word
+dropped, different case and punctuation), which should be found, and unseen names, which should not. Reported:
+build time, lookup latency percentiles, hit ratio per kind and the share of hits that returned the material
+the query was derived from.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_similarity --materials 1000000 --lookups 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+WORDS = ["acetone", "acrylic", "adhesive", "alloy", "aluminum", "amine", "anhydrous", "argon", "barium", "base",
+         "bisphenol", "black", "blend", "brass", "bronze", "butyl", "calcium", "carbide", "carbon", "cast",
+         "cement", "ceramic", "chloride", "chromium", "cleaner", "coating", "cobalt", "compound", "copper",
+         "cryogenic", "cutting", "degreaser", "diluent", "dioxide", "emulsion", "enamel", "epoxy", "ethanol",
+         "ethylene", "fiber", "film", "fluid", "fluoro", "foam", "gas", "glass", "glycol", "graphite", "grease",
+         "hardener", "helium", "hydraulic", "hydrogen", "ink", "iron", "isopropyl", "lacquer", "liquid",
+         "lubricant", "magnesium", "methyl", "mold", "nickel", "nitrogen", "nylon", "oil", "oxide", "oxygen",
+         "paint", "paste", "phenolic", "polyamide", "polyester", "polymer", "potassium", "powder", "primer",
+         "propane", "resin", "rubber", "sealant", "silica", "silicone", "silver", "sodium", "solder", "solvent",
+         "stainless", "steel", "sulfate", "tape", "thinner", "tin", "titanium", "toluene", "urethane", "varnish",
+         "vinyl", "wax", "xylene", "zinc"]
+
+
+def synthetic_name(rng, index):
+    """A name of 2-4 chemistry words and a grade, unique per index."""
+    words = rng.sample(WORDS, rng.randint(2, 4))
+    return f"{' '.join(word.title() for word in words)} {index % 9973}"
+
+
+def reworded(rng, name):
+    """The same material named differently: shuffled words, other case and punctuation."""
+    words = name.split()
+    rng.shuffle(words)
+    return ", ".join(words).upper()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--materials", type=int, default=1000000, help="Past analyses in the index")
+    parser.add_argument("--manufacturers", type=int, default=200)
+    parser.add_argument("--lookups", type=int, default=2000, help="Timed lookups, half of them rewordings")
+    parser.add_argument("--min-similarity", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+    from ask_viridium_ai.similarity import SimilarityIndex
+    from ask_viridium_ai.storage import RecordStore
+
+    rng = random.Random(args.seed)
+    result = {"decision": "PFAS (No)", "reasoning": "Synthetic"}
+    names = [synthetic_name(rng, index) for index in range(args.materials)]
+    manufacturers = [f"Manufacturer {index % args.manufacturers}" for index in range(args.materials)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = RecordStore(os.path.join(directory, "records.jsonl"))
+        store.extend({"material": name, "manufacturer": manufacturer, "result": result}
+                     for name, manufacturer in zip(names, manufacturers))
+        index = SimilarityIndex(store, min_similarity=args.min_similarity)
+        start = time.perf_counter()
+        index.refresh()
+        print(f"indexed {index.snapshot.size} materials in {time.perf_counter() - start:.1f} s", flush=True)
+
+        timings = {"reworded": [], "unseen": []}
+        hits = {"reworded": 0, "unseen": 0}
+        correct = 0
+        for lookup in range(args.lookups):
+            target = rng.randrange(args.materials)
+            if lookup % 2 == 0:
+                kind, name = "reworded", reworded(rng, names[target])
+            else:
+                kind, name = "unseen", synthetic_name(rng, args.materials + lookup)
+            start = time.perf_counter()
+            match = index.lookup(name, manufacturers[target])
+            timings[kind].append(time.perf_counter() - start)
+            if match is not None:
+                hits[kind] += 1
+                correct += kind == "reworded" and match[0]["material"] == names[target]
+
+        for kind, values in timings.items():
+            print(f"{kind:<9} lookups={len(values):<5} hit_ratio={hits[kind] / len(values):<6.3f} "
+                  f"p50={percentile(values, 0.5) * 1000:6.2f} ms p99={percentile(values, 0.99) * 1000:6.2f} ms",
+                  flush=True)
+        print(f"reworded hits returning the original material: {correct}/{hits['reworded']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares query latency with and without speculative analysis.
+
+A local fake OpenAI server answers every LLM call after a fixed delay. Pure materials such as "Nitrogen, Cryogenic
+Liquid" come back as themselves, so their speculative analysis is accepted. Mixtures with a short name come back
+as something else, so their speculation is discarded. Long trade names are never speculated on. Caches are
+disabled, so every query makes its LLM calls.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_speculation --queries 30 --latency 0.3
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PURE_MATERIALS = ["Nitrogen", "Argon", "Isopropyl Alcohol", "Acetone"]
+MATERIALS = {
+    "pure": ["Nitrogen, Cryogenic Liquid", "Argon, Compressed Gas", "Isopropyl Alcohol", "Acetone"],
+    "mixture": ["Grinding Wheel", "Cutting Fluid", "Thread Sealant"],
+    "trade name": ["TRIM TC 184B", "0652-W Nylon/ 30655-W nylon with CPT Sealant"],
+}
+
+
+def configure_environment(fake_port, directory):
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{fake_port}",
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "OPENAI_API_VERSION": "2024-02-01",
+        "AZURE_DEPLOYMENT_NAME": "benchmark",
+        "AZURE_APP_INSIGHTS_CONNECTION_STRING": "",
+        "RESULT_CACHE_ENABLED": "false",
+        "COMPOSITION_CACHE_ENABLED": "false",
+        "RECORD_STORE_PATH": os.path.join(directory, "records.jsonl"),
+    })
+
+
+def percentile(durations, fraction):
+    durations = sorted(durations)
+    return durations[min(len(durations) - 1, int(len(durations) * fraction))]
+
+
+def run_sync(engine, queries):
+    """Latencies in seconds per material kind, querying one material at a time."""
+    latencies = {kind: [] for kind in MATERIALS}
+    for index in range(queries):
+        for kind, materials in MATERIALS.items():
+            start = time.perf_counter()
+            engine.query(materials[index % len(materials)], "Benchmark Inc.", f"Use case {index}")
+            latencies[kind].append(time.perf_counter() - start)
+    return latencies
+
+
+async def run_async(engine, queries):
+    """Async version of run_sync."""
+    latencies = {kind: [] for kind in MATERIALS}
+    for index in range(queries):
+        for kind, materials in MATERIALS.items():
+            start = time.perf_counter()
+            await engine.aquery(materials[index % len(materials)], "Benchmark Inc.", f"Use case {index}")
+            latencies[kind].append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=30, help="Queries per material kind and mode")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--fake-port", type=int, default=8912)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args.fake_port, directory)
+        sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+        from benchmarks.fake_openai_server import start_in_thread
+        from ask_viridium_ai.ask_viridium_ai import AskViridium
+        from global_constants import GlobalConstants
+
+        start_in_thread(args.fake_port, latency=args.latency, pure_materials=PURE_MATERIALS)
+        print(f"{'path':<6} {'speculation':<12} {'material':<11} {'p50 s':>7} {'p95 s':>7} {'mean s':>7}")
+        for path in ["sync", "async"]:
+            for enabled in [False, True]:
+                GlobalConstants.speculation["enabled"] = enabled
+                engine = AskViridium()
+                if path == "sync":
+                    latencies = run_sync(engine, args.queries)
+                else:
+                    latencies = asyncio.run(run_async(engine, args.queries))
+                for kind, durations in latencies.items():
+                    print(f"{path:<6} {'on' if enabled else 'off':<12} {kind:<11} {percentile(durations, 0.5):7.3f} "
+                          f"{percentile(durations, 0.95):7.3f} {statistics.mean(durations):7.3f}")
+                if engine.speculation:
+                    time.sleep(args.latency * 2)  # Let discarded analyses finish so their tokens are counted
+                    print(f"{path:<6} speculation stats: {engine.speculation.stats()}")
+
+
+if __name__ == '__main__':
+    main()
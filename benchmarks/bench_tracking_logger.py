@@ -0,0 +1,86 @@
+"""
+Compares tracking.Logger with the row-by-row pd.concat logger it replaced.
+
+Both loggers log the same rows of a typical query and save them to a CSV in a temporary directory. For each row
+count the time per row, the total time and the peak memory traced by tracemalloc are reported. The time per row
+of the concat logger grows with the rows already logged, so it is only run up to --legacy-max rows.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_tracking_logger --rows 1000 10000 100000 --chunk-rows 10000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import pandas as pd
+
+from ask_viridium_ai.tracking import Logger
+
+
+class ConcatLogger:
+    """The previous tracking.Logger: one pd.concat per logged row, the whole frame written on save."""
+
+    def __init__(self):
+        self.df = pd.DataFrame(columns=Logger().columns)
+
+    def log(self, info):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)  # Concatenating to the empty initial frame
+            self.df = pd.concat([self.df, pd.DataFrame(info, index=[0])])
+
+    def save(self, filename):
+        self.df.to_csv(filename, index=False)
+
+
+def row(index):
+    return {"time": time.time(), "user_id": index % 50, "material_name": f"Material {index}",
+            "tokens_used_for_chemical_composition": 850, "cost_chemical_composition": 0.0042,
+            "tokens_used_for_analysis": 1900, "cost_analysis": 0.0095, "total_cost": 0.0137,
+            "chemical_composition": "Polytetrafluoroethylene; Silicon carbide", "PFAS_status": "PFAS (Yes)"}
+
+
+def log_rows(logger, rows, filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+    start = time.perf_counter()
+    for index in range(rows):
+        logger.log(row(index))
+    logger.save(filename)
+    return time.perf_counter() - start
+
+
+def measure(factory, rows, filename):
+    """Time a run, then repeat it under tracemalloc for the peak memory, which tracing would otherwise slow."""
+    elapsed = log_rows(factory(), rows, filename)
+    tracemalloc.start()
+    log_rows(factory(), rows, filename)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--chunk-rows", type=int, default=10000, help="Rows buffered before a chunk is written")
+    parser.add_argument("--legacy-max", type=int, default=10000, help="Largest row count for the concat logger")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "log.csv")
+        for rows in args.rows:
+            loggers = [("buffered", lambda: Logger(filename, args.chunk_rows))]
+            if rows <= args.legacy_max:
+                loggers.insert(0, ("concat", ConcatLogger))
+            for name, factory in loggers:
+                elapsed, peak_mb = measure(factory, rows, filename)
+                print(f"{name:<9} rows={rows:<7} {elapsed / rows * 1e6:8.1f} us/row  total={elapsed:7.2f} s  "
+                      f"peak={peak_mb:7.1f} MB", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Evaluates the fluorine pre-screen against the decisions the analysis call made on past queries.
+
+The labelled set is drawn from data_dump/data.json, and optionally a record store: every past analysis with a
+composition and a decision. Its label is the LLM's decision. Entries that only kept the MaterialInfo have their
+chemicals split out of its composition field, without CAS numbers. Because the past queries hold no PFAS, a
+few hand-labelled fluorinated compositions are added as controls, reported separately; the pre-screen must
+never clear them.
+
+Reported: entries the pre-screen decided as PFAS (No), i.e. analysis calls saved, and its precision against
+the LLM's decision, with and without the CAS reference, plus every disagreement.
+
+Usage (from the repository root):
+    python -m benchmarks.eval_prescreen --data data_dump/data.json --records data_dump/data.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+CONTROLS = [
+    ("PTFE thread seal tape", [{"name": "Polytetrafluoroethylene", "cas_no": "9002-84-0"}]),
+    ("Teflon coated wire", [{"name": "Copper", "cas_no": "7440-50-8"}, {"name": "Teflon FEP", "cas_no": None}]),
+    ("Fluoroelastomer O-ring", [{"name": "Viton", "cas_no": None}, {"name": "Carbon Black", "cas_no": "1333-86-4"}]),
+    ("PVDF membrane", [{"name": "PVDF", "cas_no": "24937-79-9"}]),
+    ("Firefighting foam", [{"name": "Water", "cas_no": "7732-18-5"}, {"name": "Perfluorohexanoic acid",
+                                                                       "cas_no": "307-24-4"}]),
+    ("Lubricant", [{"name": "Perfluoropolyether oil", "cas_no": None}]),
+]
+
+
+def labelled_entries(data_path, records_path=None):
+    """
+    Past analyses with a composition and a decision.
+
+    Returns:
+        list: (material, chemicals, LLM decision) per entry.
+    """
+    entries = list()
+    with open(data_path) as file:
+        stored = json.load(file)
+    if records_path and os.path.exists(records_path):
+        with open(records_path) as file:
+            stored += [json.loads(line) for line in file if line.strip()]
+
+    for entry in stored:
+        if "result" in entry:  # A full record
+            result = entry["result"] or dict()
+            chemicals = ((entry.get("chemical_composition") or dict()).get("chemicals")) or list()
+            if entry.get("cached") or entry.get("coalesced") or entry.get("similar_to"):
+                continue  # Repeats of another entry
+        else:  # A bare MaterialInfo
+            result = entry
+            chemicals = [{"name": name.strip(), "cas_no": None}
+                         for name in (result.get("composition") or "").split(",") if name.strip()]
+        if result.get("decision") and chemicals and result.get("composition") != "Undetermined":
+            entries.append((result.get("analyzed_material") or entry.get("material"), chemicals, result["decision"]))
+    return entries
+
+
+def evaluate(prescreen, entries):
+    """Decisions of the pre-screen on the entries, and the entries it got wrong."""
+    decided, wrong = 0, list()
+    for material, chemicals, label in entries:
+        result = prescreen.screen(material, {"chemicals": chemicals})
+        if result is not None:
+            decided += 1
+            if label != result["decision"]:
+                wrong.append((material, [chemical["name"] for chemical in chemicals], label))
+    return decided, wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data_dump/data.json", help="Past analyses, read only")
+    parser.add_argument("--records", default=None, help="Record store with further past analyses")
+    args = parser.parse_args()
+
+    sys.stderr = open(os.devnull, "w")  # Keep the engine's console logging out of the report
+
+    from ask_viridium_ai.prescreen import PreScreen
+    from ask_viridium_ai.reference import CasReference
+    from global_constants import GlobalConstants
+
+    entries = labelled_entries(args.data, args.records)
+    controls = [(material, chemicals, "PFAS (Yes)") for material, chemicals in CONTROLS]
+    with tempfile.TemporaryDirectory() as directory:
+        reference = CasReference.load(directory, GlobalConstants.cas_reference.source)
+        for name, prescreen in [("names only", PreScreen()), ("with CAS reference", PreScreen(reference))]:
+            decided, wrong = evaluate(prescreen, entries)
+            precision = (decided - len(wrong)) / decided if decided else 0.0
+            cleared_controls = evaluate(prescreen, controls)[0]
+            print(f"{name:<19} entries={len(entries):<4} decided={decided:<4} "
+                  f"analysis_calls_saved={decided / len(entries) if entries else 0.0:<7.1%} "
+                  f"precision={precision:<6.3f} controls_cleared={cleared_controls}/{len(controls)}")
+            for material, chemicals, label in wrong:
+                print(f"    disagreement: {material}: {', '.join(chemicals)} (LLM: {label})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Local stand-in for the Azure OpenAI chat completions API, used to benchmark the service without spending tokens.
+
+It answers every chat completion with a canned function call matching the function the caller bound
+(MaterialComposition, MaterialInfo or both for MaterialAssessment), after a configurable delay, optionally
+growing with the length of the answer the way generation time does. Materials listed as pure are given
+themselves as their only chemical, the way the real model answers for pure chemicals. A configurable share of
+requests fails with an error status instead, to exercise retries and error handling. With a requests-per-minute
+quota, requests beyond it are answered 429 with Retry-After, the way Azure throttles a deployment: like Azure,
+the quota is enforced over 10 second windows, so a deployment of 600 requests per minute accepts 100 per 10 s.
+Given an SSL context it serves HTTPS, and it counts the connections its clients open.
+
+Usage (from the repository root):
+    python -m benchmarks.fake_openai_server --port 8910 --latency 0.5 --error-rate 0.05 --error-status 429
+
+Then point the service at it:
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8910 AZURE_OPENAI_API_KEY=benchmark gunicorn run:app
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from aiohttp import web
+
+from global_constants import GlobalConstants
+
+CANNED_ARGUMENTS = {
+    "MaterialComposition": {
+        "product_name": "Vitrified Bonded Stick",
+        "chemicals": [
+            {"name": "Silicon Carbide", "cas_no": "409-21-2", "source": "https://pubchem.ncbi.nlm.nih.gov/"},
+            {"name": "Aluminum Oxide", "cas_no": "1344-28-1", "source": "https://pubchem.ncbi.nlm.nih.gov/"},
+        ],
+        "confidence": 1,
+    },
+    "MaterialInfo": dict(GlobalConstants.analysis_example, confidence=0.9),
+}
+
+
+class FakeOpenAIServer:
+    """aiohttp application imitating the chat completions endpoint of an Azure OpenAI deployment."""
+
+    def __init__(self, latency=0.5, model="gpt-4o", pure_materials=(), error_rate=0.0, error_status=500,
+                 max_rpm=None, token_latency=0.0):
+        """
+        Args:
+            latency (float): Seconds to wait before answering each completion.
+            model (str): Model name reported back, used by get_openai_callback to price the call.
+            pure_materials (Iterable[str]): Material names, before any comma, whose composition is themselves.
+            error_rate (float): Share of completions answered with error_status instead.
+            error_status (int): HTTP status of injected failures, e.g. 500 or 429.
+            max_rpm (Optional[int]): Requests per minute accepted, enforced as max_rpm / 6 in any 10 second window;
+                None for no quota.
+            token_latency (float): Further seconds to wait per completion token answered.
+        """
+        self.latency = latency
+        self.model = model
+        self.pure_materials = set(pure_materials)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_rpm = max_rpm
+        self.token_latency = token_latency
+        self.requests = 0
+        self.connections = set()  # Client addresses seen, one per connection the clients opened
+        self.errors = 0
+        self.throttled = 0
+        self.accepted = deque()  # Times of the requests accepted in the last window
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/openai/deployments/{deployment}/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+    async def chat_completions(self, request):
+        payload = await request.json()
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        if self.max_rpm is not None:
+            now = time.monotonic()
+            while self.accepted and self.accepted[0] <= now - 10:
+                self.accepted.popleft()
+            if len(self.accepted) >= self.max_rpm / 6:
+                self.throttled += 1
+                retry_after = self.accepted[0] + 10 - now
+                return web.json_response(
+                    {"error": {"message": "Rate limit exceeded", "type": "rate_limit", "code": "429"}}, status=429,
+                    headers={"retry-after": str(int(retry_after) + 1), "retry-after-ms": str(int(retry_after * 1000))})
+            self.accepted.append(now)
+
+        function_name = (payload.get("function_call") or {}).get("name") or payload["functions"][0]["name"]
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in payload["messages"]) // 4
+        arguments = json.dumps(self.arguments(function_name, payload["messages"]))
+        completion_tokens = len(arguments) // 4
+        await asyncio.sleep(self.latency + self.token_latency * completion_tokens)
+
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "Injected failure", "type": "server_error",
+                                                "code": str(self.error_status)}}, status=self.error_status)
+
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": None,
+                            "function_call": {"name": function_name, "arguments": arguments}},
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+    def arguments(self, function_name, messages):
+        """The function call arguments answering a request."""
+        if function_name == "MaterialAssessment":
+            return {"chemical_composition": self.arguments("MaterialComposition", messages),
+                    "analysis": self.arguments("MaterialInfo", messages)}
+        if function_name == "MaterialComposition":
+            material = str(messages[-1].get("content", "")).removeprefix("Material Name: ").split(",")[0].strip()
+            if material in self.pure_materials:
+                return {"product_name": material, "chemicals": [{"name": material, "cas_no": None, "source": None}],
+                        "confidence": 1}
+        return CANNED_ARGUMENTS.get(function_name, {})
+
+
+def start_in_thread(port, ssl_context=None, **kwargs):
+    """
+    Run the fake server on a background thread.
+
+    Args:
+        port (int): Port to listen on.
+        ssl_context (Optional[ssl.SSLContext]): Serve HTTPS with this context instead of plain HTTP.
+        **kwargs: Passed to FakeOpenAIServer.
+
+    Returns:
+        FakeOpenAIServer: The running server, whose request counter can be inspected.
+    """
+    server = FakeOpenAIServer(**kwargs)
+    started = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(server.app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port, ssl_context=ssl_context).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8910)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds to wait before each completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of completions that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected failures")
+    parser.add_argument("--max-rpm", type=int, help="Requests per minute accepted before answering 429")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Further seconds per completion token")
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.latency, error_rate=args.error_rate, error_status=args.error_status,
+                              max_rpm=args.max_rpm, token_latency=args.token_latency)
+    web.run_app(server.app(), host="127.0.0.1", port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
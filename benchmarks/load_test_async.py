@@ -0,0 +1,132 @@
+"""
+Load test comparing the sync (run:app) and async (asgi:app) request paths of /v1/ask-viridium-ai.
+
+A local fake OpenAI server answers every LLM call after a fixed delay, and each entry point is started under
+gunicorn with a single worker. Caches are disabled so every request makes both LLM calls.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test_async --concurrency 50 --duration 20 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fake_openai_server import start_in_thread
+
+ENTRY_POINTS = {
+    "sync": ["run:app"],
+    "async": ["-k", "uvicorn.workers.UvicornWorker", "asgi:app"],
+}
+
+
+def service_environment(fake_port, record_store_path):
+    """Environment pointing the service at the fake server, with caches off and records kept out of the repo."""
+    environment = dict(os.environ)
+    environment.update({
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{fake_port}",
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "OPENAI_API_VERSION": "2024-02-01",
+        "AZURE_DEPLOYMENT_NAME": "benchmark",
+        "AZURE_APP_INSIGHTS_CONNECTION_STRING":
+            "InstrumentationKey=00000000-0000-0000-0000-000000000000;IngestionEndpoint=http://127.0.0.1:9/",
+        "RESULT_CACHE_ENABLED": "false",
+        "COMPOSITION_CACHE_ENABLED": "false",
+        "RECORD_STORE_PATH": record_store_path,
+    })
+    return environment
+
+
+def start_service(mode, port, environment, workers):
+    command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+               "--timeout", "120", *ENTRY_POINTS[mode]]
+    return subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/v1/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"{base_url} did not become ready")
+
+
+async def drive(base_url, concurrency, duration):
+    """
+    Keep `concurrency` requests in flight for `duration` seconds.
+
+    Returns:
+        tuple: Number of successful and failed requests, the per-request latencies of the successful ones and
+            the wall time until the last request finished.
+    """
+    started = time.monotonic()
+    deadline = started + duration
+    latencies, failures = [], 0
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async def client(session, index):
+        nonlocal failures
+        request_number = 0
+        while time.monotonic() < deadline:
+            request_number += 1
+            body = {"material_name": f"Material {index}-{request_number}", "manufacturer_name": "Benchmark Inc."}
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{base_url}/v1/ask-viridium-ai", json=body) as response:
+                    await response.read()
+                    if response.status == 200:
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        failures += 1
+            except aiohttp.ClientError:
+                failures += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(client(session, index) for index in range(concurrency)))
+    return len(latencies), failures, latencies, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of sustained load per entry point")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers per entry point")
+    parser.add_argument("--fake-port", type=int, default=8910)
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--modes", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    args = parser.parse_args()
+
+    start_in_thread(args.fake_port, latency=args.latency)
+    with tempfile.TemporaryDirectory() as directory:
+        environment = service_environment(args.fake_port, os.path.join(directory, "records.jsonl"))
+        for mode in args.modes:
+            service = start_service(mode, args.port, environment, args.workers)
+            base_url = f"http://127.0.0.1:{args.port}"
+            try:
+                asyncio.run(wait_until_ready(base_url))
+                succeeded, failed, latencies, elapsed = asyncio.run(
+                    drive(base_url, args.concurrency, args.duration))
+            finally:
+                service.terminate()
+                service.wait()
+            mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+            print(f"{mode:<6} {succeeded / elapsed:8.2f} req/s  ok={succeeded:<6} failed={failed:<6} "
+                  f"mean latency={mean_latency:6.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Offline benchmark suite for Ask Viridium AI Service.
+
+Starts the fake OpenAI server (benchmarks/fake_openai_server.py) with a configurable latency and error rate, then
+runs each scenario against it without spending Azure tokens:
+
+    engine          AskViridium.query called in-process from a pool of threads
+    gunicorn-sync   POST /v1/ask-viridium-ai on run:app under gunicorn
+    gunicorn-async  POST /v1/ask-viridium-ai on asgi:app under gunicorn with uvicorn workers
+    experiment      experiment/experiment_multithreaded.py over generated material data
+
+Each scenario reports throughput, p50/p95/p99 latency, the number of failed queries and resident memory (per
+worker for gunicorn). Caches are disabled, so every query makes both LLM calls. With --json the results are
+saved; with --baseline they are compared to a saved run and the suite exits with status 1 if throughput,
+p95 latency or memory regressed by more than --tolerance.
+
+Usage (from the repository root):
+    python -m benchmarks.run_suite --latency 0.3 --error-rate 0.02 --requests 200 --concurrency 20
+    python -m benchmarks.run_suite --json benchmarks/baseline.json
+    python -m benchmarks.run_suite --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import pandas as pd
+
+from benchmarks.load_test_async import ENTRY_POINTS, service_environment, start_service, wait_until_ready
+
+SCENARIOS = ["engine", "gunicorn-sync", "gunicorn-async", "experiment"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def summary(latencies, failures, elapsed, memory_mb):
+    """The figures reported for a scenario, with latencies in seconds and memory in MB."""
+    return {
+        "requests": len(latencies) + failures,
+        "failed": failures,
+        "req_per_s": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50": round(percentile(latencies, 0.50), 3),
+        "p95": round(percentile(latencies, 0.95), 3),
+        "p99": round(percentile(latencies, 0.99), 3),
+        "memory_mb": round(memory_mb, 1),
+    }
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB, read from /proc."""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child_pids(pid):
+    """Direct children of a process, e.g. the workers of a gunicorn master."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return children
+
+
+def start_fake_server(port, latency, error_rate, error_status):
+    """Run the fake OpenAI server in its own process so it does not skew the memory of the scenarios."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai_server", "--port", str(port), "--latency", str(latency),
+         "--error-rate", str(error_rate), "--error-status", str(error_status)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise TimeoutError("The fake OpenAI server did not start")
+
+
+def material(index):
+    return f"Benchmark Material {index}"
+
+
+def run_engine(args, environment):
+    """
+    AskViridium.query from a pool of threads, in a child process started with the benchmark environment so the
+    settings read at import time and the memory figure are its own.
+    """
+    command = [sys.executable, "-m", "benchmarks.run_suite", "--engine-worker", "--requests", str(args.requests),
+               "--concurrency", str(args.concurrency)]
+    output = subprocess.run(command, env=environment, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            check=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def engine_worker(args):
+    """Body of the engine scenario, printing its summary as JSON."""
+    from ask_viridium_ai.ask_viridium_ai import get_ask_viridium
+
+    engine = get_ask_viridium()
+
+    def query(index):
+        start = time.perf_counter()
+        outcome = engine.query(material(index), "Benchmark Inc.", "Benchmark")
+        return time.perf_counter() - start, outcome.result is not None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        outcomes = list(executor.map(query, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, succeeded in outcomes if succeeded]
+    print(json.dumps(summary(latencies, len(outcomes) - len(latencies), elapsed, rss_mb(os.getpid()))))
+
+
+async def drive(base_url, requests, concurrency):
+    """
+    Send `requests` queries with `concurrency` in flight.
+
+    Returns:
+        tuple: Latencies of the successful queries, the number of failed ones and the elapsed wall time.
+    """
+    latencies, failures = [], 0
+    next_index = iter(range(requests))
+
+    async def client(session):
+        nonlocal failures
+        for index in next_index:
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{base_url}/v1/ask-viridium-ai", json={
+                        "material_name": material(index), "manufacturer_name": "Benchmark Inc."}) as response:
+                    body = await response.json(content_type=None)
+                succeeded = response.status == 200 and body.get("result") is not None
+            except (aiohttp.ClientError, ValueError):
+                succeeded = False
+            if succeeded:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failures += 1
+
+    started = time.perf_counter()
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency), timeout=timeout) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - started
+
+
+def run_gunicorn(mode, args, environment):
+    """The Flask or ASGI entry point under gunicorn; memory is the mean resident size of its workers."""
+    service = start_service(mode, args.port, environment, args.workers)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        latencies, failures, elapsed = asyncio.run(drive(base_url, args.requests, args.concurrency))
+        workers = child_pids(service.pid)
+        memory = sum(rss_mb(pid) for pid in workers) / len(workers) if workers else 0.0
+    finally:
+        service.terminate()
+        service.wait()
+    return summary(latencies, failures, elapsed, memory)
+
+
+def write_experiment_data(directory, materials):
+    """Material tables in the layout experiment_multithreaded.py reads, every material pending analysis."""
+    os.makedirs(directory, exist_ok=True)
+    pd.DataFrame({"id": range(materials), "name": [material(index) for index in range(materials)],
+                  "pfas_status": "PENDING", "manufacturer_id": [index % 10 for index in range(materials)]}
+                 ).to_csv(os.path.join(directory, "global_node.csv"), index=False)
+    pd.DataFrame({"id": range(10), "name": [f"Manufacturer {index}" for index in range(10)]}
+                 ).to_csv(os.path.join(directory, "manufacturer.csv"), index=False)
+    pd.DataFrame({"material_id": range(materials)}
+                 ).to_csv(os.path.join(directory, "material_to_document_mapping.csv"), index=False)
+
+
+def run_experiment(args, environment, directory):
+    """
+    The experiment script as a subprocess. Latencies are the query durations it leaves in the record store; for
+    its batched queries that is the time until their chunk finished.
+    """
+    data_dir = os.path.join(directory, "experiment")
+    write_experiment_data(data_dir, args.requests)
+    environment = dict(environment, EXPERIMENT_DATA_DIR=data_dir, EXPERIMENT_OUTPUT_DIR=data_dir,
+                       EXPERIMENT_SAMPLE_SIZE=str(args.requests),
+                       RECORD_STORE_PATH=os.path.join(data_dir, "records.jsonl"))
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "experiment.experiment_multithreaded",
+                                "--max-concurrency", str(args.concurrency)], env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError("experiment_multithreaded.py failed")
+
+    latencies, failures = [], 0
+    with open(environment["RECORD_STORE_PATH"]) as records:
+        for line in records:
+            record = json.loads(line)
+            if record["result"] is None:
+                failures += 1
+            else:
+                latencies.append(record["duration"])
+    return summary(latencies, failures, elapsed, usage.ru_maxrss / 1024)
+
+
+def regressions(results, baseline, tolerance):
+    """Figures that got worse than the baseline by more than the tolerance."""
+    found = []
+    for scenario, figures in results.items():
+        before = baseline.get(scenario)
+        if not before:
+            continue
+        if figures["req_per_s"] < before["req_per_s"] * (1 - tolerance):
+            found.append(f"{scenario}: req/s {before['req_per_s']} -> {figures['req_per_s']}")
+        for figure in ["p95", "memory_mb"]:
+            if figures[figure] > before[figure] * (1 + tolerance):
+                found.append(f"{scenario}: {figure} {before[figure]} -> {figures[figure]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="Queries per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Queries in flight")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake LLM latency per call, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of LLM calls that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of failed LLM calls")
+    parser.add_argument("--fake-port", type=int, default=8910)
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--json", help="Save the results to this file")
+    parser.add_argument("--baseline", help="Compare with results saved by an earlier --json run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--engine-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine_worker:
+        engine_worker(args)
+        return
+
+    fake_server = start_fake_server(args.fake_port, args.latency, args.error_rate, args.error_status)
+    results = dict()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            environment = service_environment(args.fake_port, os.path.join(directory, "records.jsonl"))
+            for scenario in args.scenarios:
+                if scenario == "engine":
+                    results[scenario] = run_engine(args, environment)
+                elif scenario == "experiment":
+                    results[scenario] = run_experiment(args, environment, directory)
+                else:
+                    mode = scenario.split("-", 1)[1]
+                    assert mode in ENTRY_POINTS
+                    results[scenario] = run_gunicorn(mode, args, environment)
+                figures = results[scenario]
+                print(f"{scenario:<15} {figures['req_per_s']:8.2f} req/s  p50={figures['p50']:6.3f} s  "
+                      f"p95={figures['p95']:6.3f} s  p99={figures['p99']:6.3f} s  "
+                      f"failed={figures['failed']:<4} memory={figures['memory_mb']:7.1f} MB", flush=True)
+    finally:
+        fake_server.terminate()
+        fake_server.wait()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
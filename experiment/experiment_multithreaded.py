@@ -1,86 +1,188 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import pandas as pd
-from ask_viridium_ai import AskViridium
-from tracking import ExperimentLogger
+"""
+Bulk PFAS classification of the PENDING materials in the global_node export.
+
+The material, manufacturer and document mapping tables are joined once. Materials are then classified in chunks
+through AskViridium.query_batch, which runs the LLM calls with bounded concurrency and reuses cached results.
+Each finished chunk is appended to the output CSV and synced to disk, so the output doubles as the checkpoint:
+rerunning the same command skips every material already classified and continues where a crashed or
+interrupted run stopped. Materials whose analysis failed are retried on the next run; their new row is appended
+after the failed one, so readers should keep the last row per material_id.
+
+As in the original experiment, the first half of the materials is classified without the manufacturer name and
+the second half with it (see --manufacturer).
+
+Usage (from the repository root):
+    python -m experiment.experiment_multithreaded --data-dir data --output experiment_results.csv
+    python -m experiment.experiment_multithreaded --sample-size 10 --max-concurrency 4
+"""
+
+import argparse
+import csv
+import os
 import time
 
-# Loading dataframes
-global_node = pd.read_csv('data/global_node.csv')
-manufacturer = pd.read_csv('data/manufacturer.csv')
-material_to_document_mapping = pd.read_csv('data/material_to_document_mapping.csv')
-
-# Extracting relevant dfs with pfas_status as PENDING
-pending_materials = global_node[global_node['pfas_status'] == 'PENDING']
-material_ids = material_to_document_mapping[material_to_document_mapping['material_id'].isin(pending_materials['id'])][
-    'material_id']
-material_names = pending_materials.loc[pending_materials['id'].isin(material_ids), 'name']
-
-manufacturer_ids = pending_materials.loc[pending_materials['id'].isin(material_ids), 'manufacturer_id']
-manufacturer_names = manufacturer.loc[manufacturer['id'].isin(manufacturer_ids), 'name']
-
-# Create our own dataframe
-df = pd.DataFrame({"material_name": material_names, "manufacturer_ids": manufacturer_ids})
-
-# Limit to 10 materials
-df = df.sample(n=10, random_state=1).reset_index(drop=True)
-
-askai = AskViridium()
-
-
-def process_material(row, include_manufacturer):
-    logger = ExperimentLogger()
-    final_results = {}
-
-    mn = row['material_name']
-    manu_id = row['manufacturer_ids']
-    manu_name = manufacturer.loc[manufacturer['id'] == manu_id, "name"].values[0]
-    material_id = global_node.loc[global_node['name'] == mn, "id"].values[0]
-    service_pfas_status = global_node.loc[global_node['name'] == mn, "pfas_status"].values[0]
-
-    if include_manufacturer:
-        res = askai.query(material_name=mn, manufacturer_name=manu_name)
-    else:
-        res = askai.query(material_name=mn)
-
-    decision = res.get("decision", "UNKNOWN")
-    if decision == "PFAS (No)":
-        decision = "NO"
-    elif decision == "PFAS (Yes)":
-        decision = "YES"
-
-    final_results["material_id"] = material_id
-    final_results["manufacturer_id"] = manu_id
-    final_results["manufacturer_name"] = manu_name
-    final_results["modified_service_pfas_status"] = decision
-    final_results["material_name"] = mn
-    final_results["current_service_pfas_status"] = service_pfas_status
-
-    logger.log(final_results)
+import pandas as pd
 
-    if include_manufacturer:
-        logger.save("second_half_experiment_logs.csv")
+from ask_viridium_ai.ask_viridium_ai import get_ask_viridium
+from global_constants import GlobalConstants
+
+OUTPUT_COLUMNS = ["material_id", "material_name", "manufacturer_id", "manufacturer_name", "include_manufacturer",
+                  "current_service_pfas_status", "modified_service_pfas_status", "cached", "error"]
+DECISIONS = {"PFAS (No)": "NO", "PFAS (Yes)": "YES"}
+
+
+def load_pending_materials(data_dir, sample_size=None, manufacturer_mode="half"):
+    """
+    Join the input tables into one row per PENDING material that has documents.
+
+    Args:
+        data_dir (str): Directory holding global_node.csv, manufacturer.csv and material_to_document_mapping.csv.
+        sample_size (Optional[int]): Classify only this many materials, sampled reproducibly.
+        manufacturer_mode (str): "half" to pass the manufacturer for the second half of the materials only,
+            "all" or "none".
+
+    Returns:
+        pandas.DataFrame: The materials in a stable order, with their manufacturer and include_manufacturer flag.
+    """
+    global_node = pd.read_csv(os.path.join(data_dir, "global_node.csv"),
+                              usecols=["id", "name", "pfas_status", "manufacturer_id"])
+    manufacturer = pd.read_csv(os.path.join(data_dir, "manufacturer.csv"), usecols=["id", "name"])
+    mapping = pd.read_csv(os.path.join(data_dir, "material_to_document_mapping.csv"), usecols=["material_id"])
+
+    pending = global_node[(global_node["pfas_status"] == "PENDING")
+                          & global_node["id"].isin(mapping["material_id"].unique())]
+    materials = pending.merge(manufacturer.drop_duplicates("id").rename(columns={"id": "manufacturer_id",
+                                                                                 "name": "manufacturer_name"}),
+                              on="manufacturer_id", how="left")
+    materials = materials.rename(columns={"id": "material_id", "name": "material_name",
+                                          "pfas_status": "current_service_pfas_status"})
+    materials = materials.drop_duplicates("material_id")
+
+    if sample_size is not None and sample_size < len(materials):
+        materials = materials.sample(n=sample_size, random_state=1)
+    materials = materials.reset_index(drop=True)
+
+    if manufacturer_mode == "half":
+        materials["include_manufacturer"] = materials.index >= len(materials) // 2
     else:
-        logger.save("first_half_experiment_logs.csv")
-
-    return final_results
-
-
-rn = time.perf_counter()
-
-# First half without manufacturer info
-first_half = df.iloc[:len(df) // 2]
-
-with ThreadPoolExecutor() as executor:
-    futures = [executor.submit(process_material, row, False) for _, row in first_half.iterrows()]
-    for future in as_completed(futures):
-        print(future.result())
-
-# Second half with manufacturer info
-second_half = df.iloc[len(df) // 2:]
-
-with ThreadPoolExecutor() as executor:
-    futures = [executor.submit(process_material, row, True) for _, row in second_half.iterrows()]
-    for future in as_completed(futures):
-        print(future.result())
-
-print(f"took {time.perf_counter() - rn} seconds")
+        materials["include_manufacturer"] = manufacturer_mode == "all"
+    return materials
+
+
+def completed_material_ids(output):
+    """
+    Materials already classified by earlier runs, read back from the output.
+
+    Args:
+        output (str): The output CSV.
+
+    Returns:
+        set: Ids of materials whose last row has no error.
+    """
+    if not os.path.exists(output) or os.path.getsize(output) == 0:
+        return set()
+    rows = pd.read_csv(output, usecols=["material_id", "error"], dtype={"error": "string"})
+    last = rows.drop_duplicates("material_id", keep="last")
+    return set(last.loc[last["error"].isna(), "material_id"])
+
+
+def classify_chunk(engine, chunk, max_concurrency):
+    """
+    Classify a chunk of materials with one query_batch.
+
+    Args:
+        engine (AskViridium): The shared engine.
+        chunk (pandas.DataFrame): Rows of load_pending_materials.
+        max_concurrency (int): Maximum number of LLM calls in flight.
+
+    Returns:
+        list: One output row per material.
+    """
+    items = [{"material_name": row.material_name,
+              "manufacturer_name": row.manufacturer_name
+              if row.include_manufacturer and pd.notna(row.manufacturer_name) else None,
+              "work_content": None}
+             for row in chunk.itertuples()]
+    results, _ = engine.query_batch(items, max_concurrency)
+
+    rows = []
+    for row, outcome in zip(chunk.itertuples(), results):
+        decision = (outcome["result"] or {}).get("decision")
+        rows.append({
+            "material_id": row.material_id,
+            "material_name": row.material_name,
+            "manufacturer_id": row.manufacturer_id,
+            "manufacturer_name": row.manufacturer_name,
+            "include_manufacturer": row.include_manufacturer,
+            "current_service_pfas_status": row.current_service_pfas_status,
+            "modified_service_pfas_status": DECISIONS.get(decision, "UNKNOWN"),
+            "cached": outcome["cached"],
+            "error": outcome["error"],
+        })
+    return rows
+
+
+def append_rows(output, rows):
+    """Append rows to the output CSV and sync them to disk, writing the header for a new file."""
+    new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+    with open(output, "a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=OUTPUT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def run(data_dir, output, sample_size=None, manufacturer_mode="half", chunk_size=200, max_concurrency=8):
+    """
+    Classify every pending material not already in the output.
+
+    Returns:
+        dict: Counts of classified and failed materials and the elapsed time.
+    """
+    materials = load_pending_materials(data_dir, sample_size, manufacturer_mode)
+    done = completed_material_ids(output)
+    remaining = materials[~materials["material_id"].isin(done)]
+    print(f"{len(materials)} pending materials, {len(materials) - len(remaining)} already classified, "
+          f"{len(remaining)} to go", flush=True)
+
+    engine = get_ask_viridium()
+    start = time.perf_counter()
+    classified = failed = 0
+    for offset in range(0, len(remaining), chunk_size):
+        rows = classify_chunk(engine, remaining.iloc[offset:offset + chunk_size], max_concurrency)
+        append_rows(output, rows)
+
+        classified += len(rows)
+        failed += sum(row["error"] is not None for row in rows)
+        elapsed = time.perf_counter() - start
+        rate = classified / elapsed if elapsed else 0.0
+        eta = (len(remaining) - classified) / rate if rate else 0.0
+        print(f"{classified}/{len(remaining)} classified ({failed} failed), {rate:.2f} materials/s, "
+              f"ETA {eta / 60:.1f} min", flush=True)
+
+    return {"classified": classified, "failed": failed, "elapsed": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=os.getenv("EXPERIMENT_DATA_DIR", "data"))
+    parser.add_argument("--output", default=os.path.join(os.getenv("EXPERIMENT_OUTPUT_DIR", "."),
+                                                         "experiment_results.csv"))
+    parser.add_argument("--sample-size", type=int, default=os.getenv("EXPERIMENT_SAMPLE_SIZE"),
+                        help="Classify a reproducible sample of this many materials instead of all of them")
+    parser.add_argument("--manufacturer", choices=["half", "all", "none"], default="half",
+                        help="Which materials are queried with their manufacturer name")
+    parser.add_argument("--chunk-size", type=int, default=200, help="Materials per batch and checkpoint")
+    parser.add_argument("--max-concurrency", type=int, default=GlobalConstants.batch.max_concurrency,
+                        help="LLM calls in flight")
+    args = parser.parse_args()
+
+    summary = run(args.data_dir, args.output, args.sample_size, args.manufacturer, args.chunk_size,
+                  args.max_concurrency)
+    print(f"took {summary['elapsed']:.1f} seconds", flush=True)
+
+
+if __name__ == '__main__':
+    main()
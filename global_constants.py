@@ -72,6 +72,7 @@ class GlobalConstants(DotAccessDict):
     api_status_codes = {
         "ok": 200,
         "created": 201,
+        "accepted": 202,
         "no_content": 204,
         "bad_request": 400,
         "unauthorized": 401,
@@ -81,6 +82,7 @@ class GlobalConstants(DotAccessDict):
         "conflict": 409,
         "internal_server_error": 500,
         "service_unavailable": 503,
+        "gateway_timeout": 504,
         "rate_limit_exceeded": 429,
     }
     api_status_codes = DotAccessDict(api_status_codes)
@@ -97,8 +99,12 @@ class GlobalConstants(DotAccessDict):
         "conflict": "Conflict with current state of the resource",
         "internal_server_error": "Internal server error occurred",
         "service_unavailable": "Service temporarily unavailable",
+        "rate_limit_exceeded": "Too many requests, please retry later",
+        "deadline_exceeded": "Deadline exceeded before the analysis finished",
         "server_is_running": "Ask Viridium AI Service is running",
         "missing_required_parameters": "Missing required parameters",
+        "batch_too_large": "Too many items in batch",
+        "job_not_found": "Job not found",
         "error_while_processing_file": "Error while processing file",
     }
 
@@ -128,6 +134,149 @@ class GlobalConstants(DotAccessDict):
         "limitations_and_uncertainties": None
     }
 
+    prompts = {
+        "variant": os.getenv("PROMPT_VARIANT", "full"),  # full or compact
+    }
+    prompts = DotAccessDict(prompts)
+
+    query_mode = os.getenv("QUERY_MODE", "staged")  # staged (composition, then analysis) or combined (one LLM call)
+
+    batch = {
+        "max_items": int(os.getenv("BATCH_MAX_ITEMS", 500)),
+        "max_concurrency": int(os.getenv("BATCH_MAX_CONCURRENCY", 8)),
+    }
+    batch = DotAccessDict(batch)
+
+    job_queue = {
+        "path": os.getenv("JOB_QUEUE_PATH", "data_dump/jobs.sqlite3"),
+        "workers": int(os.getenv("JOB_WORKERS", 4)),
+        "poll_interval": float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 1.0)),
+        "visibility_timeout": int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", 600)),
+        "retention_seconds": int(os.getenv("JOB_RETENTION_SECONDS", 24 * 60 * 60)),
+        "max_queued": int(os.getenv("JOB_MAX_QUEUED", 10000)),
+        "max_requeues": int(os.getenv("JOB_MAX_REQUEUES", 10)),  # While Azure is saturated or failing
+    }
+    job_queue = DotAccessDict(job_queue)
+
+    record_store_path = os.getenv("RECORD_STORE_PATH", "data_dump/data.jsonl")
+
+    result_cache = {
+        "enabled": os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true",
+        "path": os.getenv("RESULT_CACHE_PATH", "data_dump/result_cache.sqlite3"),
+        "ttl_seconds": int(os.getenv("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60)),
+        "max_entries": int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 100000)),
+        "memory_entries": int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", 1024)),
+        "stale_seconds": int(os.getenv("RESULT_CACHE_STALE_SECONDS", 30 * 24 * 60 * 60)),  # Kept for the breaker
+    }
+    result_cache = DotAccessDict(result_cache)
+
+    composition_cache = {
+        "enabled": os.getenv("COMPOSITION_CACHE_ENABLED", "true").lower() == "true",
+        "path": os.getenv("COMPOSITION_CACHE_PATH", "data_dump/composition_cache.sqlite3"),
+        "ttl_seconds": int(os.getenv("COMPOSITION_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60)),
+        "max_entries": int(os.getenv("COMPOSITION_CACHE_MAX_ENTRIES", 100000)),
+        "memory_entries": int(os.getenv("COMPOSITION_CACHE_MEMORY_ENTRIES", 1024)),
+    }
+    composition_cache = DotAccessDict(composition_cache)
+
+    llm_http = {
+        "max_connections": int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100)),
+        "max_keepalive_connections": int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)),
+        "keepalive_expiry": float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", 120)),  # Idle time before a close
+        "http2": os.getenv("LLM_HTTP2_ENABLED", "true").lower() == "true",  # Needs the h2 package
+        "connect_timeout": float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 10)),
+        "default_timeout": float(os.getenv("LLM_TIMEOUT_SECONDS", 120)),
+        "composition_timeout": float(os.getenv("LLM_COMPOSITION_TIMEOUT_SECONDS", 60)),
+        "analysis_timeout": float(os.getenv("LLM_ANALYSIS_TIMEOUT_SECONDS", 90)),
+        "combined_timeout": float(os.getenv("LLM_COMBINED_TIMEOUT_SECONDS", 120)),
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", 2)),  # Retries of failed calls by the OpenAI SDK
+    }
+    llm_http = DotAccessDict(llm_http)
+
+    deadline = {
+        "default_seconds": float(os.getenv("REQUEST_DEADLINE_SECONDS", 120)),
+        "max_seconds": float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", 300)),  # Longest deadline a request may ask
+        "min_call_seconds": float(os.getenv("REQUEST_DEADLINE_MIN_CALL_SECONDS", 2)),  # Time a call needs to start
+    }
+    deadline = DotAccessDict(deadline)
+
+    circuit_breaker = {
+        "enabled": os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true",
+        "failure_ratio": float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATIO", 0.5)),
+        "min_calls": int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", 10)),  # Calls in the window before it may open
+        "window_seconds": float(os.getenv("CIRCUIT_BREAKER_WINDOW_SECONDS", 60)),
+        "open_seconds": float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", 30)),  # Time before probing Azure again
+        "half_open_probes": int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", 1)),
+    }
+    circuit_breaker = DotAccessDict(circuit_breaker)
+
+    rate_limit = {
+        "enabled": os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true",
+        "path": os.getenv("RATE_LIMIT_PATH", "data_dump/rate_limit.sqlite3"),
+        "requests_per_minute": int(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", 360)),
+        "tokens_per_minute": int(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", 60000)),
+        "max_wait": float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", 30)),
+        "max_retries": int(os.getenv("RATE_LIMIT_MAX_RETRIES", 3)),
+        "backoff_seconds": float(os.getenv("RATE_LIMIT_BACKOFF_SECONDS", 1.0)),
+        "estimated_tokens": int(os.getenv("RATE_LIMIT_ESTIMATED_TOKENS", 1500)),
+    }
+    rate_limit = DotAccessDict(rate_limit)
+
+    coalescing = {
+        "enabled": os.getenv("COALESCING_ENABLED", "true").lower() == "true",
+        "across_workers": os.getenv("COALESCING_ACROSS_WORKERS", "false").lower() == "true",  # Needs the result cache
+        "path": os.getenv("COALESCING_PATH", "data_dump/flights.sqlite3"),
+        "poll_interval": float(os.getenv("COALESCING_POLL_INTERVAL_SECONDS", 0.2)),
+        "lease_seconds": float(os.getenv("COALESCING_LEASE_SECONDS", 120)),
+    }
+    coalescing = DotAccessDict(coalescing)
+
+    similarity = {
+        "enabled": os.getenv("SIMILARITY_LOOKUP_ENABLED", "false").lower() == "true",
+        "min_similarity": float(os.getenv("SIMILARITY_MIN_SCORE", 0.9)),  # Cosine similarity of the names
+        "top_k": int(os.getenv("SIMILARITY_TOP_K", 5)),
+        "max_postings": int(os.getenv("SIMILARITY_MAX_POSTINGS", 50000)),
+        "refresh_interval": float(os.getenv("SIMILARITY_REFRESH_SECONDS", 5.0)),
+    }
+    similarity = DotAccessDict(similarity)
+
+    cas_reference = {
+        "enabled": os.getenv("CAS_REFERENCE_ENABLED", "false").lower() == "true",
+        "source": os.getenv("CAS_REFERENCE_SOURCE", "ask_viridium_ai/reference_data/cas_reference.csv"),
+        "path": os.getenv("CAS_REFERENCE_PATH", "data_dump/cas_reference"),  # Compiled arrays
+        "skip_analysis": os.getenv("CAS_REFERENCE_SKIP_ANALYSIS", "true").lower() == "true",
+    }
+    cas_reference = DotAccessDict(cas_reference)
+
+    prescreen = {
+        "enabled": os.getenv("PRESCREEN_ENABLED", "false").lower() == "true",
+    }
+    prescreen = DotAccessDict(prescreen)
+
+    speculation = {
+        "enabled": os.getenv("SPECULATIVE_ANALYSIS_ENABLED", "false").lower() == "true",
+        "max_words": int(os.getenv("SPECULATIVE_ANALYSIS_MAX_WORDS", 3)),
+        "min_similarity": float(os.getenv("SPECULATIVE_ANALYSIS_MIN_SIMILARITY", 1.0)),
+        "max_in_flight": int(os.getenv("SPECULATIVE_ANALYSIS_MAX_IN_FLIGHT", 8)),
+    }
+    speculation = DotAccessDict(speculation)
+
+    metrics = {
+        "multiprocess_dir": os.getenv("PROMETHEUS_MULTIPROC_DIR"),  # Set by gunicorn.conf.py under gunicorn
+    }
+    metrics = DotAccessDict(metrics)
+
+    request_logging = {
+        "mode": os.getenv("REQUEST_LOG_MODE", "summary").lower(),
+        "sample_ratio": float(os.getenv("REQUEST_LOG_SAMPLE_RATIO", 0.01)),
+        "max_body_bytes": int(os.getenv("REQUEST_LOG_MAX_BODY_BYTES", 2048)),
+        "redacted_headers": os.getenv(
+            "REQUEST_LOG_REDACT_HEADERS",
+            "authorization,proxy-authorization,cookie,set-cookie,api-key,x-api-key,ocp-apim-subscription-key"
+        ).split(","),
+    }
+    request_logging = DotAccessDict(request_logging)
+
     model_name = os.getenv("AZURE_MODEL_NAME")
     deployment_name = os.getenv("AZURE_DEPLOYMENT_NAME")
     azure_app_insights_connector = os.getenv("AZURE_APP_INSIGHTS_CONNECTION_STRING")
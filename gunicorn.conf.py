@@ -0,0 +1,32 @@
+"""
+gunicorn settings, loaded automatically from the working directory by `gunicorn run:app` and `gunicorn asgi:app`.
+
+Sets up Prometheus multiprocess mode so /v1/metrics reports the sum over all workers rather than the numbers of
+whichever worker answers the scrape.
+"""
+
+import os
+import shutil
+import tempfile
+
+# Must be set before any worker imports prometheus_client, which picks its storage when first imported
+default_metrics_directory = "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"askvai-metrics-{os.getpid()}"))
+
+
+def on_starting(server):
+    """Start from an empty metrics directory; files left by a previous run would be summed in."""
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited; its counters and histograms keep counting."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if default_metrics_directory:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
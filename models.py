@@ -28,3 +28,9 @@ class MaterialInfo(BaseModel):
     recommendation: str = Field(description="Recommendation of what to do with the material with regards to its PFAS compliance.")
     suggestion: str = Field(description="Suggestion of what to do with the material with regards to its PFAS compliance.")
     limitations_and_uncertainties: str = Field(description="Limitations and uncertainties based on the data")
+
+
+class MaterialAssessment(BaseModel):
+    """Composition and PFAS analysis of a material, returned together by a single call."""
+    chemical_composition: MaterialComposition = Field(description="Chemical composition of the material")
+    analysis: MaterialInfo = Field(description="PFAS analysis of the material based on that composition")
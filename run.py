@@ -1,14 +1,17 @@
+import time
 from http.client import HTTPException
 
 from dotenv import load_dotenv
 
-from flask import Flask, jsonify, redirect, request
+from flask import Flask, g, jsonify, redirect, request
 from flask_cors import CORS
 from apispec import APISpec
 from flask_swagger_ui import get_swaggerui_blueprint
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
 
+from ask_viridium_ai import metrics
+from ask_viridium_ai.request_logging import get_request_logger
 from ask_viridium_ai.routes import MainRoutes
 from ask_viridium_ai.tracking import AppInsightsConnector
 
@@ -22,6 +25,7 @@ app = Flask(__name__)
 CORS(app)
 
 logger = AppInsightsConnector().get_logger()
+request_logger = get_request_logger(logger)
 
 main_routes = MainRoutes()
 app.register_blueprint(main_routes.blueprint, url_prefix=GlobalConstants.api_version)
@@ -40,7 +44,12 @@ with app.test_request_context():
     for view in [
         main_routes.home,
         main_routes.ask_viridium_ai,
+        main_routes.ask_viridium_ai_stream,
+        main_routes.ask_viridium_ai_batch,
+        main_routes.submit_job,
+        main_routes.get_job,
         main_routes.health_check,
+        main_routes.get_metrics,
     ]:
         spec.path(view=view)
 
@@ -64,16 +73,38 @@ def create_swagger_spec():
 
 
 @app.before_request
-def log_request_info():
-    logger.info(f"API REQUEST : {request.method} {request.path} - Headers: {dict(request.headers)} - Body: {request.get_data()}")
+def track_request():
+    g.request_log_detail = request_logger.detail()
+    g.request_start = time.perf_counter()
+    metrics.HTTP_IN_PROGRESS.inc()
+    if g.request_log_detail == request_logger.FULL:
+        request_logger.log_request(g.request_log_detail, request.method, request.path,
+                                   request.headers.items(), request.get_data())
 
 
 @app.after_request
-def log_response_info(response):
-    logger.info(f"API RESPONSE : {response.status} - Headers: {dict(response.headers)}")
+def track_response(response):
+    duration = time.perf_counter() - g.request_start
+    metrics.HTTP_DURATION.labels(request.method, request.url_rule.rule if request.url_rule else "unmatched",
+                                 response.status_code).observe(duration)
+    detail = g.get("request_log_detail")
+    if detail is None:
+        return response
+    size = None if response.is_streamed else response.calculate_content_length()
+    if detail == request_logger.FULL:
+        request_logger.log_response(detail, request.method, request.path, response.status, duration, size,
+                                    response.headers.items(), None if response.is_streamed else response.get_data())
+    else:
+        request_logger.log_response(detail, request.method, request.path, response.status, duration, size)
     return response
 
 
+@app.teardown_request
+def end_request(_):
+    if "request_start" in g:
+        metrics.HTTP_IN_PROGRESS.dec()
+
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     # Pass through HTTP errors
@@ -98,32 +98,37 @@ function handleAskAIClick() {
 
     showSpinner();
 
-    fetch('/v1/ask-viridium-ai', {
+    const payload = {
+        material_name: materialNameInput.value,
+        manufacturer_name: manufacturerInput.value,
+        work_content: workContentInput.value,
+        additional_info: additional_info
+    };
+
+    // Stream the query: the chemical composition is shown as soon as it is found, then the analysis
+    fetch('/v1/ask-viridium-ai/stream', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({
-            material_name: materialNameInput.value,
-            manufacturer_name: manufacturerInput.value,
-            work_content: workContentInput.value,
-            additional_info: additional_info
-        })
+        body: JSON.stringify(payload)
     })
     .then(response => {
         if (!response.ok) {
             throw new Error("Error in network response");
         }
-        return response.json();
-    })
-    .then(data => {
-        displayMessage('AI', data.result, JSON.stringify({
-            material_name: materialNameInput.value,
-            manufacturer_name: manufacturerInput.value,
-            work_content: workContentInput.value,
-            additional_info: additional_info
-        }));
-        enableChat();
+        return readStream(response, event => {
+            if (event.stage === 'composition') {
+                displayMessage('AI', event.result ? {
+                    chemical_composition: event.result.chemicals.map(chemical => `${chemical.name} (CAS ${chemical.cas_no})`)
+                } : 'Chemical composition could not be found, analysing by name.');
+            } else if (event.stage === 'analysis') {
+                displayMessage('AI', event.result, JSON.stringify(payload));
+                enableChat();
+            } else if (event.stage === 'error') {
+                throw new Error(event.message);
+            }
+        });
     })
     .catch(error => {
         console.error('Error:', error);
@@ -134,6 +139,28 @@ function handleAskAIClick() {
     });
 }
 
+function readStream(response, onEvent) {
+    // Calls onEvent for each line of an NDJSON response as it arrives
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    function read() {
+        return reader.read().then(({ done, value }) => {
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim() !== '').forEach(line => onEvent(JSON.parse(line)));
+            if (done) {
+                return;
+            }
+            return read();
+        });
+    }
+
+    return read();
+}
+
 function displayMessage(sender, message, prompt = null) {
     const chatWindow = document.querySelector('.chat-messages');
     const messageElement = document.createElement('div');
@@ -1,3 +1,24 @@
 class MaxProcessingTimeExceededException(Exception):
     def __init__(self, message="Max processing time limit reached!", details=None):
         super().__init__(message, details)
+
+
+class JobQueueFullException(Exception):
+    def __init__(self, message="Job queue is full!", details=None):
+        super().__init__(message, details)
+
+
+class RateLimitExceededException(Exception):
+    def __init__(self, message="Rate limit exceeded!", details=None, retry_after=None):
+        super().__init__(message, details)
+        self.retry_after = retry_after  # Seconds the client should wait before retrying
+
+
+class UpstreamThrottledException(RateLimitExceededException):
+    def __init__(self, message="Azure OpenAI is throttling requests!", details=None, retry_after=None):
+        super().__init__(message, details, retry_after)
+
+
+class CircuitOpenException(RateLimitExceededException):
+    def __init__(self, message="Azure OpenAI is failing, circuit open!", details=None, retry_after=None):
+        super().__init__(message, details, retry_after)